@@ -1,25 +1,253 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import (Flask, render_template, request, redirect, url_for, session, jsonify, flash, g, has_request_context,
+                   stream_with_context, send_file, abort)
 from flask_sqlalchemy import SQLAlchemy
+import click
 from werkzeug.security import generate_password_hash, check_password_hash
 import requests
 import datetime
 import sqlite3
 import os
+import socket
 import re
 import json
+import threading
+import time
+import uuid
+import atexit
+import bisect
+import logging
+import sys
+import html
+import gzip
+import zlib
+import hashlib
+import mimetypes
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from contextlib import contextmanager
 from json import JSONDecodeError
+from queue import Queue, Empty
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import safe_join
+
+try:
+    import zstandard  # Nav obligāta: bez tās čatu arhīvs tiek saspiests ar zlib
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli  # Nav obligāta: bez tās statiskie faili un atbildes tiek saspiesti tikai ar gzip
+except ImportError:
+    brotli = None
 
 # Flask aplikācijas inicializācija
 app = Flask(__name__)
 
 # Aplikācijas konfigurācija
 app.config['SECRET_KEY'] = 'a1b2c3d4e5f678901q34x67890abcdefa1b2c3d4e5f6789012e4567890abcdef'  # Slepenā atslēga sesiju šifrēšanai
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///chatbot.db'  # SQLite datubāzes atrašanās vieta
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///chatbot.db')  # SQLite datubāzes atrašanās vieta
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Atslēdz SQLAlchemy brīdinājumus
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()  # WAL režīmā NORMAL ir drošs un daudz ātrāks par FULL
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 65536))  # Lapu kešatmiņa katram savienojumam (KiB)
+app.config['SQLITE_MMAP_SIZE'] = int(os.environ.get('SQLITE_MMAP_SIZE', 268435456))  # Atmiņā kartētās datubāzes daļas apjoms (baiti)
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))  # Cik ilgi gaidīt rakstīšanas slēdzeni
+app.config['DB_WRITE_BATCH_SIZE'] = int(os.environ.get('DB_WRITE_BATCH_SIZE', 500))  # Maksimālais operāciju skaits vienā grupas commit
+app.config['DB_WRITE_BATCH_WAIT'] = float(os.environ.get('DB_WRITE_BATCH_WAIT', 0.005))  # Cik ilgi rakstītājs gaida nākamās operācijas vienai transakcijai
+app.config['MODEL_CACHE_TTL'] = int(os.environ.get('MODEL_CACHE_TTL', 30))  # Sekundes, cik ilgi modeļu katalogs skaitās svaigs
+app.config['MODEL_FETCH_TIMEOUT'] = float(os.environ.get('MODEL_FETCH_TIMEOUT', 3))  # Taimauts modeļu saraksta pieprasījumam
+app.config['LOG_LEVEL'] = os.environ.get('LOG_LEVEL', 'INFO').upper()  # Žurnāla detalizācijas līmenis
+app.config['LOG_FORMAT'] = os.environ.get('LOG_FORMAT', 'json')  # 'json' (viena JSON rinda katram notikumam) vai 'text'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # Ja norādīts, /metrics pieprasa "Authorization: Bearer <token>"
+
+
+class StructuredLogFormatter(logging.Formatter):
+    """
+    Formatē žurnāla ierakstus ar strukturētiem laukiem
+    Lauki tiek padoti caur extra={...}; JSON formātā katrs notikums ir viena rinda
+    """
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def __init__(self, as_json=True):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = {key: value for key, value in vars(record).items() if key not in self.RESERVED}
+        timestamp = datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z'
+        if self.as_json:
+            entry = {'ts': timestamp, 'level': record.levelname, 'logger': record.name, 'msg': record.getMessage()}
+            entry.update(fields)
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, ensure_ascii=False, default=str)
+        text = f"{timestamp} {record.levelname} {record.getMessage()}"
+        if fields:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            text += '\n' + self.formatException(record.exc_info)
+        return text
+
+
+# Aplikācijas žurnāls (standarta kļūdu izvadē)
+logger = logging.getLogger('app')
+_log_handler = logging.StreamHandler(sys.stderr)
+_log_handler.setFormatter(StructuredLogFormatter(as_json=app.config['LOG_FORMAT'] != 'text'))
+logger.addHandler(_log_handler)
+logger.setLevel(app.config['LOG_LEVEL'])
+logger.propagate = False
+
+
+class Metric:
+    """
+    Prometheus metrika ar iezīmēm (vērtības tiek glabātas atmiņā, katram procesam atsevišķi)
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}        # iezīmju vērtību kortežs -> vērtība
+        self.lock = threading.Lock()
+
+    def format_labels(self, values, extra=None):
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, self.format_labels(key), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Skaitītājs, kas tikai pieaug"""
+    kind = 'counter'
+
+    def inc(self, *labels, value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    """
+    Mērītājs, kura vērtības tiek nolasītas nolasīšanas brīdī
+    Parametri:
+        collect: funkcija, kas atgriež {iezīmju vērtību kortežs: vērtība}
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), collect=None):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def samples(self):
+        values = self.collect() if self.collect else {}
+        return [(self.name, self.format_labels(key), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    """Vērtību sadalījums pa intervāliem (latentumiem, ātrumiem)"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self.values.items()]
+        result = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                result.append((f"{self.name}_bucket", self.format_labels(key, ('le', repr(float(bound)))), cumulative))
+            result.append((f"{self.name}_bucket", self.format_labels(key, ('le', '+Inf')), count))
+            result.append((f"{self.name}_sum", self.format_labels(key), round(total, 6)))
+            result.append((f"{self.name}_count", self.format_labels(key), count))
+        return result
+
+
+class MetricsRegistry:
+    """Visu metriku saraksts /metrics atbildei"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+metrics = MetricsRegistry()
+REQUEST_DURATION = metrics.register(Histogram(
+    'http_request_duration_seconds', "HTTP pieprasījumu apstrādes laiks (straumēm - līdz atbildes sākumam)",
+    ('method', 'route', 'status')))
+REQUEST_DB_QUERIES = metrics.register(Histogram(
+    'http_request_db_queries', "SQL vaicājumu skaits vienā HTTP pieprasījumā", ('route',),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100)))
+REQUEST_DB_SECONDS = metrics.register(Histogram(
+    'http_request_db_seconds', "Kopējais SQL vaicājumu laiks vienā HTTP pieprasījumā", ('route',)))
+DB_QUERY_DURATION = metrics.register(Histogram(
+    'db_query_duration_seconds', "Atsevišķu SQL vaicājumu izpildes laiks", ('statement',),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1)))
+UPSTREAM_DURATION = metrics.register(Histogram(
+    'upstream_request_duration_seconds', "LM Studio pieprasījumu laiks līdz atbildes galvenēm", ('backend', 'path')))
+UPSTREAM_ERRORS = metrics.register(Counter(
+    'upstream_errors_total', "Neveiksmīgi LM Studio pieprasījumi", ('backend', 'path', 'kind')))
+GENERATION_TTFT = metrics.register(Histogram(
+    'generation_time_to_first_token_seconds', "Laiks no ģenerācijas pieprasījuma līdz pirmajam tokenam (ieskaitot rindu)",
+    ('model',), buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60)))
+GENERATION_TOKENS_PER_SECOND = metrics.register(Histogram(
+    'generation_tokens_per_second', "Ģenerācijas ātrums (tokeni sekundē)", ('model',),
+    buckets=(1, 5, 10, 20, 30, 50, 75, 100, 200)))
+GENERATION_TOKENS = metrics.register(Counter(
+    'generation_tokens_total', "Ģenerēto tokenu (straumes fragmentu) skaits", ('model',)))
+GENERATIONS = metrics.register(Counter(
+    'generations_total', "Pabeigtās ģenerācijas pēc rezultāta", ('model', 'status')))
+MODEL_WARMUPS = metrics.register(Counter(
+    'model_warmups_total', "Modeļu iesildīšanas pieprasījumi pēc rezultāta", ('model', 'result')))
+COMPLETION_CACHE_REQUESTS = metrics.register(Counter(
+    'completion_cache_requests_total', "Atbilžu kešatmiņas pieprasījumi pēc rezultāta (hit, miss, bypass)",
+    ('kind', 'result')))
+MODEL_WARMUP_DURATION = metrics.register(Histogram(
+    'model_warmup_duration_seconds', "Modeļa ielādes laiks iesildīšanas pieprasījumā", ('model',),
+    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)))
 
 # Datubāzes inicializācija
 db = SQLAlchemy(app)
 
+# Noklusējuma nosaukums jaunam čatam
+DEFAULT_CHAT_TITLE = "Jauns čats"
+
 
 # Datubāzes modeļi
 class User(db.Model):
@@ -27,7 +255,7 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)  # Unikāls lietotāja ID
     username = db.Column(db.String(80), unique=True, nullable=False)  # Lietotājvārds
     password = db.Column(db.String(200), nullable=False)  # Hešēta parole
-    registration_ip = db.Column(db.String(45), nullable=False)  # IP adrese reģistrācijas brīdī
+    registration_ip = db.Column(db.String(45), nullable=False, index=True)  # IP adrese reģistrācijas brīdī
     registration_date = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Reģistrācijas datums
     chats = db.relationship('Chat', backref='user', lazy=True)  # Saite uz lietotāja čatiem
     login_logs = db.relationship('LoginLog', backref='user', lazy=True)  # Saite uz pieteikšanās žurnālu
@@ -45,9 +273,13 @@ class Chat(db.Model):
     """Čatu tabulas modelis"""
     id = db.Column(db.Integer, primary_key=True)  # Unikāls čata ID
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Ārējā atslēga uz lietotāju
-    title = db.Column(db.String(100), default="Jauns čats", nullable=False)  # Čata nosaukums
+    title = db.Column(db.String(100), default=DEFAULT_CHAT_TITLE, nullable=False)  # Čata nosaukums
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Čata izveidošanas laiks
     messages = db.relationship('Message', backref='chat', lazy=True)  # Saite uz čata ziņojumiem
+    archived_at = db.Column(db.DateTime, nullable=True)  # Arhivēšanas laiks (ziņojumi atrodas ChatArchive)
+
+    # Lietotāja čatu saraksts vienmēr tiek kārtots pēc izveidošanas laika
+    __table_args__ = (db.Index('ix_chat_user_id_created_at', 'user_id', 'created_at'),)
 
 
 class Message(db.Model):
@@ -58,339 +290,3540 @@ class Message(db.Model):
     content = db.Column(db.Text, nullable=False)  # Ziņojuma saturs
     timestamp = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Ziņojuma laiks
     model = db.Column(db.String(100), nullable=True)  # Izmantotā modeļa nosaukums
+    status = db.Column(db.String(10), nullable=False, default='complete', server_default='complete')  # 'streaming', 'complete', 'stopped' vai 'error'
 
+    # Čata ziņojumi vienmēr tiek kārtoti pēc laika
+    __table_args__ = (db.Index('ix_message_chat_id_timestamp', 'chat_id', 'timestamp'),)
 
-# Datubāzes tabulu izveide
-with app.app_context():
-    db.create_all()  # Izveido visas tabulas, ja tās neeksistē
 
-# LM Studio API konfigurācija (lokālais serveris)
-LM_STUDIO_API = "http://127.0.0.1:1234"
+class ChatSummary(db.Model):
+    """Čata vecāko ziņojumu kopsavilkums (aizvieto tos LM Studio kontekstā)"""
+    id = db.Column(db.Integer, primary_key=True)  # Unikāls kopsavilkuma ID
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), unique=True, nullable=False)  # Ārējā atslēga uz čatu
+    content = db.Column(db.Text, nullable=False)  # Kopsavilkuma teksts
+    covers_until_id = db.Column(db.Integer, nullable=False)  # Pēdējā apkopotā ziņojuma ID
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Pēdējās atjaunināšanas laiks
 
-# Aktīvo ģenerāciju sekošana (čata ID -> True/False)
-active_generations = {}
 
-# Funkcija pieejamo modeļu pārbaudei LM Studio
-def get_available_models():
-    """
-    Iegūst pieejamo modeļu sarakstu no LM Studio API
-    Atgriež: saraksts ar modeļiem vai tukšs saraksts kļūdas gadījumā
-    """
-    try:
-        response = requests.get(f"{LM_STUDIO_API}/v1/models")
-        if response.status_code == 200:
-            return response.json()["data"]
-        return []
-    except:
-        # Ja nav iespējams savienoties ar API, atgriež tukšu sarakstu
-        return []
+class ModelCatalog(db.Model):
+    """Modeļu kataloga kešatmiņa (viena rinda, kopīga visiem procesiem)"""
+    id = db.Column(db.Integer, primary_key=True)  # Vienmēr 1
+    data = db.Column(db.Text, nullable=False, default='[]')  # Modeļu saraksts JSON formātā
+    refreshed_at = db.Column(db.DateTime, nullable=True)  # Pēdējās veiksmīgās atjaunināšanas laiks
+    last_attempt = db.Column(db.DateTime, nullable=True)  # Pēdējā atjaunināšanas mēģinājuma laiks
+    last_error = db.Column(db.String(500), nullable=True)  # Pēdējā mēģinājuma kļūda (ja bija)
 
 
-# Funkcija lietotāja IP adreses iegūšanai
-def get_client_ip():
+class Generation(db.Model):
+    """Aktīvo ģenerāciju reģistrs (kopīgs visiem darba procesiem)"""
+    id = db.Column(db.String(32), primary_key=True)  # GenerationJob ID
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), unique=True, nullable=False)  # Čatā vienlaikus notiek tikai viena ģenerācija
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Ģenerācijas īpašnieks
+    model = db.Column(db.String(100), nullable=True)  # Izmantotā modeļa nosaukums
+    message_id = db.Column(db.Integer, nullable=True)  # Assistenta ziņojums, kurā tiek saglabāta atbilde
+    pid = db.Column(db.Integer, nullable=False)  # Darba procesa ID, kurā notiek ģenerācija
+    stop_requested = db.Column(db.Boolean, nullable=False, default=False)  # Apturēšanas pieprasījums no jebkura procesa
+    started_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Ģenerācijas sākuma laiks
+    heartbeat_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Pēdējais procesa dzīvības signāls
+
+
+class GenerationLane(db.Model):
+    """Salīdzināšanas ģenerācijas modeļi un to assistenta ziņojumi (viena rinda katram modelim)"""
+    id = db.Column(db.Integer, primary_key=True)  # Unikāls ieraksta ID
+    generation_id = db.Column(db.String(32), db.ForeignKey('generation.id'), nullable=False, index=True)  # Ģenerācijas reģistra ieraksts
+    model = db.Column(db.String(100), nullable=False)  # Modeļa ID
+    message_id = db.Column(db.Integer, nullable=True)  # Šī modeļa assistenta ziņojums (kad tas izveidots)
+
+
+class ChatArchive(db.Model):
+    """Arhivēta čata ziņojumi (saspiesti vienā ierakstā, atjaunoti, kad čats tiek atvērts)"""
+    id = db.Column(db.Integer, primary_key=True)  # Unikāls arhīva ID
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), unique=True, nullable=False)  # Ārējā atslēga uz čatu
+    codec = db.Column(db.String(10), nullable=False)  # Saspiešanas veids: 'zlib' vai 'zstd'
+    payload = db.Column(db.LargeBinary, nullable=False)  # Saspiests ziņojumu saraksts JSON formātā
+    message_count = db.Column(db.Integer, nullable=False)  # Arhivēto ziņojumu skaits
+    archived_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)  # Arhivēšanas laiks
+
+
+class LoginStat(db.Model):
+    """Pieteikšanās skaits pa lietotājiem un dienām (aizvieto vecos LoginLog ierakstus)"""
+    id = db.Column(db.Integer, primary_key=True)  # Unikāls ieraksta ID
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)  # Ārējā atslēga uz lietotāju
+    day = db.Column(db.Date, nullable=False)  # Diena (UTC)
+    logins = db.Column(db.Integer, nullable=False, default=0)  # Pieteikšanās reižu skaits
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_login_stat_user_day'),)
+
+
+# Datubāzes shēmas migrācijas (versija tiek glabāta SQLite PRAGMA user_version)
+# Katra migrācija: (versija, apraksts, SQL komandu saraksts)
+MIGRATIONS = [
+    (1, "Indeksi čatu, ziņojumu un reģistrācijas IP vaicājumiem", [
+        "CREATE INDEX IF NOT EXISTS ix_message_chat_id_timestamp ON message (chat_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_user_id_created_at ON chat (user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_user_registration_ip ON user (registration_ip)",
+        "ANALYZE",
+    ]),
+    (2, "Assistenta ziņojuma straumēšanas statuss", [
+        "ALTER TABLE message ADD COLUMN status VARCHAR(10) NOT NULL DEFAULT 'complete'",
+    ]),
+    (3, "Čatu arhivēšanas laiks", [
+        "ALTER TABLE chat ADD COLUMN archived_at DATETIME",
+    ]),
+]
+
+# Pilnteksta meklēšanas indekss (SQLite FTS5), create_all() to neizveido
+# rowid: ziņojumiem - ziņojuma ID, čatu nosaukumiem - negatīvs čata ID
+# owner: lietotāja marķieris 'u<ID>', lai meklēšana skatītu tikai šī lietotāja ierakstus
+# prefix: papildu indeksi īsiem prefiksiem (meklēšana rakstīšanas laikā)
+SEARCH_INDEX_SCHEMA = ("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                       "body, owner, chat_id UNINDEXED, prefix = '2 3', "
+                       "tokenize = 'unicode61 remove_diacritics 2')")
+
+
+def migrate_database():
     """
-    Iegūst klienta IP adresi, ņemot vērā proxy serverus
-    Atgriež: IP adrese kā string
+    Izveido trūkstošās tabulas un piemēro nepiemērotās shēmas migrācijas
+    Jaunai datubāzei create_all() izveido aktuālo shēmu, tāpēc migrācijas tikai atzīmē kā piemērotas
     """
-    # Pārbauda, vai ir proxy headers
-    if request.environ.get('HTTP_X_FORWARDED_FOR') is not None:
-        return request.environ['HTTP_X_FORWARDED_FOR']
-    # Ja nav proxy, izmanto tiešo IP
-    return request.remote_addr
+    latest = MIGRATIONS[-1][0] if MIGRATIONS else 0
+    is_new = 'user' not in db.inspect(db.engine).get_table_names()
+    db.create_all()  # Izveido visas tabulas, ja tās neeksistē
+
+    raw_connection = db.engine.raw_connection()
+    connection = raw_connection.driver_connection
+    isolation_level = connection.isolation_level
+    try:
+        connection.isolation_level = None  # Transakcijas tiek pārvaldītas manuāli
+        # BEGIN IMMEDIATE neļauj vairākiem procesiem vienlaikus piemērot migrācijas
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if is_new:
+                version = latest
+            for number, description, statements in MIGRATIONS:
+                if number <= version:
+                    continue
+                logger.info(f"Piemēro datubāzes migrāciju {number}: {description}")
+                for statement in statements:
+                    connection.execute(statement)
+                version = number
+            connection.execute(f"PRAGMA user_version = {int(version)}")
+            connection.execute(SEARCH_INDEX_SCHEMA)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+    finally:
+        # Savienojums atgriežas pūlā, tāpēc tam jāatjauno transakciju režīms, citādi sesijas paliktu autocommit režīmā
+        connection.isolation_level = isolation_level
+        raw_connection.close()
 
-def generate_chat_title(first_message, model_id):
+
+def configure_sqlite_connection(dbapi_connection, connection_record):
     """
-    Ģenerē čata nosaukumu, pamatojoties uz pirmo ziņojumu
-    Parametri:
-        first_message: pirmais ziņojums čatā
-        model_id: modeļa ID, kas tiks izmantots nosaukuma ģenerēšanai
-    Atgriež: ģenerēto nosaukumu vai saīsināto ziņojumu
+    Iestata SQLite parametrus katram jaunam savienojumam
+    WAL režīmā lasītāji nebloķē rakstītāju un rakstītājs nebloķē lasītājus
     """
-    # Ja nav norādīts modelis, izmanto ziņojuma sākumu
-    if not model_id or model_id.strip() == "":
-        return first_message[:50] + "..."
-    
+    synchronous = app.config['SQLITE_SYNCHRONOUS']
+    if synchronous not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        synchronous = 'NORMAL'
+    cursor = dbapi_connection.cursor()
     try:
-        # API pieprasījuma URL
-        api_url = f"{LM_STUDIO_API}/v1/chat/completions"
-        
-        # Pieprasījuma dati nosaukuma ģenerēšanai
-        payload = {
-            "model": model_id,
-            "messages": [
-                {"role": "system", "content": "Ģenerē īsu nosaukumu lietotāja valodā, pamatojoties uz ziņojumu. Dod tikai 1-2 vārdus kā atbildi, bez pēdiņām."},
-                {"role": "user", "content": f"Ziņojums: {first_message}"}
-            ],
-            "temperature": 0.7,  # Kreativitātes līmenis
-            "max_tokens": 20     # Maksimālais tokenu skaits
-        }
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA cache_size=-{int(app.config['SQLITE_CACHE_SIZE_KB'])}")
+        cursor.execute(f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}")
+        cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
 
-        # Sūta pieprasījumu uz API
-        response = requests.post(api_url, json=payload, timeout=15)
-        response.raise_for_status()
-
-        # Apstrādā atbildi
-        title_data = response.json()
-        title_text = title_data['choices'][0]['message']['content'].strip('"')
-        
-        # Noņem "Title:" prefiksu, ja tas ir
-        title_text = re.sub(r'^Title:?\s*', '', title_text, flags=re.IGNORECASE)
-        print(f"Jauns ģenerētais nosaukums: '{title_text}'")
-        return title_text
-
-    except requests.exceptions.RequestException as e:
-        print(f"HTTP kļūda nosaukuma ģenerēšanas laikā: {e}")
-        return first_message[:50] + "..."
-    except (KeyError, JSONDecodeError) as e:
-        print(f"JSON kļūda nosaukuma apstrādē: {e}")
-        return first_message[:50] + "..."
-    except Exception as e:
-        print(f"Nezināma kļūda generate_chat_title funkcijā: {e}")
-        return first_message[:50] + "..."
 
-# Aplikācijas maršruti (routes)
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
 
-@app.route('/')
-def index():
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
     """
-    Galvenā lapa - pārvirza uz čatu, ja lietotājs ir pieteicies
+    Uzskaita SQL vaicājuma laiku (kopējā metrikā un pašreizējā HTTP pieprasījuma kopsummā)
     """
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    return redirect(url_for('chat'))
+    started = conn.info.pop('query_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    DB_QUERY_DURATION.observe(elapsed, statement.split(None, 1)[0].upper() if statement else '')
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+        g.db_seconds += elapsed
 
-@app.route('/register', methods=['GET', 'POST'])
-def register():
+
+# Datubāzes tabulu izveide un migrācijas
+with app.app_context():
+    event.listen(db.engine, 'connect', configure_sqlite_connection)
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    migrate_database()
+
+
+class DatabaseWriter:
     """
-    Lietotāja reģistrācijas lapa
-    GET: parāda reģistrācijas formu
-    POST: apstrādā reģistrācijas datus
+    Viens rakstītāja pavediens nekritiskiem ierakstiem (pieteikšanās žurnāls, straumes starpstāvokļi)
+    Rindā uzkrātās operācijas tiek izpildītas vienā transakcijā (grupas commit), tāpēc
+    vienlaicīgas straumes neacenšas par SQLite rakstīšanas slēdzeni ar katru ierakstu
     """
-    if request.method == 'POST':
-        # Iegūst datus no formas
-        username = request.form.get('username')
-        password = request.form.get('password')
-        ip_address = get_client_ip()
-
-        # Pārbauda, vai no šīs IP jau ir reģistrēts lietotājs
-        existing_ip = User.query.filter_by(registration_ip=ip_address).first()
-        if existing_ip:
-            flash('Jūs jau esat reģistrējies! Problēmu gadījumā sazinieties ar administratoru: LocaLLM@darkweb.onion')
-            return redirect(url_for('register'))
 
-        # Pārbauda, vai lietotājvārds jau eksistē
-        existing_user = User.query.filter_by(username=username).first()
-        if existing_user:
-            flash('Lietotājs ar šādu lietotājvārdu jau eksistē.')
-            return redirect(url_for('register'))
+    def __init__(self, batch_size=500, batch_wait=0.005):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.batches = 0        # Izpildīto transakciju skaits
+        self.operations = 0     # Izpildīto operāciju skaits
 
-        # Izveido jaunu lietotāju
-        hashed_password = generate_password_hash(password)  # Hešē paroli
-        new_user = User(username=username, password=hashed_password, registration_ip=ip_address)
-        db.session.add(new_user)
-        db.session.commit()
+    def submit(self, operation, *args):
+        """
+        Pievieno operāciju rakstīšanas rindai
+        Parametri:
+            operation: funkcija, kas izmaina db.session (bez commit)
+            args: funkcijas argumenti
+        Atgriež: Future, kas tiek izpildīts pēc transakcijas commit
+        """
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._run, name='database-writer', daemon=True)
+                    self.thread.start()
+        future = Future()
+        self.queue.put((operation, args, future))
+        return future
 
-        flash('Reģistrācija veiksmīga. Tagad varat pieteikties.')
-        return redirect(url_for('login'))
+    def flush(self, timeout=None):
+        """
+        Gaida, līdz visas iepriekš pievienotās operācijas ir ierakstītas
+        """
+        if self.thread is not None:
+            self.submit(lambda: None).result(timeout)
 
-    # GET pieprasījums - parāda reģistrācijas formu
-    return render_template('register.html')
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except Empty:
+                    break
+            with app.app_context():
+                try:
+                    self._write(batch)
+                finally:
+                    db.session.remove()
 
+    def _write(self, batch):
+        try:
+            for operation, args, _ in batch:
+                operation(*args)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(batch) == 1:
+                logger.error(f"Datubāzes rakstītāja kļūda: {e}")
+                batch[0][2].set_exception(e)
+                return
+            # Atkārto katru operāciju atsevišķi, lai viena kļūda neatceltu pārējās
+            for item in batch:
+                self._write([item])
+            return
+        self.batches += 1
+        self.operations += len(batch)
+        for _, _, future in batch:
+            future.set_result(None)
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    """
-    Lietotāja pieteikšanās lapa
-    GET: parāda pieteikšanās formu
-    POST: apstrādā pieteikšanās datus
-    """
-    if request.method == 'POST':
-        # Iegūst datus no formas
-        username = request.form.get('username')
-        password = request.form.get('password')
 
-        # Meklē lietotāju datubāzē
-        user = User.query.filter_by(username=username).first()
+# Kopīgais rakstītājs šim procesam (neierakstītās operācijas tiek pabeigtas pirms procesa beigām)
+db_writer = DatabaseWriter(app.config['DB_WRITE_BATCH_SIZE'], app.config['DB_WRITE_BATCH_WAIT'])
+atexit.register(db_writer.flush, 10)
+metrics.register(Gauge('db_writer_queue_depth', "Datubāzes rakstītāja rindā gaidošās operācijas",
+                       collect=lambda: {(): db_writer.queue.qsize()}))
 
-        # Pārbauda lietotājvārdu un paroli
-        if user and check_password_hash(user.password, password):
-            # Saglabā lietotāja datus sesijā
-            session['user_id'] = user.id
-            session['username'] = user.username
+# LM Studio API konfigurācija (viens vai vairāki OpenAI-saderīgi serveri, atdalīti ar komatu)
+LM_STUDIO_BACKENDS = [url.strip().rstrip('/') for url in
+                      os.environ.get('LM_STUDIO_BACKENDS', 'http://127.0.0.1:1234').split(',') if url.strip()]
 
-            # Ieraksta pieteikšanās žurnālā
-            ip_address = get_client_ip()
-            login_log = LoginLog(user_id=user.id, ip_address=ip_address)
-            db.session.add(login_log)
-            db.session.commit()
+# Savienojumu pūla un taimautu konfigurācija
+app.config['UPSTREAM_CONNECT_TIMEOUT'] = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 3.05))  # Savienojuma izveides taimauts
+app.config['UPSTREAM_READ_TIMEOUT'] = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 120))  # Maksimālā pauze starp saņemtajiem datiem
+app.config['UPSTREAM_POOL_SIZE'] = int(os.environ.get('UPSTREAM_POOL_SIZE', 20))  # Pastāvīgo savienojumu skaits katram serverim
+app.config['UPSTREAM_MAX_FAILURES'] = int(os.environ.get('UPSTREAM_MAX_FAILURES', 3))  # Kļūdas pēc kārtas līdz servera izslēgšanai
+app.config['UPSTREAM_EJECT_SECONDS'] = int(os.environ.get('UPSTREAM_EJECT_SECONDS', 30))  # Cik ilgi izslēgts serveris netiek izmantots
+app.config['UPSTREAM_HEALTH_INTERVAL'] = int(os.environ.get('UPSTREAM_HEALTH_INTERVAL', 10))  # Veselības pārbaužu intervāls sekundēs
+app.config['MODEL_WARMUP_TIMEOUT'] = float(os.environ.get('MODEL_WARMUP_TIMEOUT', 300))  # Cik ilgi gaidīt modeļa ielādi iesildīšanas pieprasījumā
+app.config['MODEL_WARMUP_TTL'] = int(os.environ.get('MODEL_WARMUP_TTL', 600))  # Cik ilgi iesildīts modelis skaitās ielādēts, ja serveris stāvokli nenorāda
+app.config['MODEL_WARMUP_RETRY'] = int(os.environ.get('MODEL_WARMUP_RETRY', 60))  # Pauze sekundēs pirms atkārtotas iesildīšanas pēc kļūdas
+app.config['MODEL_WARMUP_WORKERS'] = int(os.environ.get('MODEL_WARMUP_WORKERS', 2))  # Vienlaicīgi iesildāmo modeļu skaits
+app.config['COMPLETION_CACHE_MAX_BYTES'] = int(os.environ.get('COMPLETION_CACHE_MAX_BYTES', 0))  # Atbilžu kešatmiņas izmērs atmiņā (0 - izslēgta)
+app.config['COMPLETION_CACHE_TTL'] = int(os.environ.get('COMPLETION_CACHE_TTL', 24 * 3600))  # Cik ilgi kešota atbilde ir derīga (sekundes)
+app.config['COMPLETION_CACHE_PATH'] = os.environ.get('COMPLETION_CACHE_PATH', '')  # SQLite fails kešatmiņas saglabāšanai diskā (tukšs - tikai atmiņā)
+app.config['COMPLETION_CACHE_DISK_MAX_BYTES'] = int(os.environ.get('COMPLETION_CACHE_DISK_MAX_BYTES', 256 * 1024 * 1024))  # Kešatmiņas faila satura izmēra ierobežojums
+app.config['COMPLETION_CACHE_MAX_TEMPERATURE'] = float(os.environ.get('COMPLETION_CACHE_MAX_TEMPERATURE', 0))  # Tiek kešoti tikai deterministiski pieprasījumi (vai ar seed): čatu nosaukumi; čata atbildes (temperatūra 0.6) - tikai, ja vērtība ir vismaz 0.6
+app.config['TITLE_WORKERS'] = int(os.environ.get('TITLE_WORKERS', 2))  # Fona pavedieni čatu nosaukumu ģenerēšanai
+app.config['TITLE_CACHE_SIZE'] = int(os.environ.get('TITLE_CACHE_SIZE', 512))  # Kešoto nosaukumu skaits
+app.config['MESSAGE_PAGE_SIZE'] = int(os.environ.get('MESSAGE_PAGE_SIZE', 50))  # Ziņojumu skaits vienā lapā
+app.config['CHAT_PAGE_SIZE'] = int(os.environ.get('CHAT_PAGE_SIZE', 50))  # Čatu skaits vienā sānjoslas lapā
+app.config['MAX_PAGE_SIZE'] = 200  # Maksimālais klienta pieprasītais lapas izmērs
+app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', 20))  # Meklēšanas rezultātu skaits vienā lapā
+app.config['SEARCH_MAX_OFFSET'] = int(os.environ.get('SEARCH_MAX_OFFSET', 1000))  # Cik tālu meklēšanas rezultātos var lapot
+app.config['EXPORT_FETCH_SIZE'] = int(os.environ.get('EXPORT_FETCH_SIZE', 1000))  # Rindas, ko eksports vienlaikus nolasa no kursora
+app.config['EXPORT_CHUNK_BYTES'] = int(os.environ.get('EXPORT_CHUNK_BYTES', 65536))  # Eksporta atbildes fragmenta izmērs
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))  # Importētie ziņojumi vienā transakcijā
+app.config['IMPORT_MAX_LINE_BYTES'] = int(os.environ.get('IMPORT_MAX_LINE_BYTES', 16 * 1024 * 1024))  # Maksimālais viena importa ieraksta izmērs
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))  # Čati bez aktivitātes tik dienas tiek arhivēti (0 - nekad)
+app.config['ARCHIVE_CODEC'] = os.environ.get('ARCHIVE_CODEC', 'zlib')  # Arhīva saspiešana: 'zlib' vai 'zstd' (ja instalēta zstandard)
+app.config['LOGIN_LOG_RETENTION_DAYS'] = int(os.environ.get('LOGIN_LOG_RETENTION_DAYS', 180))  # Vecāki pieteikšanās ieraksti tiek apkopoti pa dienām (0 - nekad)
+app.config['RETENTION_INTERVAL'] = int(os.environ.get('RETENTION_INTERVAL', 3600))  # Sekundes starp glabāšanas darbiem (0 - tikai ar flask run-retention)
+app.config['RETENTION_BATCH_SIZE'] = int(os.environ.get('RETENTION_BATCH_SIZE', 1000))  # Rindas vienā dzēšanas transakcijā
+app.config['STATIC_BUILD_DIR'] = os.environ.get('STATIC_BUILD_DIR', os.path.join(app.static_folder, 'build'))  # Statisko failu versiju (ar hešu nosaukumā) mape
+app.config['STATIC_ASSET_MAX_AGE'] = int(os.environ.get('STATIC_ASSET_MAX_AGE', 365 * 24 * 3600))  # Versiju failu kešošanas laiks pārlūkā (sekundes)
+app.config['COMPRESS_MIN_BYTES'] = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))  # HTML/JSON atbildes, mazākas par šo, netiek saspiestas
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))  # gzip līmenis dinamiskām atbildēm
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))  # brotli kvalitāte dinamiskām atbildēm
+app.config['RESPONSE_MAX_TOKENS'] = 2048  # Maksimālais atbildes tokenu skaits
+app.config['CONTEXT_TOKEN_BUDGET'] = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 4096))  # Vēstures tokenu budžets, ja modelim tas nav zināms
+app.config['MODEL_CONTEXT_BUDGETS'] = json.loads(os.environ.get('MODEL_CONTEXT_BUDGETS', '{}'))  # Budžeti konkrētiem modeļiem: {"modelis": tokeni}
+app.config['SUMMARY_MAX_TOKENS'] = int(os.environ.get('SUMMARY_MAX_TOKENS', 512))  # Kopsavilkuma maksimālais garums
+app.config['STREAM_FLUSH_INTERVAL'] = float(os.environ.get('STREAM_FLUSH_INTERVAL', 1.0))  # Sekundes starp straumētās atbildes saglabāšanām
+app.config['STREAM_FLUSH_BYTES'] = int(os.environ.get('STREAM_FLUSH_BYTES', 2048))  # Nesaglabāto baitu slieksnis saglabāšanai
+app.config['GENERATION_BUFFER_EVENTS'] = int(os.environ.get('GENERATION_BUFFER_EVENTS', 4096))  # Notikumu skaits ģenerācijas buferī
+app.config['GENERATION_RETENTION'] = int(os.environ.get('GENERATION_RETENTION', 60))  # Cik sekundes pabeigta ģenerācija pieejama atkārtotai pievienošanai
+app.config['GENERATION_ORPHAN_TIMEOUT'] = int(os.environ.get('GENERATION_ORPHAN_TIMEOUT', 30))  # Ģenerācija tiek apturēta, ja tik ilgi nav neviena klienta
+app.config['SSE_KEEPALIVE_INTERVAL'] = 15  # Sekundes starp keep-alive komentāriem straumē
+app.config['SSE_COALESCE_INTERVAL'] = float(os.environ.get('SSE_COALESCE_INTERVAL', 0.05))  # Cik ilgi fragmenti tiek krāti vienā SSE kadrā (0 - nekrāt)
+app.config['SSE_COALESCE_BYTES'] = int(os.environ.get('SSE_COALESCE_BYTES', 1024))  # Uzkrātā satura apjoms, pie kura kadrs tiek nosūtīts uzreiz
+app.config['GENERATION_STOP_POLL_INTERVAL'] = float(os.environ.get('GENERATION_STOP_POLL_INTERVAL', 0.5))  # Cik bieži tiek pārbaudīti citu procesu apturēšanas pieprasījumi
+app.config['GENERATION_HEARTBEAT_INTERVAL'] = int(os.environ.get('GENERATION_HEARTBEAT_INTERVAL', 5))  # Sekundes starp aktīvo ģenerāciju dzīvības signāliem
+app.config['GENERATION_STALE_AFTER'] = int(os.environ.get('GENERATION_STALE_AFTER', 30))  # Ģenerācija bez dzīvības signāla tik ilgi tiek uzskatīta par pamestu
+app.config['MODEL_CONCURRENCY'] = int(os.environ.get('MODEL_CONCURRENCY', 2))  # Vienlaicīgās ģenerācijas vienam modelim (katrā procesā)
+app.config['MODEL_CONCURRENCY_LIMITS'] = json.loads(os.environ.get('MODEL_CONCURRENCY_LIMITS', '{}'))  # Ierobežojumi konkrētiem modeļiem: {"modelis": skaits}
+app.config['COMPARE_MAX_MODELS'] = int(os.environ.get('COMPARE_MAX_MODELS', 4))  # Maksimālais modeļu skaits vienā salīdzināšanas pieprasījumā
+app.config['GENERATION_QUEUE_LIMIT'] = int(os.environ.get('GENERATION_QUEUE_LIMIT', 100))  # Maksimālais gaidošo ģenerāciju skaits vienam modelim
 
-            return redirect(url_for('chat'))
 
-        # Nepareizi pieteikšanās dati
-        flash('Nepareizs lietotājvārds vai parole.')
+def upstream_error_kind(error):
+    """
+    Klasificē LM Studio pieprasījuma kļūdu metrikām: 'timeout', 'connect' vai 'other'
+    """
+    name = type(error).__name__
+    if isinstance(error, requests.exceptions.Timeout) or 'Timeout' in name:
+        return 'timeout'
+    if isinstance(error, requests.exceptions.ConnectionError) or 'Connect' in name:
+        return 'connect'
+    return 'other'
 
-    # GET pieprasījums - parāda pieteikšanās formu
-    return render_template('login.html')
 
-@app.route('/logout')
-def logout():
+def record_upstream_call(backend_url, path, seconds=None, status=None, error_kind=None):
     """
-    Lietotāja izrakstīšanās - notīra sesiju
+    Ieraksta LM Studio pieprasījuma latentumu un kļūdas
+    Parametri:
+        backend_url: servera adrese
+        path: API ceļš (piemēram, '/v1/chat/completions')
+        seconds: laiks līdz atbildes galvenēm
+        status: HTTP statusa kods
+        error_kind: kļūdas veids, ja atbilde netika saņemta
     """
-    session.pop('user_id', None)
-    session.pop('username', None)
-    return redirect(url_for('login'))
+    if error_kind:
+        UPSTREAM_ERRORS.inc(backend_url, path, error_kind)
+        return
+    UPSTREAM_DURATION.observe(seconds, backend_url, path)
+    if status is not None and status >= 400:
+        UPSTREAM_ERRORS.inc(backend_url, path, f"http_{status // 100}xx")
 
-@app.route('/chat')
-def chat():
+
+class UpstreamCall:
     """
-    Čata galvenā lapa - parāda pēdējo čatu vai izveido jaunu
+    LM Studio pieprasījums, ko var pārtraukt no cita pavediena jebkurā brīdī - arī savienojuma izveides,
+    modeļa ielādes vai uzvednes apstrādes laikā, kad atbildes galvenes vēl nav saņemtas
+    Savienojumu pūls piesaista tam urllib3 savienojumu, pa kuru pieprasījums tiek sūtīts
     """
-    # Pārbauda, vai lietotājs ir pieteicies
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    local = threading.local()  # Pieprasījums, ko pašlaik sūta šis pavediens
 
-    # Iegūst lietotāja čatus
-    user_chats = Chat.query.filter_by(user_id=session['user_id']).order_by(Chat.created_at.desc()).all()
-    models = get_available_models()
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connection = None
+        self.response = None
+        self.aborted = False
 
-    # Ja nav čatu, izveido jaunu
-    if not user_chats:
-        new_chat = Chat(user_id=session['user_id'])
-        db.session.add(new_chat)
-        db.session.commit()
-        return render_template('chat.html', chats=user_chats, current_chat=new_chat, messages=[], models=models)
-    else:
-        # Pārvirza uz pēdējo čatu
-        latest_chat = user_chats[0]
-        return redirect(url_for('view_chat', chat_id=latest_chat.id))
+    @classmethod
+    def attach_connection(cls, connection):
+        """
+        Piesaista savienojumu pavediena aktīvajam pieprasījumam (izsauc savienojumu pūls)
+        Ja pieprasījums jau ir pārtraukts, savienojums tiek aizvērts uzreiz
+        """
+        call = getattr(cls.local, 'call', None)
+        if call is None:
+            return
+        with call.lock:
+            call.connection = connection
+            aborted = call.aborted
+        if aborted:
+            cls.shutdown(connection)
 
+    def attach_response(self, response):
+        with self.lock:
+            self.response = response
+            aborted = self.aborted
+        if aborted:
+            UpstreamPool.abort(response)
 
-@app.route('/chat/<int:chat_id>')
-def view_chat(chat_id):
-    """
-    Konkrēta čata skatīšana
-    Parametri:
-        chat_id: čata ID
-    """
-    # Pārbauda pieteikšanos
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    def abort(self):
+        """
+        Pārtrauc pieprasījumu (drīkst izsaukt no cita pavediena)
+        """
+        with self.lock:
+            self.aborted = True
+            connection, response = self.connection, self.response
+        if response is not None:
+            UpstreamPool.abort(response)
+        elif connection is not None:
+            self.shutdown(connection)
 
-    # Iegūst čatu
-    chat = Chat.query.get_or_404(chat_id)
+    @staticmethod
+    def shutdown(connection):
+        # Pamodina pavedienu, kas gaida atbildi no šī savienojuma (vēl nesavienotam nav ko aizvērt)
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
-    # Pārbauda, vai čats pieder lietotājam
-    if chat.user_id != session['user_id']:
-        return redirect(url_for('chat'))
 
-    # Iegūst čata ziņojumus un pieejamos modeļus
-    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp).all()
-    user_chats = Chat.query.filter_by(user_id=session['user_id']).order_by(Chat.created_at.desc()).all()
-    models = get_available_models()
+class AbortableConnectionMixin:
+    """Jauns savienojums pēc izveides tiek piesaistīts UpstreamCall"""
 
-    return render_template('chat.html', chats=user_chats, current_chat=chat, messages=messages, models=models)
+    def connect(self):
+        super().connect()
+        UpstreamCall.attach_connection(self)
 
-@app.route('/create_chat', methods=['POST'])
-def create_chat():
-    """
-    Jauna čata izveide (AJAX pieprasījums)
-    Atgriež: JSON ar jaunā čata datiem
-    """
-    # Pārbauda pieteikšanos
-    if 'user_id' not in session:
-        return jsonify({'error': 'Nav pieteicies'}), 401
 
-    # Izveido jaunu čatu
-    new_chat = Chat(user_id=session['user_id'])
-    db.session.add(new_chat)
-    db.session.commit()
+class AbortablePoolMixin:
+    """Pūla savienojums (arī atkārtoti izmantots) pirms pieprasījuma tiek piesaistīts UpstreamCall"""
 
-    return jsonify({
-        'id': new_chat.id,
-        'title': new_chat.title
-    })
+    def _make_request(self, conn, *args, **kwargs):
+        UpstreamCall.attach_connection(conn)
+        return super()._make_request(conn, *args, **kwargs)
 
 
-@app.route('/send_message', methods=['POST'])
-def send_message():
-    """
-    Ziņojuma sūtīšana (AJAX pieprasījums)
-    Saglabā lietotāja ziņojumu datubāzē un ģenerē čata nosaukumu, ja nepieciešams
-    """
-    # Pārbauda pieteikšanos
-    if 'user_id' not in session:
-        return jsonify({'error': 'Nav pieteicies'}), 401
-    
-    # Iegūst datus no pieprasījuma
-    data = request.json
-    chat_id = data.get('chat_id')
-    content = data.get('content')
-    model_id = data.get('model')
+class AbortableHTTPConnection(AbortableConnectionMixin, HTTPConnection):
+    pass
 
-    print(f"/send_message: chat_id={chat_id}, model_id={model_id}, content='{content[:20]}...'")
 
-    # Pārbauda čata piederību
-    chat = Chat.query.get(chat_id)
-    if not chat or chat.user_id != session['user_id']:
-        return jsonify({'error': 'Nav autorizēts'}), 403
+class AbortableHTTPSConnection(AbortableConnectionMixin, HTTPSConnection):
+    pass
 
-    # Saglabā lietotāja ziņojumu
-    user_message = Message(chat_id=chat_id, role='user', content=content)
-    db.session.add(user_message)
-    db.session.commit()
 
-    # Pārbauda, vai šis ir pirmais ziņojums čatā
-    messages_count = Message.query.filter_by(chat_id=chat_id).count()
+class AbortableHTTPConnectionPool(AbortablePoolMixin, HTTPConnectionPool):
+    ConnectionCls = AbortableHTTPConnection
 
-    if messages_count == 1:
-        # Ģenerē čata nosaukumu pirmajam ziņojumam
-        try:
-            title = generate_chat_title(content, model_id)
-            chat.title = title[:97] + "..." if len(title) > 100 else title
-            db.session.commit()
-            return jsonify({
-                'status': 'success',
-                'message_id': user_message.id,
-                'updated_chat_title': chat.title
-            })
-        except Exception as e:
-            print(f"Nosaukuma ģenerēšanas kļūda: {e}")
-            db.session.rollback()
 
-    return jsonify({'status': 'success', 'message_id': user_message.id})
+class AbortableHTTPSConnectionPool(AbortablePoolMixin, HTTPSConnectionPool):
+    ConnectionCls = AbortableHTTPSConnection
 
-@app.route('/get_chats')
-def get_chats():
-    """
+
+class AbortableHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter, kura pieprasījumus var pārtraukt ar UpstreamCall"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': AbortableHTTPConnectionPool,
+                                                   'https': AbortableHTTPSConnectionPool}
+
+
+class UpstreamBackend:
+    """Viens OpenAI-saderīgs serveris ar savu pastāvīgo savienojumu pūlu"""
+
+    def __init__(self, url, pool_size):
+        self.url = url
+        self.session = requests.Session()
+        adapter = AbortableHTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.outstanding = 0        # Pašlaik izpildāmo pieprasījumu skaits
+        self.failures = 0           # Kļūdas pēc kārtas
+        self.ejected_until = 0.0    # Laiks (time.monotonic), līdz kuram serveris ir izslēgts
+        self.models = None          # Modeļu ID kopa no pēdējās veselības pārbaudes
+        self.loaded_models = None   # Atmiņā ielādēto modeļu ID kopa (None - serveris stāvokli nenorāda)
+        self.reports_state = True   # Vai serveris atbalsta LM Studio REST API (/api/v0/models)
+
+    def is_healthy(self, now=None):
+        return (now or time.monotonic()) >= self.ejected_until
+
+    def __repr__(self):
+        return f"<UpstreamBackend {self.url} outstanding={self.outstanding} failures={self.failures}>"
+
+
+class UpstreamPool:
+    """
+    Savienojumu pūls LM Studio serveriem
+    Maršrutē pieprasījumus uz serveri ar mazāko aktīvo pieprasījumu skaitu,
+    izslēdz serverus, kas atkārtoti neatbild
+    """
+
+    def __init__(self, urls, pool_size=20, max_failures=3, eject_seconds=30):
+        self.backends = [UpstreamBackend(url, pool_size) for url in urls]
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.lock = threading.Lock()
+
+    def _select(self, model, now):
+        candidates = [b for b in self.backends if b.is_healthy(now)]
+        if model:
+            with_model = [b for b in candidates if b.models is None or model in b.models]
+            candidates = with_model or candidates
+            # Serveris, kuram modelis jau ir atmiņā, atbild bez ielādes aiztures
+            resident = [b for b in candidates if b.loaded_models is not None and model in b.loaded_models]
+            candidates = resident or candidates
+        if not candidates:
+            # Visi serveri izslēgti - mēģina to, kuru atkal drīkst izmantot visātrāk
+            candidates = [min(self.backends, key=lambda b: b.ejected_until)]
+        return min(candidates, key=lambda b: b.outstanding)
+
+    def choose(self, model=None):
+        """
+        Izvēlas serveri nākamajam pieprasījumam un rezervē to
+        Parametri:
+            model: modeļa ID (priekšroka serveriem, kuriem šis modelis ir pieejams un ielādēts)
+        Atgriež: UpstreamBackend
+        """
+        now = time.monotonic()
+        with self.lock:
+            backend = self._select(model, now)
+            backend.outstanding += 1
+            return backend
+
+    def pick(self, model=None):
+        """
+        Izvēlas serveri tāpat kā choose(), bet to nerezervē
+        (rezervē request(), kad tam nodod izvēlēto serveri)
+        """
+        now = time.monotonic()
+        with self.lock:
+            return self._select(model, now)
+
+    def is_resident(self, model):
+        """
+        Pārbauda, vai modelis ir ielādēts kādā no veselajiem serveriem
+        Atgriež: True/False vai None, ja neviens serveris stāvokli nenorāda
+        """
+        now = time.monotonic()
+        with self.lock:
+            backends = [b for b in self.backends if b.is_healthy(now) and (b.models is None or model in b.models)]
+            states = [b.loaded_models for b in backends if b.loaded_models is not None]
+        if any(model in loaded for loaded in states):
+            return True
+        if states and len(states) == len(backends):
+            return False
+        return None
+
+    def release(self, backend, ok):
+        """
+        Atbrīvo serveri pēc pieprasījuma un atjaunina tā veselības stāvokli
+        """
+        with self.lock:
+            backend.outstanding -= 1
+            if ok is None:
+                # Pieprasījumu pārtrauca apturēšana - servera veselība netiek vērtēta
+                return
+            if ok:
+                backend.failures = 0
+                backend.ejected_until = 0.0
+            else:
+                backend.failures += 1
+                if backend.failures >= self.max_failures:
+                    backend.ejected_until = time.monotonic() + self.eject_seconds
+                    logger.warning(f"LM Studio serveris izslēgts uz {self.eject_seconds}s: {backend.url}")
+
+    @contextmanager
+    def request(self, method, path, model=None, backend=None, timeout=None, call=None, **kwargs):
+        """
+        Izpilda HTTP pieprasījumu caur pūlu (konteksta pārvaldnieks)
+        Parametri:
+            method: HTTP metode
+            path: ceļš, piemēram, '/v1/chat/completions'
+            model: modeļa ID maršrutēšanai
+            backend: konkrēts serveris (ja nav norādīts, tiek izvēlēts automātiski)
+            timeout: (savienojuma, lasīšanas) taimauti sekundēs
+            call: UpstreamCall, ar ko pieprasījumu var pārtraukt no cita pavediena
+        Atgriež: requests.Response, kas tiek aizvērts, izejot no konteksta
+        """
+        if backend is None:
+            backend = self.choose(model)
+        else:
+            with self.lock:
+                backend.outstanding += 1
+        if timeout is None:
+            timeout = (app.config['UPSTREAM_CONNECT_TIMEOUT'], app.config['UPSTREAM_READ_TIMEOUT'])
+
+        ok = False
+        response = None
+        started = time.perf_counter()
+        try:
+            UpstreamCall.local.call = call
+            try:
+                response = backend.session.request(method, backend.url + path, timeout=timeout, **kwargs)
+            finally:
+                UpstreamCall.local.call = None
+            if call is not None:
+                call.attach_response(response)
+            ok = response.status_code < 500
+            record_upstream_call(backend.url, path, time.perf_counter() - started, status=response.status_code)
+            try:
+                yield response
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError, OSError):
+                # Straume pārtrūka pusceļā (taimauts, savienojuma kļūda) - tā ir servera kļūme,
+                # ja vien savienojumu neaizvēra apturēšana
+                if not getattr(response, 'aborted', False):
+                    ok = False
+                raise
+        except requests.exceptions.RequestException as e:
+            if call is not None and call.aborted:
+                ok = None
+            elif response is None:
+                record_upstream_call(backend.url, path, error_kind=upstream_error_kind(e))
+            raise
+        finally:
+            if response is not None:
+                response.close()
+            self.release(backend, ok)
+
+    @staticmethod
+    def abort(response):
+        """
+        Nekavējoties aizver straumētas atbildes savienojumu (drīkst izsaukt no cita pavediena)
+        Serveris pamana atvienošanos un pārtrauc ģenerēšanu
+        """
+        # Pēc tam radusies savienojuma kļūda netiek uzskatīta par servera kļūmi
+        response.aborted = True
+        connection = getattr(response.raw, '_connection', None)
+        sock = getattr(connection, 'sock', None)
+        if sock is not None:
+            try:
+                # Pamodina pavedienu, kas gaida datus no šī savienojuma
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        response.close()
+
+    def get_json(self, path, backend=None, timeout=None):
+        """
+        GET pieprasījums, kas atgriež JSON atbildi
+        """
+        with self.request('GET', path, backend=backend, timeout=timeout) as response:
+            response.raise_for_status()
+            return response.json()
+
+    def post_json(self, path, payload, model=None, timeout=None):
+        """
+        POST pieprasījums (bez straumēšanas), kas atgriež JSON atbildi
+        """
+        with self.request('POST', path, model=model, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            return response.json()
+
+    def health_check(self):
+        """
+        Pārbauda visus serverus un atjaunina to pieejamo modeļu sarakstus
+        """
+        timeout = (app.config['UPSTREAM_CONNECT_TIMEOUT'], app.config['MODEL_FETCH_TIMEOUT'])
+        for backend in self.backends:
+            try:
+                data = self.get_json('/v1/models', backend=backend, timeout=timeout)
+                backend.models = {m['id'] for m in data.get('data', [])}
+            except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                logger.warning(f"LM Studio servera veselības pārbaude neizdevās ({backend.url}): {e}")
+                continue
+            if backend.reports_state:
+                self.refresh_loaded_models(backend, timeout)
+
+    def refresh_loaded_models(self, backend, timeout):
+        """
+        Nolasa, kuri modeļi serverī ir ielādēti atmiņā (LM Studio REST API)
+        Serveri, kas šo API neatbalsta, turpmāk vairs netiek vaicāti
+        """
+        try:
+            data = self.get_json('/api/v0/models', backend=backend, timeout=timeout)
+            backend.loaded_models = {m['id'] for m in data.get('data', []) if m.get('state') == 'loaded'}
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                backend.reports_state = False
+            backend.loaded_models = None
+        except (requests.exceptions.RequestException, ValueError, KeyError, AttributeError):
+            backend.loaded_models = None
+
+    def healthy_backends(self):
+        now = time.monotonic()
+        return [b for b in self.backends if b.is_healthy(now)]
+
+
+# Kopīgais savienojumu pūls visiem LM Studio pieprasījumiem
+upstream = UpstreamPool(
+    LM_STUDIO_BACKENDS,
+    pool_size=app.config['UPSTREAM_POOL_SIZE'],
+    max_failures=app.config['UPSTREAM_MAX_FAILURES'],
+    eject_seconds=app.config['UPSTREAM_EJECT_SECONDS']
+)
+
+
+class ModelWarmer:
+    """
+    Modeļu iesildīšana - ielādē modeli LM Studio atmiņā pirms pirmā lietotāja pieprasījuma
+    Iesildīšana ir minimāls pieprasījums (1 tokens), kas liek LM Studio ielādēt modeli (JIT ielāde),
+    tāpēc pirmā /get_response atbilde negaida modeļa ielādi
+    Stāvokļi: 'loaded', 'loading', 'unloaded', 'error' vai 'unknown' (serveris stāvokli nenorāda)
+    """
+
+    def __init__(self, pool, workers=2):
+        self.pool = pool
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='model-warmer')
+        self.lock = threading.Lock()
+        self.pending = {}   # Modelis -> iesildīšanas sākuma laiks (time.monotonic)
+        self.warmed = {}    # Modelis -> pēdējās veiksmīgās ielādes laiks (time.monotonic)
+        self.failed = {}    # Modelis -> (kļūdas laiks, kļūdas teksts)
+
+    def state(self, model):
+        """
+        Atgriež modeļa stāvokli šajā procesā
+        """
+        now = time.monotonic()
+        with self.lock:
+            if model in self.pending:
+                return 'loading'
+            warmed = self.warmed.get(model)
+            failed = self.failed.get(model)
+
+        resident = self.pool.is_resident(model)
+        if resident:
+            return 'loaded'
+        if failed and now - failed[0] < app.config['MODEL_WARMUP_RETRY']:
+            return 'error'
+        if resident is False:
+            return 'unloaded'
+        if warmed and now - warmed < app.config['MODEL_WARMUP_TTL']:
+            # Serveris stāvokli nenorāda - paļaujas uz nesenu veiksmīgu pieprasījumu
+            return 'loaded'
+        return 'unknown'
+
+    def status(self, models):
+        """
+        Atgriež vairāku modeļu stāvokļus UI vajadzībām
+        Atgriež: vārdnīca {modeļa ID: {'state': ..., 'error': ...}}
+        """
+        result = {}
+        for model in models:
+            state = self.state(model)
+            entry = {'state': state}
+            if state == 'error':
+                with self.lock:
+                    entry['error'] = self.failed.get(model, (0, None))[1]
+            result[model] = entry
+        return result
+
+    def warm(self, model):
+        """
+        Sāk modeļa iesildīšanu fonā, ja tas vēl nav ielādēts vai tiek ielādēts
+        Parametri:
+            model: modeļa ID
+        Atgriež: modeļa stāvoklis pēc izsaukuma
+        """
+        if not model:
+            return 'unknown'
+        state = self.state(model)
+        if state in ('loaded', 'loading', 'error'):
+            return state
+
+        with self.lock:
+            if model in self.pending:
+                return 'loading'
+            self.pending[model] = time.monotonic()
+        try:
+            self.executor.submit(self._warm, model)
+        except RuntimeError:
+            # Izpildītājs apturēts (procesa beigas)
+            with self.lock:
+                self.pending.pop(model, None)
+            return state
+        return 'loading'
+
+    def _warm(self, model):
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": "."}],
+            "max_tokens": 1,
+            "temperature": 0,
+            "stream": False
+        }
+        timeout = (app.config['UPSTREAM_CONNECT_TIMEOUT'], app.config['MODEL_WARMUP_TIMEOUT'])
+        backend = self.pool.pick(model)
+        started = time.perf_counter()
+        try:
+            with self.pool.request('POST', '/v1/chat/completions', backend=backend, json=payload,
+                                   timeout=timeout) as response:
+                response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Modeļa iesildīšana neizdevās ({model}, {backend.url}): {e}")
+            MODEL_WARMUPS.inc(model, 'error')
+            with self.lock:
+                self.pending.pop(model, None)
+                self.failed[model] = (time.monotonic(), str(e))
+            return
+
+        duration = time.perf_counter() - started
+        MODEL_WARMUPS.inc(model, 'ok')
+        MODEL_WARMUP_DURATION.observe(duration, model)
+        logger.info(f"Modelis iesildīts: {model} ({backend.url}, {duration:.1f}s)")
+        self.mark_loaded(backend, model)
+
+    def mark_loaded(self, backend, model):
+        """
+        Atzīmē, ka modelis serverī ir ielādēts (pēc iesildīšanas vai veiksmīgas ģenerācijas)
+        """
+        with self.lock:
+            self.pending.pop(model, None)
+            self.failed.pop(model, None)
+            self.warmed[model] = time.monotonic()
+        if backend.loaded_models is not None:
+            backend.loaded_models = backend.loaded_models | {model}
+
+
+# Modeļu iesildīšana (stāvoklis katrā procesā)
+model_warmer = ModelWarmer(upstream, workers=app.config['MODEL_WARMUP_WORKERS'])
+
+
+def recent_user_model(user_id):
+    """
+    Atrod modeli, ko lietotājs izmantoja pēdējo reizi (pēdējo čatu assistenta ziņojumos)
+    Atgriež: modeļa ID vai None
+    """
+    recent_chats = db.select(Chat.id).where(Chat.user_id == user_id) \
+        .order_by(Chat.created_at.desc()).limit(5).subquery()
+    return db.session.execute(
+        db.select(Message.model)
+        .where(Message.chat_id.in_(db.select(recent_chats.c.id)),
+               Message.role == 'assistant', Message.model.isnot(None), Message.model != '')
+        .order_by(Message.timestamp.desc())
+        .limit(1)
+    ).scalar()
+
+
+class CompletionCache:
+    """
+    Precīzas sakritības kešatmiņa LM Studio atbildēm (ieslēdz ar COMPLETION_CACHE_MAX_BYTES)
+    Atslēga - modelis, normalizēts ziņojumu saraksts un izlases parametri; atkārtots pieprasījums
+    (nosaukuma uzvedne, bieži pirmie jautājumi, identiskas vēstures) netērē GPU laiku
+    Atmiņā ierobežota pēc kopējā izmēra (LRU) un vecuma (TTL); pēc izvēles ieraksti tiek saglabāti
+    SQLite failā, kas ir kopīgs visiem darba procesiem un saglabājas pēc restartēšanas
+    """
+
+    # Pieprasījuma parametri, kas ietekmē atbildi (pārējie, piemēram, stream, atslēgā netiek iekļauti)
+    SAMPLING_PARAMS = ('temperature', 'top_p', 'top_k', 'min_p', 'max_tokens', 'seed', 'stop',
+                       'presence_penalty', 'frequency_penalty', 'repeat_penalty', 'response_format')
+
+    def __init__(self, max_bytes, ttl, path=None, disk_max_bytes=0, max_temperature=0.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.path = path
+        self.disk_max_bytes = disk_max_bytes
+        self.max_temperature = max_temperature
+        self.entries = OrderedDict()    # Atslēga -> (izveides laiks, teksts, izmērs baitos)
+        self.bytes = 0
+        self.stores = 0
+        self.lock = threading.Lock()
+        self.connection = None
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def cacheable(self, payload):
+        """
+        Vai atbildi drīkst ņemt no kešatmiņas un saglabāt tajā
+        Ar augstu temperatūru katra atbilde ir jauna, ja vien nav norādīts fiksēts seed
+        """
+        if not self.enabled:
+            return False
+        if payload.get('seed') is not None:
+            return True
+        return float(payload.get('temperature', 1.0)) <= self.max_temperature
+
+    @classmethod
+    def make_key(cls, payload):
+        """
+        Atslēga no modeļa, ziņojumiem (atstarpes normalizētas) un izlases parametriem
+        """
+        messages = [{'role': str(message.get('role', '')).lower(),
+                     'content': ' '.join(str(message.get('content') or '').split())}
+                    for message in payload.get('messages', [])]
+        params = {name: payload[name] for name in cls.SAMPLING_PARAMS if name in payload}
+        material = json.dumps({'model': payload.get('model'), 'messages': messages, 'params': params},
+                              sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def lookup(self, payload, kind='chat'):
+        """
+        Atrod kešotu atbildi
+        Parametri:
+            payload: /v1/chat/completions pieprasījuma dati
+            kind: pieprasījuma veids statistikai ('chat', 'title')
+        Atgriež: atbildes teksts vai None
+        """
+        if not self.cacheable(payload):
+            if self.enabled:
+                COMPLETION_CACHE_REQUESTS.inc(kind, 'bypass')
+            return None
+        key = self.make_key(payload)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+            elif self.path:
+                entry = self._disk_get(key, now)
+                if entry is not None:
+                    self._insert(key, entry[0], entry[1])
+        COMPLETION_CACHE_REQUESTS.inc(kind, 'miss' if entry is None else 'hit')
+        return None if entry is None else entry[1]
+
+    def store(self, payload, text):
+        """
+        Saglabā pabeigtu atbildi (tukšas un pārāk lielas atbildes netiek saglabātas)
+        """
+        if not text or not self.cacheable(payload):
+            return
+        key = self.make_key(payload)
+        now = time.time()
+        with self.lock:
+            self._insert(key, now, text)
+            if self.path:
+                self._disk_put(key, payload.get('model'), text, now)
+
+    def _insert(self, key, created_at, text):
+        # Izsaukt tikai ar self.lock slēdzeni
+        size = len(text.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (created_at, text, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            # Izspiež ilgāk neizmantotos ierakstus
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, _, size = self.entries.pop(key)
+        self.bytes -= size
+
+    def _disk(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS completion_cache (key TEXT PRIMARY KEY, model TEXT, content TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS ix_completion_cache_used_at ON completion_cache (used_at)")
+        return self.connection
+
+    def _disk_get(self, key, now):
+        try:
+            connection = self._disk()
+            row = connection.execute("SELECT created_at, content FROM completion_cache WHERE key = ?",
+                                     (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[0] > self.ttl:
+                connection.execute("DELETE FROM completion_cache WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE completion_cache SET used_at = ? WHERE key = ?", (now, key))
+            return row
+        except sqlite3.Error as e:
+            logger.warning(f"Atbilžu kešatmiņas faila kļūda: {e}")
+            return None
+
+    def _disk_put(self, key, model, text, now):
+        try:
+            connection = self._disk()
+            connection.execute(
+                "INSERT OR REPLACE INTO completion_cache (key, model, content, size, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", (key, model, text, len(text.encode('utf-8')), now, now))
+            self.stores += 1
+            if self.stores % 100 == 1:
+                self._disk_prune(now)
+        except sqlite3.Error as e:
+            logger.warning(f"Atbilžu kešatmiņas faila kļūda: {e}")
+
+    def _disk_prune(self, now):
+        """
+        Dzēš novecojušus ierakstus un ilgāk neizmantotos, ja fails pārsniedz COMPLETION_CACHE_DISK_MAX_BYTES
+        """
+        connection = self._disk()
+        connection.execute("DELETE FROM completion_cache WHERE created_at < ?", (now - self.ttl,))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM completion_cache").fetchone()[0]
+        while self.disk_max_bytes and total > self.disk_max_bytes:
+            rows = connection.execute("SELECT key, size FROM completion_cache ORDER BY used_at LIMIT 100").fetchall()
+            if not rows:
+                break
+            connection.executemany("DELETE FROM completion_cache WHERE key = ?", [(row[0],) for row in rows])
+            total -= sum(row[1] for row in rows)
+
+    def disk_stats(self):
+        """
+        Atgriež (ierakstu skaits, satura izmērs baitos) kešatmiņas failā
+        """
+        with self.lock:
+            return self._disk().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completion_cache").fetchone()
+
+    def clear(self):
+        """
+        Iztukšo kešatmiņu atmiņā un diskā
+        """
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+            if self.path:
+                self._disk().execute("DELETE FROM completion_cache")
+
+
+# Atbilžu kešatmiņa (atmiņā katram procesam, fails - kopīgs)
+completion_cache = CompletionCache(
+    app.config['COMPLETION_CACHE_MAX_BYTES'],
+    app.config['COMPLETION_CACHE_TTL'],
+    path=app.config['COMPLETION_CACHE_PATH'] or None,
+    disk_max_bytes=app.config['COMPLETION_CACHE_DISK_MAX_BYTES'],
+    max_temperature=app.config['COMPLETION_CACHE_MAX_TEMPERATURE']
+)
+metrics.register(Gauge('completion_cache_entries', "Atbilžu kešatmiņas ieraksti šī procesa atmiņā",
+                       collect=lambda: {(): len(completion_cache.entries)}))
+metrics.register(Gauge('completion_cache_bytes', "Atbilžu kešatmiņas saturs šī procesa atmiņā (baiti)",
+                       collect=lambda: {(): completion_cache.bytes}))
+
+
+def announce_model_load(job):
+    """
+    Ja modelis vēl nav ielādēts, paziņo klientiem, ka atbilde sāksies pēc modeļa ielādes
+    """
+    state = model_warmer.state(job.model_id)
+    if state in ('unloaded', 'loading'):
+        job.publish({'model_loading': {'model': job.model_id, 'state': state}})
+
+
+# Funkcija pieejamo modeļu ielādei no LM Studio
+def fetch_models_from_lm_studio():
+    """
+    Pieprasa modeļu sarakstu no visiem LM Studio serveriem un atzīmē, kuri modeļi ir ielādēti atmiņā
+    Atgriež: apvienots saraksts ar modeļiem (katram ir lauks 'loaded': True/False/None)
+    Izmet: requests.exceptions.RequestException, ja neviens serveris nav pieejams
+    """
+    timeout = (app.config['UPSTREAM_CONNECT_TIMEOUT'], app.config['MODEL_FETCH_TIMEOUT'])
+    backends = upstream.healthy_backends() or upstream.backends
+    models = {}
+    last_error = None
+
+    for backend in backends:
+        try:
+            data = upstream.get_json('/v1/models', backend=backend, timeout=timeout)["data"]
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            last_error = e
+            continue
+
+        # LM Studio REST API (/api/v0) papildus norāda modeļa stāvokli
+        states = {}
+        try:
+            state_data = upstream.get_json('/api/v0/models', backend=backend, timeout=timeout)
+            states = {m["id"]: m.get("state") for m in state_data.get("data", [])}
+        except (requests.exceptions.RequestException, ValueError, KeyError):
+            pass
+
+        for model in data:
+            state = states.get(model["id"])
+            loaded = None if state is None else state == "loaded"
+            known = models.get(model["id"])
+            if known is None:
+                model["loaded"] = loaded
+                models[model["id"]] = model
+            elif loaded:
+                # Modelis ir ielādēts vismaz vienā serverī
+                known["loaded"] = True
+
+    if not models and last_error is not None:
+        raise last_error
+    return list(models.values())
+
+
+def refresh_model_catalog(force=False):
+    """
+    Atjaunina kopīgo modeļu katalogu datubāzē
+    Parametri:
+        force: atjaunināt arī tad, ja TTL vēl nav beidzies
+    Atgriež: True, ja šis process veica atjaunināšanu
+    """
+    ttl = app.config['MODEL_CACHE_TTL']
+    now = datetime.datetime.utcnow()
+
+    # Nodrošina, ka kataloga rinda eksistē
+    if db.session.get(ModelCatalog, 1) is None:
+        db.session.add(ModelCatalog(id=1, data='[]'))
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+    # Atomāri "rezervē" atjaunināšanu, lai vairāki procesi vienlaikus nepārslogotu LM Studio
+    query = ModelCatalog.query.filter(ModelCatalog.id == 1)
+    if not force:
+        threshold = now - datetime.timedelta(seconds=ttl)
+        query = query.filter(db.or_(ModelCatalog.last_attempt.is_(None), ModelCatalog.last_attempt < threshold))
+    claimed = query.update({'last_attempt': now}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return False
+
+    try:
+        models = fetch_models_from_lm_studio()
+        ModelCatalog.query.filter_by(id=1).update({
+            'data': json.dumps(models),
+            'refreshed_at': datetime.datetime.utcnow(),
+            'last_error': None
+        }, synchronize_session=False)
+    except Exception as e:
+        # Saglabā iepriekšējos datus, tikai atzīmē kļūdu
+        logger.error(f"Modeļu kataloga atjaunināšanas kļūda: {e}")
+        ModelCatalog.query.filter_by(id=1).update({'last_error': str(e)[:500]}, synchronize_session=False)
+    db.session.commit()
+    return True
+
+
+def get_model_catalog():
+    """
+    Nolasa modeļu katalogu no kešatmiņas (nekad negaida uz LM Studio, ja dati jau ir)
+    Atgriež: vārdnīca ar 'models', 'refreshed_at', 'stale' un 'error'
+    """
+    catalog = db.session.get(ModelCatalog, 1)
+    if catalog is None or (catalog.refreshed_at is None and catalog.last_attempt is None):
+        # Pirmais pieprasījums pēc palaišanas - katalogs vēl nav aizpildīts
+        refresh_model_catalog(force=True)
+        db.session.expire_all()
+        catalog = db.session.get(ModelCatalog, 1)
+
+    ttl = app.config['MODEL_CACHE_TTL']
+    refreshed_at = catalog.refreshed_at if catalog else None
+    stale = (refreshed_at is None
+             or datetime.datetime.utcnow() - refreshed_at > datetime.timedelta(seconds=ttl * 2))
+    return {
+        'models': json.loads(catalog.data) if catalog else [],
+        'refreshed_at': refreshed_at.isoformat() + 'Z' if refreshed_at else None,
+        'stale': stale,
+        'error': catalog.last_error if catalog else None
+    }
+
+
+# Funkcija pieejamo modeļu pārbaudei LM Studio
+def get_available_models():
+    """
+    Iegūst pieejamo modeļu sarakstu no kešatmiņas
+    Atgriež: saraksts ar modeļiem vai tukšs saraksts, ja katalogs vēl nav ielādēts
+    """
+    try:
+        return get_model_catalog()['models']
+    except Exception as e:
+        logger.error(f"Modeļu kataloga nolasīšanas kļūda: {e}")
+        db.session.rollback()
+        return []
+
+
+def model_catalog_refresher():
+    """
+    Fona pavediens, kas periodiski atjaunina modeļu katalogu
+    """
+    while True:
+        with app.app_context():
+            try:
+                refresh_model_catalog()
+            except Exception as e:
+                logger.error(f"Fona modeļu atjaunināšanas kļūda: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+        time.sleep(max(1, app.config['MODEL_CACHE_TTL'] // 2))
+
+
+def upstream_health_checker():
+    """
+    Fona pavediens, kas periodiski pārbauda LM Studio serveru veselību
+    """
+    while True:
+        try:
+            upstream.health_check()
+        except Exception as e:
+            logger.error(f"Veselības pārbaudes kļūda: {e}")
+        time.sleep(app.config['UPSTREAM_HEALTH_INTERVAL'])
+
+
+def start_background_workers():
+    """
+    Palaiž fona pavedienus (vienreiz katrā procesā)
+    """
+    if getattr(start_background_workers, 'started', False):
+        return
+    start_background_workers.started = True
+    threading.Thread(target=model_catalog_refresher, name='model-catalog-refresher', daemon=True).start()
+    threading.Thread(target=upstream_health_checker, name='upstream-health-checker', daemon=True).start()
+    threading.Thread(target=generation_registry_watcher, name='generation-registry-watcher', daemon=True).start()
+    if app.config['RETENTION_INTERVAL'] > 0:
+        threading.Thread(target=retention_worker, name='retention-worker', daemon=True).start()
+
+
+# Funkcija lietotāja IP adreses iegūšanai
+def get_client_ip():
+    """
+    Iegūst klienta IP adresi, ņemot vērā proxy serverus
+    Atgriež: IP adrese kā string
+    """
+    # Pārbauda, vai ir proxy headers
+    if request.environ.get('HTTP_X_FORWARDED_FOR') is not None:
+        return request.environ['HTTP_X_FORWARDED_FOR']
+    # Ja nav proxy, izmanto tiešo IP
+    return request.remote_addr
+
+def request_chat_title(first_message, model_id):
+    """
+    Pieprasa čata nosaukumu no LM Studio
+    Parametri:
+        first_message: pirmais ziņojums čatā
+        model_id: modeļa ID, kas tiks izmantots nosaukuma ģenerēšanai
+    Atgriež: ģenerēto nosaukumu
+    Izmet: requests.exceptions.RequestException, KeyError vai JSONDecodeError kļūdas gadījumā
+    """
+    # Pieprasījuma dati nosaukuma ģenerēšanai
+    payload = {
+        "model": model_id,
+        "messages": [
+            {"role": "system", "content": "Ģenerē īsu nosaukumu lietotāja valodā, pamatojoties uz ziņojumu. Dod tikai 1-2 vārdus kā atbildi, bez pēdiņām."},
+            {"role": "user", "content": f"Ziņojums: {first_message}"}
+        ],
+        "temperature": 0,    # Deterministisks nosaukums, tāpēc to drīkst kešot (COMPLETION_CACHE_MAX_TEMPERATURE)
+        "max_tokens": 20     # Maksimālais tokenu skaits
+    }
+
+    # Tā pati uzvedne tam pašam modelim - nosaukums no kešatmiņas
+    title_text = completion_cache.lookup(payload, kind='title')
+    if title_text is None:
+        # Sūta pieprasījumu uz API caur savienojumu pūlu
+        timeout = (app.config['UPSTREAM_CONNECT_TIMEOUT'], 15)
+        title_data = upstream.post_json('/v1/chat/completions', payload, model=model_id, timeout=timeout)
+        title_text = title_data['choices'][0]['message']['content']
+        completion_cache.store(payload, title_text)
+
+    # Apstrādā atbildi
+    title_text = title_text.strip('"')
+
+    # Noņem "Title:" prefiksu, ja tas ir
+    title_text = re.sub(r'^Title:?\s*', '', title_text, flags=re.IGNORECASE)
+    logger.info(f"Jauns ģenerētais nosaukums: '{title_text}'")
+    return title_text
+
+
+class TitleQueue:
+    """
+    Fona rinda čatu nosaukumu ģenerēšanai
+    Vienādi pirmie ziņojumi tiek apvienoti vienā pieprasījumā, un rezultāti tiek kešoti
+    """
+
+    def __init__(self, workers, cache_size):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='title-worker')
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.pending = {}           # Atslēga -> Future (izpildē esošie pieprasījumi)
+        self.cache = OrderedDict()  # Atslēga -> nosaukums (LRU)
+        self.ready = OrderedDict()  # Čata ID -> nosaukums, kas vēl nav nosūtīts klientam
+
+    @staticmethod
+    def make_key(first_message, model_id):
+        # Normalizē atstarpes un reģistru, lai vienādi ziņojumi dotu vienādu atslēgu
+        return model_id, ' '.join(first_message.split()).lower()
+
+    def submit(self, chat_id, first_message, model_id):
+        """
+        Ieliek nosaukuma ģenerēšanu rindā
+        Parametri:
+            chat_id: čata ID
+            first_message: pirmais ziņojums čatā
+            model_id: modeļa ID
+        Atgriež: nosaukumu, ja tas jau bija kešatmiņā, citādi None
+        """
+        if not model_id or model_id.strip() == "":
+            return self.apply(chat_id, first_message[:50] + "...")
+
+        key = self.make_key(first_message, model_id)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                title = self.cache[key]
+                future = None
+            else:
+                future = self.pending.get(key)
+                if future is None:
+                    future = self.executor.submit(request_chat_title, first_message, model_id)
+                    self.pending[key] = future
+                    future.add_done_callback(lambda f: self._finish(key, f))
+
+        if future is None:
+            return self.apply(chat_id, title)
+        future.add_done_callback(lambda f: self._deliver(chat_id, first_message, f))
+        return None
+
+    def _finish(self, key, future):
+        # Kešo tikai veiksmīgi ģenerētos nosaukumus
+        with self.lock:
+            self.pending.pop(key, None)
+            if future.exception() is None:
+                self.cache[key] = future.result()
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def _deliver(self, chat_id, first_message, future):
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Nosaukuma ģenerēšanas kļūda: {error}")
+            title = first_message[:50] + "..."
+        else:
+            title = future.result()
+        try:
+            self.apply(chat_id, title)
+        except Exception as e:
+            logger.error(f"Nosaukuma saglabāšanas kļūda: {e}")
+
+    def apply(self, chat_id, title):
+        """
+        Saglabā nosaukumu datubāzē (ja lietotājs to vēl nav mainījis) un atzīmē to nosūtīšanai
+        Atgriež: saglabāto nosaukumu
+        """
+        title = title[:97] + "..." if len(title) > 100 else title
+        with app.app_context():
+            try:
+                updated = Chat.query.filter_by(id=chat_id, title=DEFAULT_CHAT_TITLE).update(
+                    {'title': title}, synchronize_session=False)
+                if updated:
+                    index_chat_title(chat_id)
+                db.session.commit()
+            finally:
+                db.session.remove()
+        with self.lock:
+            self.ready[str(chat_id)] = title
+            while len(self.ready) > self.cache_size:
+                self.ready.popitem(last=False)
+        return title
+
+    def pop_ready(self, chat_id):
+        """
+        Atgriež gatavo nosaukumu, kas vēl nav nosūtīts klientam (vai None)
+        """
+        if not self.ready:
+            return None
+        with self.lock:
+            return self.ready.pop(str(chat_id), None)
+
+
+# Čatu nosaukumu ģenerēšanas rinda
+title_queue = TitleQueue(app.config['TITLE_WORKERS'], app.config['TITLE_CACHE_SIZE'])
+
+def get_page_limit(default):
+    """
+    Nolasa lapas izmēru no pieprasījuma parametra 'limit'
+    """
+    limit = request.args.get('limit', type=int) or default
+    return max(1, min(limit, app.config['MAX_PAGE_SIZE']))
+
+
+def load_messages_page(chat_id, before_id=None, limit=None):
+    """
+    Ielādē vienu čata ziņojumu lapu (jaunākie vispirms, keyset lapošana)
+    Parametri:
+        chat_id: čata ID
+        before_id: vecākā jau ielādētā ziņojuma ID (kursors) vai None
+        limit: ziņojumu skaits lapā
+    Atgriež: (ziņojumi hronoloģiskā secībā, kursors vecākiem ziņojumiem vai None)
+    """
+    limit = limit or app.config['MESSAGE_PAGE_SIZE']
+    query = Message.query.filter_by(chat_id=chat_id)
+    if before_id is not None:
+        anchor = db.session.get(Message, before_id)
+        if anchor is None or anchor.chat_id != int(chat_id):
+            return [], None
+        query = query.filter(db.tuple_(Message.timestamp, Message.id) < (anchor.timestamp, anchor.id))
+
+    rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    return rows, (rows[0].id if has_more and rows else None)
+
+
+def load_chats_page(user_id, before_id=None, limit=None):
+    """
+    Ielādē vienu lietotāja čatu lapu (jaunākie vispirms, keyset lapošana)
+    Parametri:
+        user_id: lietotāja ID
+        before_id: pēdējā jau ielādētā čata ID (kursors) vai None
+        limit: čatu skaits lapā
+    Atgriež: (čati, kursors nākamajai lapai vai None)
+    """
+    limit = limit or app.config['CHAT_PAGE_SIZE']
+    query = Chat.query.filter_by(user_id=user_id)
+    if before_id is not None:
+        anchor = db.session.get(Chat, before_id)
+        if anchor is None or anchor.user_id != user_id:
+            return [], None
+        query = query.filter(db.tuple_(Chat.created_at, Chat.id) < (anchor.created_at, anchor.id))
+
+    rows = query.order_by(Chat.created_at.desc(), Chat.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (rows[-1].id if has_more and rows else None)
+
+
+def message_to_dict(message):
+    """
+    Pārveido ziņojumu par JSON vārdnīcu
+    """
+    return {
+        'id': message.id,
+        'role': message.role,
+        'content': message.content,
+        'model': message.model,
+        'status': message.status,
+        'timestamp': message.timestamp.isoformat() + 'Z' if message.timestamp else None
+    }
+
+
+def index_message(message_id):
+    """
+    Ievieto vai atjauno ziņojumu meklēšanas indeksā (pašreizējā transakcijā, bez commit)
+    """
+    db.session.execute(db.text("DELETE FROM search_index WHERE rowid = :id"), {'id': message_id})
+    db.session.execute(db.text(
+        "INSERT INTO search_index (rowid, body, owner, chat_id) "
+        "SELECT message.id, message.content, 'u' || chat.user_id, message.chat_id "
+        "FROM message JOIN chat ON chat.id = message.chat_id "
+        "WHERE message.id = :id AND message.content != ''"), {'id': message_id})
+
+
+def index_chat_title(chat_id):
+    """
+    Ievieto vai atjauno čata nosaukumu meklēšanas indeksā (noklusējuma nosaukums netiek indeksēts)
+    """
+    db.session.execute(db.text("DELETE FROM search_index WHERE rowid = :rowid"), {'rowid': -int(chat_id)})
+    db.session.execute(db.text(
+        "INSERT INTO search_index (rowid, body, owner, chat_id) "
+        "SELECT -chat.id, chat.title, 'u' || chat.user_id, chat.id FROM chat "
+        "WHERE chat.id = :id AND chat.title != :default"), {'id': int(chat_id), 'default': DEFAULT_CHAT_TITLE})
+
+
+def unindex_chat_title(chat_id):
+    """
+    Izņem čata nosaukumu no meklēšanas indeksa
+    """
+    db.session.execute(db.text("DELETE FROM search_index WHERE rowid = :rowid"), {'rowid': -int(chat_id)})
+
+
+def unindex_messages(message_ids):
+    """
+    Izņem ziņojumus no meklēšanas indeksa (jāizsauc pirms ziņojumu dzēšanas)
+    Dzēšana notiek pēc rowid, tāpēc nav jāpārskata viss indekss
+    """
+    if message_ids:
+        db.session.execute(db.text("DELETE FROM search_index WHERE rowid IN :ids").bindparams(
+            db.bindparam('ids', expanding=True)), {'ids': list(message_ids)})
+
+
+def bulk_insert_messages(rows, user_id):
+    """
+    Ievieto daudzus ziņojumus vienā izpildē un pievieno tos meklēšanas indeksam (bez commit)
+    Parametri:
+        rows: ziņojumu vārdnīcas (chat_id, role, content, model, status, timestamp)
+        user_id: čatu īpašnieks (meklēšanas indeksam)
+    Atgriež: jauno ziņojumu ID tādā pašā secībā
+    """
+    if not rows:
+        return []
+    # RETURNING ar parametru secību dod jaunos ID meklēšanas indeksam
+    ids = db.session.execute(db.insert(Message).returning(Message.id, sort_by_parameter_order=True),
+                             rows).scalars().all()
+    entries = [{'id': message_id, 'body': row['content'], 'owner': f"u{user_id}", 'chat_id': row['chat_id']}
+               for message_id, row in zip(ids, rows) if row['content']]
+    if entries:
+        db.session.execute(db.text(
+            "INSERT INTO search_index (rowid, body, owner, chat_id) VALUES (:id, :body, :owner, :chat_id)"), entries)
+    return ids
+
+
+def build_search_query(text, user_id):
+    """
+    Pārveido lietotāja ievadi par drošu FTS5 vaicājumu
+    Visi vārdi ir obligāti, pēdējais tiek meklēts kā prefikss (rakstīšanas laikā)
+    Atgriež: vaicājuma teksts vai None, ja ievadē nav neviena vārda
+    """
+    terms = re.findall(r'\w+', text or '')[:16]
+    if not terms:
+        return None
+    phrases = [f'body : "{term}"' for term in terms]
+    phrases[-1] += '*'
+    return f'owner : "u{int(user_id)}" AND ' + ' AND '.join(phrases)
+
+
+def search_messages(user_id, text, offset=0, limit=None):
+    """
+    Meklē lietotāja ziņojumos un čatu nosaukumos (kārtots pēc atbilstības, bm25)
+    Parametri:
+        user_id: lietotāja ID
+        text: meklējamais teksts
+        offset: cik rezultātus izlaist
+        limit: rezultātu skaits lapā
+    Atgriež: (rezultātu saraksts, nākamās lapas nobīde vai None)
+    """
+    limit = limit or app.config['SEARCH_PAGE_SIZE']
+    query = build_search_query(text, user_id)
+    if query is None:
+        return [], None
+
+    # Fragmenta iezīmes ir kontrolsimboli, lai saturu varētu droši pārveidot par HTML
+    rows = db.session.execute(db.text(
+        "SELECT search_index.rowid AS rowid, search_index.chat_id AS chat_id, chat.title AS title, "
+        "snippet(search_index, 0, char(2), char(3), '…', 16) AS snippet, "
+        "message.role AS role, message.timestamp AS timestamp "
+        "FROM search_index "
+        "JOIN chat ON chat.id = search_index.chat_id "
+        "LEFT JOIN message ON message.id = search_index.rowid "
+        "WHERE search_index MATCH :query AND chat.user_id = :user_id "
+        "ORDER BY bm25(search_index, 1.0, 0.0) "
+        "LIMIT :limit OFFSET :offset"),
+        {'query': query, 'user_id': user_id, 'limit': limit + 1, 'offset': offset}).fetchall()
+
+    has_more = len(rows) > limit
+    results = []
+    for row in rows[:limit]:
+        snippet = html.escape(row.snippet or '').replace('\x02', '<mark>').replace('\x03', '</mark>')
+        results.append({
+            'chat_id': int(row.chat_id),
+            'chat_title': row.title,
+            'message_id': row.rowid if row.rowid > 0 else None,
+            'role': row.role,
+            'snippet': snippet,
+            'timestamp': f"{row.timestamp}".replace(' ', 'T') + 'Z' if row.timestamp else None
+        })
+    return results, (offset + limit if has_more else None)
+
+
+class StaticAssets:
+    """
+    Statisko failu versijas ar satura hešu nosaukumā un iepriekš saspiestiem variantiem (.gz, .br)
+    Nosaukums mainās līdz ar saturu, tāpēc pārlūks versijas drīkst kešot neierobežoti (immutable)
+    """
+
+    # Paplašinājumi, kuriem tiek veidoti saspiestie varianti (attēli un fonti jau ir saspiesti)
+    COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.map', '.txt')
+
+    def __init__(self, source_dir, build_dir):
+        self.source_dir = source_dir
+        self.build_dir = build_dir
+        self.manifest = {}  # Ceļš static mapē -> versijas ceļš build mapē
+        self.signature = None  # Avota failu (ceļš, mtime, izmērs) pēdējās būvēšanas brīdī
+
+    def _sources(self):
+        # Avota faili: (pilns ceļš, ceļš static mapē), bez build mapes
+        build_dir = os.path.abspath(self.build_dir)
+        for root, dirs, files in os.walk(self.source_dir):
+            dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != build_dir)
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, self.source_dir).replace(os.sep, '/')
+
+    def _signature(self):
+        signature = []
+        for path, logical in self._sources():
+            stat = os.stat(path)
+            signature.append((logical, stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def build(self):
+        """
+        Izveido trūkstošās versijas visiem statiskajiem failiem un atjaunina manifestu
+        Esošie faili netiek pārrakstīti (saturu nosaka nosaukums), tāpēc to droši var izsaukt katrā procesā
+        Atgriež: manifests
+        """
+        manifest = {}
+        # Paraksts pirms lasīšanas - ja fails mainās būvēšanas laikā, nākamā refresh() būvē vēlreiz
+        signature = self._signature()
+        for path, logical in self._sources():
+            with open(path, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            self._write(hashed, lambda: data)
+            if ext.lower() in self.COMPRESSIBLE:
+                self._write(hashed + '.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    self._write(hashed + '.br', lambda: brotli.compress(data, quality=11))
+            manifest[logical] = hashed
+
+        # Manifests arī failā - lai tos pašus failus var pasniegt reversais proxy
+        self._write('manifest.json', lambda: json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'),
+                    replace=True)
+        self.manifest = manifest
+        self.signature = signature
+        return manifest
+
+    def refresh(self):
+        """
+        Pārbūvē versijas tikai tad, ja kāds avota fails ir mainīts, pievienots vai izdzēsts
+        (pārbaude izmanto tikai os.stat, failu saturs netiek lasīts)
+        """
+        if self._signature() != self.signature:
+            self.build()
+
+    def _write(self, name, produce, replace=False):
+        target = os.path.join(self.build_dir, name)
+        if not replace and os.path.exists(target):
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Vispirms pagaidu fails, lai cits process neredz pusē ierakstītu failu
+        temporary = f"{target}.{os.getpid()}.tmp"
+        with open(temporary, 'wb') as f:
+            f.write(produce())
+        os.replace(temporary, target)
+
+    def clean(self):
+        """
+        Izdzēš versijas, kas vairs nav manifestā (iepriekšējo izvietošanu faili)
+        Atgriež: izdzēsto failu skaits
+        """
+        keep = {'manifest.json'}
+        for hashed in self.manifest.values():
+            keep.update((hashed, hashed + '.gz', hashed + '.br'))
+        removed = 0
+        for root, _, files in os.walk(self.build_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.relpath(path, self.build_dir).replace(os.sep, '/') not in keep:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def url(self, filename):
+        """
+        Statiskā faila URL šablonos - versija ar hešu, ja tāda ir, citādi parastais /static ceļš
+        """
+        if app.debug:
+            # Izstrādes režīmā faili mainās bez servera restartēšanas
+            self.refresh()
+        hashed = self.manifest.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('static_asset', filename=hashed)
+
+
+static_assets = StaticAssets(app.static_folder, app.config['STATIC_BUILD_DIR'])
+try:
+    static_assets.build()
+except OSError as e:
+    logger.warning(f"Statisko failu versijas neizdevās izveidot, tiek izmantoti oriģinālie faili: {e}")
+app.add_template_global(static_assets.url, 'asset_url')
+
+# Dinamiski saspiežamie atbilžu tipi (SSE un citas straumētas atbildes netiek saspiestas)
+COMPRESSIBLE_MIMETYPES = ('text/html', 'application/json')
+
+
+def choose_encoding(accept_encodings, available):
+    """
+    Izvēlas saspiešanas veidu pēc klienta Accept-Encoding
+    Parametri:
+        accept_encodings: request.accept_encodings
+        available: pieejamie veidi prioritātes secībā, piemēram, ('br', 'gzip')
+    Atgriež: izvēlētais veids vai None
+    """
+    for encoding in available:
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+# Aplikācijas maršruti (routes)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+
+
+@app.after_request
+def record_request_metrics(response):
+    """
+    Ieraksta pieprasījuma latentumu un SQL vaicājumu skaitu/laiku pēc maršruta šablona
+    """
+    if 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_DURATION.observe(time.perf_counter() - g.request_started, request.method, route,
+                                 str(response.status_code))
+        REQUEST_DB_QUERIES.observe(g.db_queries, route)
+        REQUEST_DB_SECONDS.observe(g.db_seconds, route)
+    return response
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Saspiež HTML un JSON atbildes, kas lielākas par COMPRESS_MIN_BYTES (brotli vai gzip)
+    Straumētas atbildes (SSE, eksports), daļējas (206) un jau saspiestas atbildes netiek mainītas
+    """
+    if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.is_streamed or response.direct_passthrough
+            or response.status_code < 200 or response.status_code in (204, 206)
+            or 'Content-Encoding' in response.headers or 'Content-Range' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    encoding = choose_encoding(request.accept_encodings, ('br', 'gzip') if brotli is not None else ('gzip',))
+    if encoding is None:
+        return response
+    # Saspiestais un nesaspiestais variants atšķiras pa baitiem, tāpēc tiem nevar būt kopīgs stiprs ETag;
+    # vājš ETag der If-None-Match pārbaudei (arī 304 atbildē, lai tas sakristu ar klienta saglabāto)
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    if response.status_code == 304 or (response.content_length is not None
+                                       and response.content_length < app.config['COMPRESS_MIN_BYTES']):
+        return response
+    data = response.get_data()
+    if encoding == 'br':
+        data = brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+    else:
+        data = gzip.compress(data, compresslevel=app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+    response.set_data(data)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.route('/assets/<path:filename>')
+def static_asset(filename):
+    """
+    Statiskā faila versija (ar hešu nosaukumā) ar neierobežotu kešošanu
+    Ja klients to atbalsta, tiek nosūtīts iepriekš saspiests variants (.br vai .gz)
+    """
+    path = safe_join(app.config['STATIC_BUILD_DIR'], filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encodings = [e for e, suffix in (('br', '.br'), ('gzip', '.gz')) if os.path.isfile(path + suffix)]
+    encoding = choose_encoding(request.accept_encodings, encodings) if encodings else None
+    if encoding is not None:
+        path += '.br' if encoding == 'br' else '.gz'
+
+    max_age = app.config['STATIC_ASSET_MAX_AGE']
+    response = send_file(path, mimetype=mimetype, max_age=max_age, conditional=True)
+    response.headers['Cache-Control'] = f"public, max-age={max_age}, immutable"
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Šī darba procesa metrikas Prometheus teksta formātā
+    """
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({'error': 'Nav autorizēts'}), 403
+    return app.response_class(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/')
+def index():
+    """
+    Galvenā lapa - pārvirza uz čatu, ja lietotājs ir pieteicies
+    """
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    return redirect(url_for('chat'))
+
+@app.route('/register', methods=['GET', 'POST'])
+def register():
+    """
+    Lietotāja reģistrācijas lapa
+    GET: parāda reģistrācijas formu
+    POST: apstrādā reģistrācijas datus
+    """
+    if request.method == 'POST':
+        # Iegūst datus no formas
+        username = request.form.get('username')
+        password = request.form.get('password')
+        ip_address = get_client_ip()
+
+        # Pārbauda, vai no šīs IP jau ir reģistrēts lietotājs
+        existing_ip = User.query.filter_by(registration_ip=ip_address).first()
+        if existing_ip:
+            flash('Jūs jau esat reģistrējies! Problēmu gadījumā sazinieties ar administratoru: LocaLLM@darkweb.onion')
+            return redirect(url_for('register'))
+
+        # Pārbauda, vai lietotājvārds jau eksistē
+        existing_user = User.query.filter_by(username=username).first()
+        if existing_user:
+            flash('Lietotājs ar šādu lietotājvārdu jau eksistē.')
+            return redirect(url_for('register'))
+
+        # Izveido jaunu lietotāju
+        hashed_password = generate_password_hash(password)  # Hešē paroli
+        new_user = User(username=username, password=hashed_password, registration_ip=ip_address)
+        db.session.add(new_user)
+        db.session.commit()
+
+        flash('Reģistrācija veiksmīga. Tagad varat pieteikties.')
+        return redirect(url_for('login'))
+
+    # GET pieprasījums - parāda reģistrācijas formu
+    return render_template('register.html')
+
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    """
+    Lietotāja pieteikšanās lapa
+    GET: parāda pieteikšanās formu
+    POST: apstrādā pieteikšanās datus
+    """
+    if request.method == 'POST':
+        # Iegūst datus no formas
+        username = request.form.get('username')
+        password = request.form.get('password')
+
+        # Meklē lietotāju datubāzē
+        user = User.query.filter_by(username=username).first()
+
+        # Pārbauda lietotājvārdu un paroli
+        if user and check_password_hash(user.password, password):
+            # Saglabā lietotāja datus sesijā
+            session['user_id'] = user.id
+            session['username'] = user.username
+
+            # Ieraksta pieteikšanās žurnālā (caur rakstītāja rindu, negaidot)
+            db_writer.submit(add_login_log, user.id, get_client_ip())
+
+            # Iepriekš ielādē lietotāja pēdējo izmantoto modeli
+            try:
+                model_warmer.warm(recent_user_model(user.id))
+            except Exception as e:
+                logger.warning(f"Modeļa iesildīšanu neizdevās sākt: {e}")
+                db.session.rollback()
+
+            return redirect(url_for('chat'))
+
+        # Nepareizi pieteikšanās dati
+        flash('Nepareizs lietotājvārds vai parole.')
+
+    # GET pieprasījums - parāda pieteikšanās formu
+    return render_template('login.html')
+
+def add_login_log(user_id, ip_address):
+    """
+    Pievieno pieteikšanās žurnāla ierakstu (izpilda datubāzes rakstītājs)
+    """
+    db.session.add(LoginLog(user_id=user_id, ip_address=ip_address))
+
+@app.route('/logout')
+def logout():
+    """
+    Lietotāja izrakstīšanās - notīra sesiju
+    """
+    session.pop('user_id', None)
+    session.pop('username', None)
+    return redirect(url_for('login'))
+
+@app.route('/chat')
+def chat():
+    """
+    Čata galvenā lapa - parāda pēdējo čatu vai izveido jaunu
+    """
+    # Pārbauda, vai lietotājs ir pieteicies
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    # Iegūst lietotāja jaunāko čatu
+    latest_chat = Chat.query.filter_by(user_id=session['user_id']).order_by(Chat.created_at.desc()).first()
+
+    # Ja nav čatu, izveido jaunu
+    if not latest_chat:
+        models = get_available_models()
+        new_chat = Chat(user_id=session['user_id'])
+        db.session.add(new_chat)
+        db.session.commit()
+        return render_template('chat.html', current_chat=new_chat, messages=[], next_cursor=None, models=models)
+    else:
+        # Pārvirza uz pēdējo čatu
+        return redirect(url_for('view_chat', chat_id=latest_chat.id))
+
+
+@app.route('/chat/<int:chat_id>')
+def view_chat(chat_id):
+    """
+    Konkrēta čata skatīšana
+    Parāda tikai jaunākos ziņojumus, vecākie tiek ielādēti pēc vajadzības
+    Parametri:
+        chat_id: čata ID
+    """
+    # Pārbauda pieteikšanos
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    # Iegūst čatu
+    chat = Chat.query.get_or_404(chat_id)
+
+    # Pārbauda, vai čats pieder lietotājam
+    if chat.user_id != session['user_id']:
+        return redirect(url_for('chat'))
+
+    # Arhivēts čats tiek atjaunots, kad to atver
+    ensure_chat_restored(chat)
+
+    # Iegūst jaunāko ziņojumu lapu un pieejamos modeļus
+    messages, next_cursor = load_messages_page(chat_id)
+    models = get_available_models()
+
+    return render_template('chat.html', current_chat=chat, messages=messages, next_cursor=next_cursor, models=models)
+
+
+@app.route('/chat/<int:chat_id>/messages')
+def chat_messages(chat_id):
+    """
+    Atgriež vecāku čata ziņojumu lapu (AJAX pieprasījums)
+    Parametri:
+        chat_id: čata ID
+        before: vecākā jau ielādētā ziņojuma ID
+        limit: ziņojumu skaits lapā
+    Atgriež: JSON ar ziņojumiem, kursors nākamajai lapai galvenē X-Next-Cursor
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    chat = db.session.get(Chat, chat_id)
+    if not chat or chat.user_id != session['user_id']:
+        return jsonify({'error': 'Nav autorizēts'}), 403
+    ensure_chat_restored(chat)
+
+    messages, next_cursor = load_messages_page(
+        chat_id, request.args.get('before', type=int), get_page_limit(app.config['MESSAGE_PAGE_SIZE']))
+    response = jsonify([message_to_dict(message) for message in messages])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+@app.route('/create_chat', methods=['POST'])
+def create_chat():
+    """
+    Jauna čata izveide (AJAX pieprasījums)
+    Atgriež: JSON ar jaunā čata datiem
+    """
+    # Pārbauda pieteikšanos
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    # Izveido jaunu čatu
+    new_chat = Chat(user_id=session['user_id'])
+    db.session.add(new_chat)
+    db.session.commit()
+
+    return jsonify({
+        'id': new_chat.id,
+        'title': new_chat.title
+    })
+
+
+@app.route('/send_message', methods=['POST'])
+def send_message():
+    """
+    Ziņojuma sūtīšana (AJAX pieprasījums)
+    Saglabā lietotāja ziņojumu datubāzē un ģenerē čata nosaukumu, ja nepieciešams
+    """
+    # Pārbauda pieteikšanos
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+    
+    # Iegūst datus no pieprasījuma
+    data = request.json
+    chat_id = data.get('chat_id')
+    content = data.get('content')
+    model_id = data.get('model')
+
+    logger.info(f"/send_message: chat_id={chat_id}, model_id={model_id}, content='{content[:20]}...'", extra={'chat_id': chat_id})
+
+    # Pārbauda čata piederību
+    chat = Chat.query.get(chat_id)
+    if not chat or chat.user_id != session['user_id']:
+        return jsonify({'error': 'Nav autorizēts'}), 403
+
+    # Jaunam ziņojumam vajadzīga visa čata vēsture
+    ensure_chat_restored(chat)
+
+    # Saglabā lietotāja ziņojumu (kopā ar meklēšanas indeksu)
+    user_message = Message(chat_id=chat_id, role='user', content=content)
+    db.session.add(user_message)
+    db.session.flush()
+    index_message(user_message.id)
+    db.session.commit()
+
+    # Pārbauda, vai šis ir pirmais ziņojums čatā
+    messages_count = Message.query.filter_by(chat_id=chat_id).count()
+
+    if messages_count == 1:
+        # Nosaukums tiek ģenerēts fonā un nosūtīts klientam caur /get_response straumi
+        try:
+            title = title_queue.submit(chat.id, content, model_id)
+        except Exception as e:
+            logger.error(f"Nosaukuma ģenerēšanas kļūda: {e}")
+            title = None
+        if title:
+            return jsonify({
+                'status': 'success',
+                'message_id': user_message.id,
+                'updated_chat_title': title
+            })
+        return jsonify({'status': 'success', 'message_id': user_message.id, 'title_pending': True})
+
+    return jsonify({'status': 'success', 'message_id': user_message.id})
+
+@app.route('/get_chats')
+def get_chats():
+    """
     Iegūst lietotāja čatu sarakstu (AJAX pieprasījums)
-    Atgriež: JSON ar čatu sarakstu
+    Parametri:
+        before: pēdējā jau ielādētā čata ID (nākamajai lapai)
+        limit: čatu skaits lapā
+    Atgriež: JSON ar čatu sarakstu, kursors nākamajai lapai galvenē X-Next-Cursor
+    Nemainītam sarakstam atbild ar 304 (ETag/If-None-Match)
+    """
+    if 'user_id' not in session:
+        return jsonify([])
+
+    chats, next_cursor = load_chats_page(
+        session['user_id'], request.args.get('before', type=int), get_page_limit(app.config['CHAT_PAGE_SIZE']))
+    response = jsonify([{'id': chat.id, 'title': chat.title} for chat in chats])
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+
+    # Pārlūks vienmēr pārbauda saraksta aktualitāti, bet nemainītu sarakstu nesaņem vēlreiz
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+
+@app.route('/search')
+def search():
+    """
+    Pilnteksta meklēšana lietotāja čatos (AJAX pieprasījums)
+    Parametri:
+        q: meklējamais teksts
+        offset: cik rezultātus izlaist (nākamajai lapai)
+        limit: rezultātu skaits lapā
+    Atgriež: JSON ar rezultātiem (fragmentā atbilstības iezīmētas ar <mark>),
+             nākamās lapas nobīde galvenē X-Next-Cursor
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    offset = max(0, request.args.get('offset', 0, type=int))
+    if offset > app.config['SEARCH_MAX_OFFSET']:
+        return jsonify([])
+    results, next_offset = search_messages(session['user_id'], request.args.get('q', ''), offset,
+                                           get_page_limit(app.config['SEARCH_PAGE_SIZE']))
+    response = jsonify(results)
+    if next_offset is not None and next_offset <= app.config['SEARCH_MAX_OFFSET']:
+        response.headers['X-Next-Cursor'] = str(next_offset)
+    return response
+
+@app.route('/stop_generation', methods=['POST'])
+def stop_generation():
+    """
+    Aptur ģenerācijas procesu konkrētam čatam (AJAX pieprasījums)
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    chat_id = str((request.get_json(silent=True) or {}).get('chat_id'))
+    if not chat_id.isdigit():
+        return jsonify({'error': 'Nederīgs čata ID'}), 400
+
+    # Pārbauda čata piederību (apturēšanas karodziņš ir kopīgs visiem darba procesiem)
+    chat = Chat.query.get(int(chat_id))
+    if not chat or chat.user_id != session['user_id']:
+        return jsonify({'error': 'Nav autorizēts'}), 403
+
+    logger.info(f"Pieprasījums apturēt ģenerāciju čatam: {chat_id}", extra={'chat_id': chat_id})
+    stop_chat_generation(chat_id)
+
+    return jsonify(success=True)
+
+
+@app.route('/regenerate', methods=['POST'])
+def regenerate():
+    """
+    Dzēš čata pēdējās atbildes (pēc pēdējā lietotāja ziņojuma), lai tās ģenerētu no jauna (AJAX pieprasījums)
+    Klients pēc tam atver /get_response ar fresh=1, tāpēc jaunā atbilde netiek ņemta no kešatmiņas
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    chat_id = str((request.get_json(silent=True) or {}).get('chat_id'))
+    if not chat_id.isdigit():
+        return jsonify({'error': 'Nederīgs čata ID'}), 400
+
+    # Pārbauda čata piederību
+    chat = Chat.query.get(int(chat_id))
+    if not chat or chat.user_id != session['user_id']:
+        return jsonify({'error': 'Nav autorizēts'}), 403
+
+    # Atbildi, kas vēl tiek ģenerēta, nevar aizstāt
+    job = generation_jobs.get(chat_id)
+    if (job and not job.finished) or Generation.query.filter_by(chat_id=chat.id).first():
+        return jsonify({'error': 'Čatā notiek ģenerācija'}), 409
+
+    ensure_chat_restored(chat)
+    last_user_id = (db.session.query(db.func.max(Message.id))
+                    .filter_by(chat_id=chat.id, role='user').scalar())
+    if last_user_id is None:
+        return jsonify({'error': 'Čatā nav ziņojumu'}), 400
+
+    removed = [row[0] for row in db.session.query(Message.id).filter(
+        Message.chat_id == chat.id, Message.role == 'assistant', Message.id > last_user_id)]
+    unindex_messages(removed)
+    Message.query.filter(Message.id.in_(removed)).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info(f"Atbilde tiks ģenerēta no jauna čatam: {chat_id}", extra={'chat_id': chat_id})
+
+    return jsonify({'success': True, 'removed': removed})
+
+
+@app.route('/generations')
+def list_generations():
+    """
+    Atgriež lietotāja aktīvās ģenerācijas visos darba procesos (AJAX pieprasījums)
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    generations = (Generation.query.filter_by(user_id=session['user_id'])
+                   .order_by(Generation.started_at).all())
+    return jsonify([generation_to_dict(generation) for generation in generations])
+
+
+@app.route('/queue')
+def queue_status():
+    """
+    Atgriež šī procesa ģenerāciju plānotāja stāvokli: izpildāmās un gaidošās ģenerācijas katram modelim
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    response = jsonify(generation_scheduler.status())
+    response.headers['X-Queue-Depth'] = str(generation_scheduler.queue_depth())
+    return response
+
+
+def sse_event(payload, event_id=None):
+    """
+    Noformē vienu Server-Sent Events notikumu
+    Parametri:
+        payload: vārdnīca, kas tiks nosūtīta kā JSON
+        event_id: notikuma ID (klients to atsūta Last-Event-ID galvenē, atjaunojot savienojumu)
+    """
+    data = f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    return f"id: {event_id}\n{data}" if event_id else data
+
+
+class GenerationJob:
+    """
+    Servera puses ģenerācijas uzdevums
+    Notikumi tiek glabāti ierobežotā buferī, tāpēc vairāki klienti var pievienoties
+    un atjaunot straumi no Last-Event-ID
+    """
+
+    def __init__(self, chat_id, model_id, buffer_size):
+        self.id = uuid.uuid4().hex[:12]  # Unikāls uzdevuma ID (notikumu ID prefikss)
+        self.chat_id = str(chat_id)
+        self.model_id = model_id
+        self.message_id = None
+        self.buffer_size = buffer_size
+        self.events = deque()           # (kārtas numurs, dati)
+        self.seq = 0                    # Pēdējā notikuma kārtas numurs
+        self.evicted_text = []          # Saturs no notikumiem, kas izspiesti no bufera
+        self.finished = False
+        self.finished_at = None
+        self.stop_requested = False
+        self.subscribers = 0
+        self.last_detach = time.monotonic()
+        self.condition = threading.Condition()
+        self.async_waiters = []         # (notikumu cilpa, asyncio.Event) asinhronajiem klientiem
+        self.cancel_hook = None         # Funkcija, kas aizver savienojumu ar LM Studio
+        self.ticket = None              # Vieta ģenerāciju plānotājā
+        self.created_at = time.monotonic()
+        self.lanes = [self]             # Ģenerācijas, kas publicē šajā buferī (salīdzināšanā - viena katram modelim)
+
+    def publish(self, payload, final=False):
+        """
+        Pievieno notikumu buferim un pamodina visus klientus
+        Parametri:
+            payload: notikuma dati
+            final: vai šis ir pēdējais notikums
+        """
+        with self.condition:
+            self.seq += 1
+            self.events.append((self.seq, payload))
+            if len(self.events) > self.buffer_size:
+                _, evicted = self.events.popleft()
+                self.evict(evicted)
+            if final:
+                self.finished = True
+                self.finished_at = time.monotonic()
+            self.condition.notify_all()
+            waiters, self.async_waiters = self.async_waiters, []
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def evict(self, payload):
+        # Izsaukt tikai ar self.condition slēdzeni
+        if 'content' in payload:
+            self.evicted_text.append(payload['content'])
+
+    def snapshot_payload(self):
+        return {'snapshot': ''.join(self.evicted_text), 'message_id': self.message_id}
+
+    def _read(self, last_seq):
+        # Izsaukt tikai ar self.condition slēdzeni
+        first_seq = self.events[0][0] if self.events else self.seq + 1
+        snapshot = None
+        if last_seq < first_seq - 1:
+            # Klients palaida garām notikumus, kas vairs nav buferī - sūta to saturu vienā notikumā
+            snapshot = (first_seq - 1, self.snapshot_payload())
+        events = [event for event in self.events if event[0] > last_seq]
+        return snapshot, events, self.finished
+
+    def read(self, last_seq, waiter=None):
+        """
+        Nolasa notikumus pēc last_seq
+        Parametri:
+            last_seq: pēdējais klienta saņemtā notikuma numurs
+            waiter: (cilpa, asyncio.Event), kas tiks pamodināts, ja jaunu notikumu vēl nav
+        Atgriež: (snapshot vai None, notikumu saraksts, vai uzdevums pabeigts)
+        """
+        with self.condition:
+            result = self._read(last_seq)
+            if waiter and result[0] is None and not result[1] and not result[2]:
+                self.async_waiters.append(waiter)
+            return result
+
+    def wait(self, last_seq, timeout):
+        """
+        Gaida jaunus notikumus pēc last_seq (bloķējoši)
+        """
+        with self.condition:
+            result = self._read(last_seq)
+            if result[0] is None and not result[1] and not result[2]:
+                self.condition.wait(timeout)
+                result = self._read(last_seq)
+            return result
+
+    def parse_event_id(self, event_id):
+        """
+        Atgriež kārtas numuru no Last-Event-ID (0, ja ID nepieder šim uzdevumam)
+        """
+        prefix, _, number = (event_id or '').partition('-')
+        return int(number) if prefix == self.id and number.isdigit() else 0
+
+    def event_id(self, seq):
+        return f"{self.id}-{seq}"
+
+    def attach(self):
+        with self.condition:
+            self.subscribers += 1
+
+    def detach(self):
+        with self.condition:
+            self.subscribers -= 1
+            self.last_detach = time.monotonic()
+
+    def cancel(self):
+        """
+        Aptur ģenerāciju nekavējoties - aizver savienojumu ar LM Studio, lai serveris
+        pārtrauc tokenu ģenerēšanu, negaidot nākamo saņemto rindu
+        """
+        self.stop_requested = True
+        hook = self.cancel_hook
+        if hook is not None:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Kļūda, aizverot LM Studio savienojumu čatam {self.chat_id}: {e}", extra={'chat_id': self.chat_id})
+
+    def should_stop(self):
+        """
+        Vai ģenerācija jāpārtrauc (lietotājs to apturēja vai neviens klients vairs neklausās)
+        """
+        if self.stop_requested:
+            return True
+        return (self.subscribers <= 0
+                and time.monotonic() - self.last_detach > app.config['GENERATION_ORPHAN_TIMEOUT'])
+
+    def unregister(self):
+        """
+        Izņem pabeigtu ģenerāciju no reģistra (jāizsauc ar aplikācijas kontekstu)
+        """
+        unregister_generation(self.id)
+
+
+class CompareJob(GenerationJob):
+    """
+    Salīdzināšanas ģenerācija - viens lietotāja ziņojums vairākiem modeļiem vienlaikus
+    Katrs modelis ir atsevišķa CompareLane ar savu assistenta ziņojumu un vietu plānotājā;
+    visu modeļu notikumi ar modeļa atzīmi nonāk vienā buferī, tāpēc klients tos saņem
+    pa vienu SSE savienojumu, un kopējais laiks ir lēnākā modeļa laiks
+    """
+
+    def __init__(self, chat_id, model_ids, buffer_size):
+        super().__init__(chat_id, ','.join(model_ids)[:100], buffer_size * len(model_ids))
+        self.evicted_text = {}          # Modelis -> saturs no notikumiem, kas izspiesti no bufera
+        self.lanes = [CompareLane(self, model_id) for model_id in model_ids]
+        self.remaining = len(self.lanes)
+
+    def evict(self, payload):
+        if 'content' in payload:
+            self.evicted_text.setdefault(payload.get('model'), []).append(payload['content'])
+
+    def snapshot_payload(self):
+        return {'snapshots': {lane.model_id: {'content': ''.join(self.evicted_text.get(lane.model_id, [])),
+                                              'message_id': lane.message_id} for lane in self.lanes}}
+
+    def lane_finished(self):
+        """
+        Atzīmē viena modeļa ģenerācijas beigas; pēc pēdējās paziņo klientiem un atbrīvo čatu reģistrā
+        """
+        with self.condition:
+            self.remaining -= 1
+            last = self.remaining == 0
+        if last:
+            self.publish({'done': True}, final=True)
+            db_writer.submit(remove_generation, self.id)
+
+    def cancel(self):
+        self.stop_requested = True
+        for lane in self.lanes:
+            lane.cancel()
+
+
+class CompareLane:
+    """
+    Viena modeļa ģenerācija salīdzināšanas uzdevumā
+    Ģenerācijas izpildītājiem un plānotājam tā izskatās kā GenerationJob, bet notikumus
+    publicē kopīgajā CompareJob buferī
+    """
+
+    def __init__(self, parent, model_id):
+        self.parent = parent
+        self.id = parent.id             # Reģistra ieraksts ir kopīgs; ziņojums tiek piesaistīts GenerationLane rindai
+        self.chat_id = parent.chat_id
+        self.model_id = model_id
+        self.message_id = None
+        self.finished = False
+        self.stop_requested = False
+        self.cancel_hook = None
+        self.ticket = None
+        self.created_at = parent.created_at
+
+    def publish(self, payload, final=False):
+        if self.finished:
+            return
+        self.parent.publish({**payload, 'model': self.model_id})
+        if final:
+            self.finished = True
+            self.parent.lane_finished()
+
+    def cancel(self):
+        self.stop_requested = True
+        hook = self.cancel_hook
+        if hook is not None:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Kļūda, aizverot LM Studio savienojumu čatam {self.chat_id}: {e}", extra={'chat_id': self.chat_id})
+
+    def should_stop(self):
+        return self.stop_requested or self.parent.should_stop()
+
+    def unregister(self):
+        # Reģistra ierakstu izņem CompareJob pēc pēdējā modeļa (lane_finished)
+        pass
+
+
+class SchedulerTicket:
+    """Viena ģenerācija plānotājā (gaidoša vai izpildāma)"""
+
+    def __init__(self, job, user_id, start):
+        self.job = job
+        self.user_id = user_id
+        self.start = start          # Funkcija, kas palaiž ģenerāciju, kad pienāk tās kārta
+        self.admitted = False       # Vai ģenerācija aizņem vietu modeļa limitā
+        self.position = None        # Pēdējā klientiem paziņotā vieta rindā
+
+
+class GenerationScheduler:
+    """
+    Ģenerāciju uzņemšanas kontrole
+    Katram modelim ierobežo vienlaicīgo ģenerāciju skaitu, pārējās gaida rindā,
+    kas tiek apkalpota pēc kārtas starp lietotājiem (round-robin pēc user_id),
+    lai viena lietotāja pieprasījumu virkne neaizkavētu visus pārējos
+    """
+
+    def __init__(self, default_limit, limits=None, max_queued=100):
+        self.default_limit = default_limit
+        self.limits = limits or {}
+        self.max_queued = max_queued
+        self.running = {}   # modelis -> izpildāmo ģenerāciju skaits
+        self.queues = {}    # modelis -> OrderedDict(user_id -> deque(SchedulerTicket)), secība nosaka nākamo lietotāju
+        self.lock = threading.Lock()
+
+    def limit(self, model):
+        return max(1, int(self.limits.get(model, self.default_limit)))
+
+    def submit(self, job, user_id, start):
+        """
+        Palaiž ģenerāciju uzreiz vai ieliek to rindā
+        Parametri:
+            job: GenerationJob
+            user_id: lietotāja ID (rindas taisnīgumam)
+            start: funkcija, kas palaiž ģenerāciju (var tikt izsaukta no cita pavediena)
+        Atgriež: False, ja modeļa rinda ir pilna un ģenerācija netika pieņemta
+        """
+        model = job.model_id
+        ticket = SchedulerTicket(job, user_id, start)
+        job.ticket = ticket
+        with self.lock:
+            queue = self.queues.setdefault(model, OrderedDict())
+            if self.running.get(model, 0) < self.limit(model) and not queue:
+                self.running[model] = self.running.get(model, 0) + 1
+                ticket.admitted = True
+                updates = []
+            else:
+                if sum(len(tickets) for tickets in queue.values()) >= self.max_queued:
+                    return False
+                queue.setdefault(user_id, deque()).append(ticket)
+                # Apturēšana izņem gaidošu ģenerāciju no rindas
+                job.cancel_hook = lambda: self.withdraw(ticket)
+                updates = self._positions(model)
+        if ticket.admitted:
+            start()
+        self._publish_positions(updates)
+        return True
+
+    def release(self, ticket):
+        """
+        Atbrīvo modeļa vietu pēc ģenerācijas un palaiž nākamās gaidošās
+        """
+        if ticket is None:
+            return
+        model = ticket.job.model_id
+        with self.lock:
+            if ticket.admitted:
+                ticket.admitted = False
+                self.running[model] -= 1
+            started = self._admit(model)
+            updates = self._positions(model)
+        for next_ticket in started:
+            next_ticket.start()
+        self._publish_positions(updates)
+
+    def withdraw(self, ticket):
+        """
+        Izņem apturētu ģenerāciju no rindas (tā tiek palaista un uzreiz beidzas)
+        """
+        model = ticket.job.model_id
+        with self.lock:
+            queue = self.queues.get(model, {})
+            tickets = queue.get(ticket.user_id)
+            if not tickets or ticket not in tickets:
+                return
+            tickets.remove(ticket)
+            if not tickets:
+                del queue[ticket.user_id]
+            updates = self._positions(model)
+        ticket.start()
+        self._publish_positions(updates)
+
+    def _admit(self, model):
+        # Izsaukt tikai ar self.lock slēdzeni
+        queue = self.queues.get(model)
+        started = []
+        while queue and self.running.get(model, 0) < self.limit(model):
+            user_id, tickets = next(iter(queue.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                queue.move_to_end(user_id)
+            else:
+                del queue[user_id]
+            ticket.admitted = True
+            ticket.job.cancel_hook = None
+            self.running[model] = self.running.get(model, 0) + 1
+            started.append(ticket)
+        return started
+
+    def _positions(self, model):
+        # Izsaukt tikai ar self.lock slēdzeni
+        # Atgriež gaidošās ģenerācijas, kuru vieta rindā mainījusies: [(biļete, vieta, rindas garums)]
+        queue = self.queues.get(model) or {}
+        order = []
+        rounds = [list(tickets) for tickets in queue.values()]
+        for index in range(max((len(tickets) for tickets in rounds), default=0)):
+            order.extend(tickets[index] for tickets in rounds if index < len(tickets))
+        updates = []
+        for position, ticket in enumerate(order, start=1):
+            if ticket.position != position:
+                ticket.position = position
+                updates.append((ticket, position, len(order)))
+        return updates
+
+    @staticmethod
+    def _publish_positions(updates):
+        for ticket, position, depth in updates:
+            ticket.job.publish({'queue': {'position': position, 'depth': depth}})
+
+    def status(self):
+        """
+        Atgriež plānotāja stāvokli katram modelim
+        """
+        with self.lock:
+            models = set(self.running) | {model for model, queue in self.queues.items() if queue}
+            return {
+                model: {
+                    'running': self.running.get(model, 0),
+                    'limit': self.limit(model),
+                    'queued': sum(len(tickets) for tickets in self.queues.get(model, {}).values()),
+                    'queued_users': len(self.queues.get(model, {}))
+                }
+                for model in sorted(models)
+            }
+
+    def queue_depth(self):
+        with self.lock:
+            return sum(len(tickets) for queue in self.queues.values() for tickets in queue.values())
+
+
+# Kopīgais plānotājs visām šī procesa ģenerācijām
+generation_scheduler = GenerationScheduler(
+    app.config['MODEL_CONCURRENCY'],
+    limits=app.config['MODEL_CONCURRENCY_LIMITS'],
+    max_queued=app.config['GENERATION_QUEUE_LIMIT']
+)
+metrics.register(Gauge('generations_active', "Pašlaik izpildāmās ģenerācijas", ('model',), collect=lambda: {
+    (model,): info['running'] for model, info in generation_scheduler.status().items()}))
+metrics.register(Gauge('generations_queued', "Rindā gaidošās ģenerācijas", ('model',), collect=lambda: {
+    (model,): info['queued'] for model, info in generation_scheduler.status().items()}))
+
+
+def record_generation_metrics(job, buffer, status):
+    """
+    Ieraksta ģenerācijas metrikas vienreiz beigās (straumēšanas ciklā nekas netiek mērīts atsevišķi)
+    Parametri:
+        job: GenerationJob
+        buffer: StreamBuffer ar saņemtajiem fragmentiem
+        status: 'complete', 'stopped' vai 'error'
+    """
+    model = job.model_id or ''
+    tokens = len(buffer.chunks)
+    GENERATIONS.inc(model, status)
+    if tokens:
+        GENERATION_TOKENS.inc(model, value=tokens)
+    if buffer.first_at is not None:
+        GENERATION_TTFT.observe(buffer.first_at - job.created_at, model)
+        duration = buffer.last_at - buffer.first_at
+        if tokens > 1 and duration > 0:
+            GENERATION_TOKENS_PER_SECOND.observe((tokens - 1) / duration, model)
+
+
+# Aktīvās un nesen pabeigtās ģenerācijas (čata ID -> GenerationJob)
+generation_jobs = {}
+generation_jobs_lock = threading.Lock()
+
+
+class RemoteGeneration:
+    """Citā darba procesā notiekoša ģenerācija (tai seko caur datubāzē saglabāto saturu)"""
+
+    def __init__(self, generation_id, chat_id):
+        self.id = generation_id
+        self.chat_id = str(chat_id)
+
+
+def find_or_create_job(chat_id, model_id, user_id=None, allow_create=True, compare_models=None):
+    """
+    Atrod čata aktīvo ģenerāciju (arī citā darba procesā) vai izveido jaunu
+    Jāizsauc ar aplikācijas kontekstu
+    Parametri:
+        chat_id: čata ID
+        model_id: modeļa ID
+        user_id: lietotāja ID (jaunās ģenerācijas reģistrēšanai)
+        allow_create: vai drīkst izveidot jaunu uzdevumu
+        compare_models: vairāku modeļu saraksts salīdzināšanas režīmam (izveido CompareJob)
+    Atgriež: (GenerationJob, RemoteGeneration vai None, vai uzdevums tikko izveidots)
+    """
+    chat_id = str(chat_id)
+    now = time.monotonic()
+    with generation_jobs_lock:
+        # Notīra pabeigtās ģenerācijas, kurām beidzies glabāšanas laiks
+        for key, job in list(generation_jobs.items()):
+            if job.finished and now - job.finished_at > app.config['GENERATION_RETENTION']:
+                del generation_jobs[key]
+
+        job = generation_jobs.get(chat_id)
+        if job and not job.finished:
+            return job, False
+        remote = find_remote_generation(chat_id)
+        if remote is not None:
+            return remote, False
+        if not allow_create:
+            return job, False
+        if compare_models and len(compare_models) > 1:
+            job = CompareJob(chat_id, compare_models, app.config['GENERATION_BUFFER_EVENTS'])
+        else:
+            job = GenerationJob(chat_id, model_id, app.config['GENERATION_BUFFER_EVENTS'])
+        remote = register_generation(job, user_id)
+        if remote is not None:
+            return remote, False
+        generation_jobs[chat_id] = job
+        return job, True
+
+
+def reject_generation(job):
+    """
+    Noraida ģenerāciju, kurai plānotāja rindā nav vietas
+    """
+    logger.warning(f"Ģenerāciju rinda pilna modelim {job.model_id}, čats: {job.chat_id}", extra={'chat_id': job.chat_id})
+    job.publish({'error': "Serveris ir pārslogots, lūdzu, mēģiniet vēlreiz pēc brīža"}, final=True)
+    job.unregister()
+
+
+def generation_to_dict(generation):
+    """
+    Pārveido ģenerācijas reģistra ierakstu par JSON vārdnīcu
+    """
+    return {
+        'id': generation.id,
+        'chat_id': generation.chat_id,
+        'model': generation.model,
+        'message_id': generation.message_id,
+        'pid': generation.pid,
+        'stop_requested': generation.stop_requested,
+        'started_at': generation.started_at.isoformat() + 'Z' if generation.started_at else None,
+        'heartbeat_at': generation.heartbeat_at.isoformat() + 'Z' if generation.heartbeat_at else None
+    }
+
+
+def reap_stale_generations(chat_id=None):
+    """
+    Noņem no reģistra ģenerācijas, kuru process vairs nesūta dzīvības signālu (piemēram, tika apturēts)
+    Parametri:
+        chat_id: ja norādīts, pārbauda tikai šo čatu
+    """
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=app.config['GENERATION_STALE_AFTER'])
+    query = Generation.query.filter(Generation.heartbeat_at < cutoff)
+    if chat_id is not None:
+        query = query.filter_by(chat_id=int(chat_id))
+    stale = query.all()
+    for generation in stale:
+        logger.warning(f"Noņem pamestu ģenerāciju {generation.id} (process {generation.pid}) čatam: {generation.chat_id}", extra={'chat_id': generation.chat_id})
+        lanes = GenerationLane.query.filter_by(generation_id=generation.id)
+        message_ids = [lane.message_id for lane in lanes if lane.message_id]
+        if generation.message_id:
+            message_ids.append(generation.message_id)
+        if message_ids:
+            # Pamestās atbildes (salīdzināšanā - visu modeļu) paliek ar pēdējo saglabāto saturu
+            Message.query.filter(Message.id.in_(message_ids), Message.status == 'streaming').update(
+                {'status': 'stopped'}, synchronize_session=False)
+        lanes.delete(synchronize_session=False)
+        db.session.delete(generation)
+    if stale:
+        db.session.commit()
+
+
+def find_remote_generation(chat_id):
+    """
+    Atrod čata ģenerāciju, kas notiek citā darba procesā
+    Atgriež: RemoteGeneration vai None
+    """
+    reap_stale_generations(chat_id)
+    generation = Generation.query.filter_by(chat_id=int(chat_id)).first()
+    if generation is None:
+        return None
+    return RemoteGeneration(generation.id, generation.chat_id)
+
+
+def register_generation(job, user_id):
+    """
+    Ieraksta ģenerāciju kopīgajā reģistrā
+    Unikālais chat_id neļauj diviem procesiem vienlaikus sākt ģenerāciju vienam čatam
+    Atgriež: None, ja ģenerācija reģistrēta, vai RemoteGeneration, ja čatam to jau sācis cits process
+    """
+    for _ in range(3):
+        db.session.add(Generation(id=job.id, chat_id=int(job.chat_id), user_id=user_id,
+                                  model=job.model_id, pid=os.getpid()))
+        if isinstance(job, CompareJob):
+            # Citi procesi zina salīdzināmos modeļus jau pirms to ziņojumu izveides
+            db.session.add_all([GenerationLane(generation_id=job.id, model=lane.model_id) for lane in job.lanes])
+        try:
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+        remote = find_remote_generation(job.chat_id)
+        if remote is not None:
+            return remote
+    raise RuntimeError("Neizdevās reģistrēt ģenerāciju")
+
+
+def remove_generation(generation_id):
+    """
+    Izdzēš ģenerācijas reģistra ierakstu (bez commit, izmanto arī datubāzes rakstītājs)
+    """
+    GenerationLane.query.filter_by(generation_id=generation_id).delete(synchronize_session=False)
+    Generation.query.filter_by(id=generation_id).delete(synchronize_session=False)
+
+
+def unregister_generation(generation_id):
+    """
+    Izņem pabeigtu ģenerāciju no reģistra
+    """
+    remove_generation(generation_id)
+    db.session.commit()
+
+
+def stop_chat_generation(chat_id):
+    """
+    Aptur čata ģenerāciju neatkarīgi no tā, kurā darba procesā tā notiek
+    Šī procesa ģenerācija tiek apturēta uzreiz, citus procesus informē reģistra karodziņš
+    """
+    job = generation_jobs.get(str(chat_id))
+    if job and not job.finished:
+        job.cancel()
+        logger.info(f"Ģenerācija apturēta čatam: {chat_id}", extra={'chat_id': chat_id})
+        return
+    updated = Generation.query.filter_by(chat_id=int(chat_id)).update(
+        {'stop_requested': True}, synchronize_session=False)
+    db.session.commit()
+    if updated:
+        logger.info(f"Apturēšanas karodziņš uzstādīts čatam: {chat_id}", extra={'chat_id': chat_id})
+
+
+def generation_registry_watcher():
+    """
+    Fona pavediens, kas uztur šī procesa ģenerāciju ierakstus reģistrā:
+    sūta dzīvības signālus un pārtrauc ģenerācijas, kuras apturēja cits process
+    """
+    last_heartbeat = 0.0
+    while True:
+        time.sleep(app.config['GENERATION_STOP_POLL_INTERVAL'])
+        with generation_jobs_lock:
+            running = {job.id: job for job in generation_jobs.values() if not job.finished}
+        with app.app_context():
+            try:
+                now = time.monotonic()
+                if now - last_heartbeat >= app.config['GENERATION_HEARTBEAT_INTERVAL']:
+                    last_heartbeat = now
+                    if running:
+                        Generation.query.filter(Generation.id.in_(running)).update(
+                            {'heartbeat_at': datetime.datetime.utcnow()}, synchronize_session=False)
+                        db.session.commit()
+                    reap_stale_generations()
+                if running:
+                    stopped = db.session.execute(
+                        db.select(Generation.id).where(Generation.id.in_(running), Generation.stop_requested)
+                    ).scalars().all()
+                    for generation_id in stopped:
+                        job = running[generation_id]
+                        if not job.stop_requested:
+                            logger.info(f"Ģenerācija apturēta no cita procesa čatam: {job.chat_id}", extra={'chat_id': job.chat_id})
+                            job.cancel()
+            except Exception as e:
+                logger.error(f"Ģenerāciju reģistra kļūda: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def poll_remote_generation(remote, state):
+    """
+    Viens solis, sekojot citā procesā notiekošai ģenerācijai pēc tās saglabātā satura
+    Parametri:
+        remote: RemoteGeneration
+        state: vārdnīca, kurā starp izsaukumiem tiek glabāts ziņojuma ID un nosūtītā satura garums
+    Atgriež: (SSE notikumu saraksts, vai ģenerācija beigusies)
+    """
+    generation = db.session.get(Generation, remote.id)
+    lanes = GenerationLane.query.filter_by(generation_id=remote.id).all() if generation is not None else []
+    if lanes or 'lanes' in state:
+        return poll_remote_lanes(generation, lanes, state)
+    if generation is not None and generation.message_id:
+        state['message_id'] = generation.message_id
+    if state.get('message_id') is None:
+        if generation is None:
+            # Ģenerācija beidzās, pirms tās ziņojums bija redzams
+            return stored_response_events(remote.chat_id), True
+        return [], False
+
+    message = db.session.get(Message, state['message_id'])
+    if message is None:
+        return [sse_event({'done': True})], True
+    events = []
+    sent = state.get('sent')
+    if sent is None:
+        events.append(sse_event({'snapshot': message.content, 'message_id': message.id}))
+    elif len(message.content) > sent:
+        events.append(sse_event({'content': message.content[sent:]}))
+    state['sent'] = len(message.content)
+
+    finished = generation is None or message.status != 'streaming'
+    if finished:
+        events.append(sse_event({'done': True}))
+    return events, finished
+
+
+def poll_remote_lanes(generation, lanes, state):
+    """
+    poll_remote_generation salīdzināšanas ģenerācijai - katra modeļa saturs tiek sūtīts ar modeļa atzīmi
+    Parametri:
+        generation: reģistra ieraksts (None, ja ģenerācija jau beigusies)
+        lanes: ģenerācijas GenerationLane rindas
+        state: poll_remote_generation stāvoklis
+    Atgriež: (SSE notikumu saraksts, vai ģenerācija beigusies)
+    """
+    known = state.setdefault('lanes', {})       # Modelis -> ziņojuma ID (None, kamēr ziņojums nav izveidots)
+    sent = state.setdefault('lane_sent', {})    # Ziņojuma ID -> nosūtītā satura garums
+    done = state.setdefault('lane_done', set())
+    for lane in lanes:
+        if lane.message_id or lane.model not in known:
+            known[lane.model] = lane.message_id
+    message_ids = [message_id for message_id in known.values() if message_id]
+    messages = {message.id: message for message in
+                Message.query.filter(Message.id.in_(message_ids))} if message_ids else {}
+
+    events = []
+    if not state.get('snapshot_sent'):
+        state['snapshot_sent'] = True
+        snapshots = {}
+        for model, message_id in known.items():
+            message = messages.get(message_id)
+            snapshots[model] = {'content': message.content if message else '',
+                                'message_id': message.id if message else None}
+            if message is not None:
+                sent[message.id] = len(message.content)
+        events.append(sse_event({'snapshots': snapshots}))
+    for model, message_id in known.items():
+        message = messages.get(message_id)
+        if message is None:
+            continue
+        if message.id not in sent:
+            events.append(sse_event({'message_id': message.id, 'model': model}))
+            sent[message.id] = 0
+        if len(message.content) > sent[message.id]:
+            events.append(sse_event({'content': message.content[sent[message.id]:], 'model': model}))
+            sent[message.id] = len(message.content)
+        if model not in done and message.status != 'streaming':
+            done.add(model)
+            events.append(sse_event({'done': True, 'model': model}))
+
+    finished = generation is None or len(done) == len(known)
+    if finished:
+        events.append(sse_event({'done': True}))
+    return events, finished
+
+
+def follow_remote_generation(remote):
+    """
+    Ģenerators, kas straumē citā darba procesā notiekošu ģenerāciju (Server-Sent Events)
+    Saturs tiek nolasīts no datubāzes tikpat bieži, cik tas tiek saglabāts
+    """
+    state = {}
+    last_sent = time.monotonic()
+    while True:
+        with app.app_context():
+            try:
+                events, finished = poll_remote_generation(remote, state)
+            finally:
+                db.session.remove()
+        for event in events:
+            yield event
+        if finished:
+            break
+        now = time.monotonic()
+        if events:
+            last_sent = now
+        elif now - last_sent >= app.config['SSE_KEEPALIVE_INTERVAL']:
+            last_sent = now
+            yield ": keep-alive\n\n"
+        time.sleep(app.config['STREAM_FLUSH_INTERVAL'])
+
+
+def prepare_completion(chat_id, model_id, fresh=False):
+    """
+    Sagatavo LM Studio pieprasījumu un pārbauda atbilžu kešatmiņu
+    Parametri:
+        chat_id: čata ID
+        model_id: modeļa ID
+        fresh: neņemt atbildi no kešatmiņas (jaunā atbilde tiek saglabāta)
+    Atgriež: (pieprasījuma dati, kešotās atbildes teksts vai None)
+    """
+    data = build_completion_payload(chat_id, model_id)
+    cached = None if fresh else completion_cache.lookup(data)
+    return data, cached
+
+
+def replay_cached_completion(job, text):
+    """
+    Nosūta kešotu atbildi klientiem pilnā ātrumā un saglabā to kā parastu assistenta ziņojumu
+    LM Studio un vieta ģenerāciju plānotājā nav vajadzīga
+    Parametri:
+        job: GenerationJob (vai CompareLane)
+        text: kešotās atbildes teksts
+    """
+    chat_id = job.chat_id
+    with app.app_context():
+        try:
+            job.message_id = create_assistant_message(chat_id, job.model_id, job.id)
+            job.publish({'message_id': job.message_id, 'cached': True})
+            job.publish({'content': text})
+            checkpoint_message(job.message_id, text, 'complete', wait=True)
+            GENERATIONS.inc(job.model_id or '', 'cached')
+            logger.info(f"Atbilde no kešatmiņas čatam: {chat_id}", extra={'chat_id': chat_id})
+
+            title = title_queue.pop_ready(chat_id)
+            if title:
+                job.publish({'title': title})
+            job.publish({'done': True}, final=True)
+
+        except Exception as e:
+            error_message = f"Kļūda atbildes ģenerēšanā: {str(e)}"
+            logger.error(error_message, extra={'chat_id': chat_id})
+            db.session.rollback()
+            job.publish({'error': error_message}, final=True)
+
+        finally:
+            if not job.finished:
+                job.publish({'done': True}, final=True)
+            job.unregister()
+            db.session.remove()
+
+
+def run_generation_job(job, data):
+    """
+    Izpilda ģenerāciju fonā un publicē notikumus uzdevuma buferī
+    Parametri:
+        job: GenerationJob
+        data: LM Studio pieprasījuma dati
+    """
+    chat_id = job.chat_id
+    with app.app_context():
+        buffer = StreamBuffer()
+        status = 'stopped'
+        saved = False
+        backend = None
+        try:
+            # Apturēšana aizver savienojumu uzreiz, lai LM Studio pārtrauc darbu -
+            # arī modeļa ielādes vai uzvednes apstrādes laikā, pirms pirmā tokena
+            call = UpstreamCall()
+            job.cancel_hook = call.abort
+
+            if job.should_stop():
+                # Apturēta vai pamesta, kamēr gaidīja rindā
+                logger.info(f"Ģenerācija atcelta pirms sākuma čatam: {chat_id}", extra={'chat_id': chat_id})
+                return
+
+            # Brīdina klientus, ja atbilde gaidīs modeļa ielādi
+            announce_model_load(job)
+
+            # Sūta pieprasījumu uz LM Studio caur savienojumu pūlu (serveris ar mazāko slodzi)
+            backend = upstream.pick(job.model_id)
+            with upstream.request('POST', '/v1/chat/completions', backend=backend, json=data, stream=True,
+                                  call=call) as response:
+                response.raise_for_status()
+
+                # Izveido assistenta ziņojumu datubāzē un paziņo tā ID klientiem
+                job.message_id = create_assistant_message(chat_id, job.model_id, job.id)
+                job.publish({'message_id': job.message_id})
+
+                # Apstrādā straumēto atbildi
+                for line in response.iter_lines():
+                    # Pārbauda, vai ģenerācija nav apturēta
+                    if job.should_stop():
+                        logger.info(f"Ģenerācija apturēta čatam: {chat_id}", extra={'chat_id': chat_id})
+                        break
+
+                    content = parse_stream_line(line)
+                    if content is True:
+                        logger.info(f"Ģenerācija pabeigta no LM Studio čatam: {chat_id}", extra={'chat_id': chat_id})
+                        status = 'complete'
+                        break
+                    if content:
+                        # Periodiski saglabā uzkrāto saturu datubāzē
+                        if buffer.append(content):
+                            checkpoint_message(job.message_id, buffer.take_pending())
+                        job.publish({'content': content})
+
+                    # Sūta fonā ģenerēto čata nosaukumu, tiklīdz tas ir gatavs
+                    title = title_queue.pop_ready(chat_id)
+                    if title:
+                        job.publish({'title': title})
+                else:
+                    # Straume beidzās bez [DONE]
+                    status = 'complete'
+
+            # Saglabā atlikušo atbildi datubāzē
+            checkpoint_message(job.message_id, buffer.take_pending(), status, wait=True)
+            saved = True
+            logger.info(f"Assistenta saturs saglabāts datubāzē ziņojumam: {job.message_id}",
+                        extra={'chat_id': chat_id, 'message_id': job.message_id})
+            if status == 'complete':
+                completion_cache.store(data, buffer.text())
+
+            title = title_queue.pop_ready(chat_id)
+            if title:
+                job.publish({'title': title})
+
+            # Paziņo par ģenerācijas pabeigšanu
+            job.publish({'done': True}, final=True)
+
+        except Exception as e:
+            if job.stop_requested:
+                # Savienojumu aizvēra apturēšana - tā nav kļūda
+                logger.info(f"Ģenerācija apturēta čatam: {chat_id}", extra={'chat_id': chat_id})
+            else:
+                # Kļūdu apstrāde
+                error_message = f"Kļūda atbildes ģenerēšanā: {str(e)}"
+                logger.error(error_message, extra={'chat_id': chat_id})
+
+                # Saglabā kļūdu ziņojumu datubāzē
+                status = 'error'
+                if job.message_id:
+                    db.session.rollback()
+                    checkpoint_message(job.message_id, f"{buffer.take_pending()}\n[Kļūda: {str(e)}]", 'error', wait=True)
+                    saved = True
+                job.publish({'error': error_message}, final=True)
+
+        finally:
+            job.cancel_hook = None
+            generation_scheduler.release(job.ticket)
+            record_generation_metrics(job, buffer, status)
+            if backend is not None and buffer.first_at is not None:
+                model_warmer.mark_loaded(backend, job.model_id)
+            if job.message_id and not saved:
+                db.session.rollback()
+                checkpoint_message(job.message_id, buffer.take_pending(), status, wait=True)
+            if not job.finished:
+                job.publish({'done': True}, final=True)
+            job.unregister()
+            db.session.remove()
+            logger.info(f"Ģenerācijas apstrāde pabeigta čatam: {chat_id}", extra={'chat_id': chat_id})
+
+
+def content_size(events):
+    """
+    Atgriež satura fragmentu kopējo garumu notikumu sarakstā
+    """
+    return sum(len(payload.get('content', '')) for _, payload in events)
+
+
+def format_job_events(job, events):
+    """
+    Noformē uzdevuma notikumus vienā SSE blokā, apvienojot secīgus satura fragmentus vienā notikumā
+    Apvienotā notikuma ID ir pēdējā fragmenta numurs, tāpēc Last-Event-ID atjaunošana nemainās
+    Parametri:
+        job: GenerationJob
+        events: [(kārtas numurs, dati)]
+    Atgriež: teksts, kas klientam jānosūta vienā rakstīšanas reizē
+    """
+    frames = []
+    pending = []
+    pending_seq = None
+    pending_model = None
+
+    def flush():
+        merged = {'content': ''.join(pending)}
+        if pending_model is not None:
+            # Salīdzināšanas režīmā fragmenti tiek apvienoti tikai viena modeļa ietvaros
+            merged['model'] = pending_model
+        frames.append(sse_event(merged, job.event_id(pending_seq)))
+        pending.clear()
+
+    for seq, payload in events:
+        model = payload.get('model')
+        if 'content' in payload and len(payload) == (1 if model is None else 2):
+            if pending and model != pending_model:
+                flush()
+            pending.append(payload['content'])
+            pending_seq = seq
+            pending_model = model
+            continue
+        if pending:
+            flush()
+        frames.append(sse_event(payload, job.event_id(seq)))
+    if pending:
+        flush()
+    return ''.join(frames)
+
+
+def stream_job_events(job, last_seq=0):
+    """
+    Ģenerators, kas straumē uzdevuma notikumus vienam klientam (Server-Sent Events)
+    Tokeni, kas pienāk SSE_COALESCE_INTERVAL laikā, tiek nosūtīti vienā kadrā
+    Parametri:
+        job: GenerationJob
+        last_seq: pēdējā klienta saņemtā notikuma numurs
+    """
+    window = app.config['SSE_COALESCE_INTERVAL']
+    max_bytes = app.config['SSE_COALESCE_BYTES']
+    job.attach()
+    try:
+        while True:
+            snapshot, events, finished = job.wait(last_seq, app.config['SSE_KEEPALIVE_INTERVAL'])
+            if snapshot is None and not events and not finished:
+                # Komentārs uztur savienojumu un ļauj pamanīt atvienojušos klientu
+                yield ": keep-alive\n\n"
+                continue
+
+            # Nedaudz pagaida nākamos fragmentus, lai tos nosūtītu kopā
+            deadline = time.monotonic() + window
+            while events and snapshot is None and not finished and content_size(events) < max_bytes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                more_snapshot, more, more_finished = job.wait(events[-1][0], remaining)
+                if more_snapshot is not None or not (more or more_finished):
+                    break
+                events.extend(more)
+                finished = more_finished
+
+            frames = ''
+            if snapshot is not None:
+                last_seq, payload = snapshot
+                frames = sse_event(payload, job.event_id(last_seq))
+            if events:
+                last_seq = events[-1][0]
+                frames += format_job_events(job, events)
+            if frames:
+                yield frames
+            if finished:
+                break
+    finally:
+        job.detach()
+
+
+def stored_response_events(chat_id):
+    """
+    Notikumi klientam, kura ģenerācija vairs nav atmiņā (tiek nosūtīts saglabātais saturs)
+    Ja pēdējo ziņojumu salīdzināja vairāki modeļi, tiek nosūtītas visu modeļu atbildes
+    """
+    last_user_id = (db.session.query(db.func.max(Message.id))
+                    .filter_by(chat_id=chat_id, role='user').scalar())
+    if last_user_id is not None:
+        answers = (Message.query.filter(Message.chat_id == chat_id, Message.role == 'assistant',
+                                        Message.id > last_user_id).order_by(Message.id).all())
+        if len(answers) > 1:
+            snapshots = {message.model: {'content': message.content, 'message_id': message.id} for message in answers}
+            return [sse_event({'snapshots': snapshots}), sse_event({'done': True})]
+    message = (Message.query.filter_by(chat_id=chat_id, role='assistant')
+               .order_by(Message.timestamp.desc(), Message.id.desc()).first())
+    payload = {'snapshot': message.content, 'message_id': message.id} if message else {'snapshot': ''}
+    return [sse_event(payload), sse_event({'done': True})]
+
+
+def estimate_tokens(text):
+    """
+    Aptuveni novērtē tokenu skaitu tekstā (~4 simboli uz tokenu)
+    """
+    return len(text) // 4 + 1
+
+
+def message_tokens(message):
+    # Papildu tokeni ziņojuma lomas un formatējuma dēļ
+    return estimate_tokens(message.content) + 4
+
+
+def get_context_budget(model_id):
+    """
+    Aprēķina vēstures tokenu budžetu konkrētam modelim
+    Izmanto konfigurāciju vai LM Studio norādīto konteksta garumu (max_context_length)
+    """
+    budgets = app.config['MODEL_CONTEXT_BUDGETS']
+    if model_id in budgets:
+        return int(budgets[model_id])
+    for model in get_available_models():
+        if model.get('id') == model_id and model.get('max_context_length'):
+            return max(512, int(model['max_context_length']) - app.config['RESPONSE_MAX_TOKENS'])
+    return app.config['CONTEXT_TOKEN_BUDGET']
+
+
+def build_context(chat_id, model_id):
+    """
+    Saliek čata vēsturi, kas ietilpst modeļa tokenu budžetā
+    Vecākie ziņojumi tiek aizvietoti ar saglabāto kopsavilkumu; ja vēsture neietilpst,
+    fonā tiek ieplānota kopsavilkuma atjaunināšana
+    Parametri:
+        chat_id: čata ID
+        model_id: modeļa ID
+    Atgriež: ziņojumu saraksts LM Studio pieprasījumam
+    """
+    budget = get_context_budget(model_id)
+    summary = ChatSummary.query.filter_by(chat_id=chat_id).first()
+    if summary:
+        budget -= estimate_tokens(summary.content) + 8
+
+    # Ziņojumi no jaunākā uz vecāko, kamēr ietilpst budžetā
+    query = Message.query.filter_by(chat_id=chat_id)
+    if summary:
+        query = query.filter(Message.id > summary.covers_until_id)
+    kept = []
+    used = 0
+    overflow = False
+    for message in query.order_by(Message.timestamp.desc(), Message.id.desc()).yield_per(100):
+        cost = message_tokens(message)
+        if kept and used + cost > budget:
+            overflow = True
+            break
+        kept.append(message)
+        used += cost
+    kept.reverse()
+
+    if overflow:
+        schedule_summary(chat_id, model_id, kept[0].id, budget)
+
+    history = []
+    if summary:
+        history.append({"role": "system", "content": f"Iepriekšējās sarunas kopsavilkums: {summary.content}"})
+    history.extend({"role": msg.role, "content": msg.content} for msg in collapse_compared_answers(kept, model_id))
+    return history
+
+
+def collapse_compared_answers(messages, model_id):
+    """
+    Salīdzināšanas režīmā vienam lietotāja ziņojumam ir vairākas assistenta atbildes pēc kārtas;
+    kontekstā paliek tikai viena - šī paša modeļa atbilde vai, ja tādas nav, pēdējā
+    Parametri:
+        messages: ziņojumi hronoloģiskā secībā
+        model_id: modelis, kuram tiek veidots konteksts
+    Atgriež: ziņojumu saraksts
+    """
+    result = []
+    group = []
+    for message in messages + [None]:
+        if message is not None and message.role == 'assistant':
+            group.append(message)
+            continue
+        if group:
+            own = [m for m in group if m.model == model_id]
+            result.append(own[-1] if own else group[-1])
+            group = []
+        if message is not None:
+            result.append(message)
+    return result
+
+
+def build_completion_payload(chat_id, model_id):
+    """
+    Sagatavo LM Studio pieprasījuma datus no čata vēstures
+    Parametri:
+        chat_id: čata ID
+        model_id: modeļa ID
+    Atgriež: vārdnīca ar /v1/chat/completions pieprasījuma datiem
+    """
+    return {
+        "model": model_id,
+        "messages": build_context(chat_id, model_id),
+        "stream": True,      # Straumēšanas režīms
+        "temperature": 0.6,  # Kreativitātes līmenis (kešatmiņā tikai, ja COMPLETION_CACHE_MAX_TEMPERATURE >= 0.6)
+        "max_tokens": app.config['RESPONSE_MAX_TOKENS']  # Maksimālais tokenu skaits
+    }
+
+
+# Fona kopsavilkumu ģenerēšana (viens uzdevums katram čatam vienlaicīgi)
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='summary-worker')
+summaries_in_progress = set()
+summaries_lock = threading.Lock()
+
+
+def schedule_summary(chat_id, model_id, first_kept_id, budget):
+    """
+    Ieplāno čata vecāko ziņojumu apkopošanu fonā
+    Parametri:
+        chat_id: čata ID
+        model_id: modelis, ar kuru veidot kopsavilkumu
+        first_kept_id: vecākā kontekstā iekļautā ziņojuma ID
+        budget: vēstures tokenu budžets
+    """
+    chat_id = int(chat_id)
+    with summaries_lock:
+        if chat_id in summaries_in_progress:
+            return
+        summaries_in_progress.add(chat_id)
+    summary_executor.submit(summarize_chat, chat_id, model_id, first_kept_id, budget)
+
+
+def summarize_chat(chat_id, model_id, first_kept_id, budget):
+    """
+    Apkopo ziņojumus, kas vairs neietilpst kontekstā, un saglabā kopsavilkumu
+    Lai nākamie gājieni ietilptu budžetā bez jaunas apkopošanas, kontekstā tiek atstāta
+    tikai aptuveni puse budžeta
+    """
+    try:
+        with app.app_context():
+            try:
+                summary = ChatSummary.query.filter_by(chat_id=chat_id).first()
+                query = Message.query.filter_by(chat_id=chat_id)
+                if summary:
+                    query = query.filter(Message.id > summary.covers_until_id)
+
+                # Jaunākie ziņojumi, kas paliek kontekstā (līdz pusei budžeta, vismaz viens)
+                keep_from_id = None
+                kept_tokens = 0
+                for message in query.order_by(Message.timestamp.desc(), Message.id.desc()).yield_per(100):
+                    kept_tokens += message_tokens(message)
+                    if keep_from_id is not None and kept_tokens > budget // 2:
+                        break
+                    keep_from_id = message.id
+                keep_from_id = max(keep_from_id or first_kept_id, first_kept_id)
+
+                # Kopsavilkuma pieprasījumam jāietilpst budžetā - atlikušie tiks apkopoti nākamreiz
+                chunk = []
+                used = estimate_tokens(summary.content) if summary else 0
+                older = query.filter(Message.id < keep_from_id).order_by(Message.timestamp, Message.id)
+                for message in older.yield_per(100):
+                    used += message_tokens(message)
+                    if chunk and used > budget:
+                        break
+                    chunk.append(message)
+                if not chunk:
+                    return
+
+                transcript = "\n".join(f"{m.role}: {m.content}" for m in chunk)
+                if summary:
+                    transcript = f"Iepriekšējais kopsavilkums: {summary.content}\n\n{transcript}"
+                payload = {
+                    "model": model_id,
+                    "messages": [
+                        {"role": "system", "content": "Apkopo sarunu īsi un faktiski, saglabājot svarīgas detaļas, vārdus, skaitļus un lēmumus. Atbildi sarunas valodā."},
+                        {"role": "user", "content": transcript}
+                    ],
+                    "temperature": 0.3,
+                    "max_tokens": app.config['SUMMARY_MAX_TOKENS']
+                }
+                timeout = (app.config['UPSTREAM_CONNECT_TIMEOUT'], app.config['UPSTREAM_READ_TIMEOUT'])
+                result = upstream.post_json('/v1/chat/completions', payload, model=model_id, timeout=timeout)
+                content = result['choices'][0]['message']['content'].strip()
+
+                if summary is None:
+                    summary = ChatSummary(chat_id=chat_id, content=content, covers_until_id=chunk[-1].id)
+                    db.session.add(summary)
+                else:
+                    summary.content = content
+                    summary.covers_until_id = chunk[-1].id
+                    summary.updated_at = datetime.datetime.utcnow()
+                db.session.commit()
+                logger.info(f"Čata {chat_id} kopsavilkums atjaunināts līdz ziņojumam {chunk[-1].id}", extra={'chat_id': chat_id})
+            finally:
+                db.session.remove()
+    except Exception as e:
+        logger.error(f"Kopsavilkuma ģenerēšanas kļūda čatam {chat_id}: {e}", extra={'chat_id': chat_id})
+    finally:
+        with summaries_lock:
+            summaries_in_progress.discard(chat_id)
+
+
+def create_assistant_message(chat_id, model_id, generation_id=None):
+    """
+    Izveido tukšu assistenta ziņojumu datubāzē (statuss 'streaming')
+    Parametri:
+        generation_id: ģenerācijas reģistra ieraksts, kuram piesaistīt ziņojumu
+                       (salīdzināšanā - šī modeļa GenerationLane rindai)
+    Atgriež: jaunā ziņojuma ID
+    """
+    assistant_message = Message(chat_id=chat_id, role='assistant', content="", model=model_id, status='streaming')
+    db.session.add(assistant_message)
+    db.session.flush()
+    if generation_id:
+        updated = GenerationLane.query.filter_by(generation_id=generation_id, model=model_id).update(
+            {'message_id': assistant_message.id}, synchronize_session=False)
+        if not updated:
+            Generation.query.filter_by(id=generation_id).update(
+                {'message_id': assistant_message.id}, synchronize_session=False)
+    db.session.commit()
+    return assistant_message.id
+
+
+def update_message(message_id, values):
     """
-    if 'user_id' not in session:
-        return jsonify([])
-    
-    chats = Chat.query.filter_by(user_id=session['user_id']).order_by(Chat.created_at.desc()).all()
-    return jsonify([{'id': chat.id, 'title': chat.title} for chat in chats])
+    Atjaunina ziņojuma laukus (izpilda datubāzes rakstītājs)
+    """
+    Message.query.filter_by(id=message_id).update(values, synchronize_session=False)
 
-@app.route('/stop_generation', methods=['POST'])
-def stop_generation():
+
+def checkpoint_message(message_id, delta, status=None, wait=False):
     """
-    Aptur ģenerācijas procesu konkrētam čatam (AJAX pieprasījums)
+    Pievieno ziņojumam jaunu saturu caur datubāzes rakstītāja rindu
+    Visu straumju starpstāvokļi tiek ierakstīti kopīgās transakcijās, secība saglabājas
+    Parametri:
+        message_id: ziņojuma ID
+        delta: teksts, kas jāpievieno esošajam saturam
+        status: jaunais statuss (ja jāmaina)
+        wait: vai gaidīt, līdz izmaiņas ierakstītas
+    Atgriež: Future, kas izpildās pēc ierakstīšanas
     """
-    chat_id = request.json.get('chat_id')
-    print(f"Pieprasījums apturēt ģenerāciju čatam: {chat_id}")
-    
-    if chat_id in active_generations:
-        active_generations[chat_id] = False
-        print(f"Apturēšanas karodziņš uzstādīts čatam: {chat_id}")
-    
-    return jsonify(success=True)
+    values = {}
+    if delta:
+        values['content'] = Message.content + delta
+    if status:
+        values['status'] = status
+    if not values:
+        future = Future()
+        future.set_result(None)
+        return future
+    future = db_writer.submit(update_message, message_id, values)
+    if status:
+        # Galīgais saturs tiek indeksēts meklēšanai (starpstāvokļi netiek indeksēti)
+        future = db_writer.submit(index_message, message_id)
+    if wait:
+        future.result()
+    return future
+
+
+class StreamBuffer:
+    """
+    Straumētās atbildes fragmentu buferis
+    Nosaka, kad uzkrātais saturs jāsaglabā datubāzē (pēc laika vai apjoma)
+    """
+
+    def __init__(self, flush_interval=None, flush_bytes=None):
+        self.chunks = []        # Visi saņemtie fragmenti
+        self.flushed = 0        # Cik fragmentu jau saglabāti datubāzē
+        self.pending_bytes = 0  # Nesaglabāto fragmentu apjoms
+        self.flush_interval = app.config['STREAM_FLUSH_INTERVAL'] if flush_interval is None else flush_interval
+        self.flush_bytes = app.config['STREAM_FLUSH_BYTES'] if flush_bytes is None else flush_bytes
+        self.last_flush = time.monotonic()
+        self.first_at = None    # Pirmā fragmenta saņemšanas laiks
+        self.last_at = None     # Pēdējā fragmenta saņemšanas laiks
+
+    def append(self, content):
+        """
+        Pievieno fragmentu
+        Atgriež: True, ja uzkrātais saturs jāsaglabā
+        """
+        now = time.monotonic()
+        if self.first_at is None:
+            self.first_at = now
+        self.last_at = now
+        self.chunks.append(content)
+        self.pending_bytes += len(content)
+        return (self.pending_bytes >= self.flush_bytes
+                or now - self.last_flush >= self.flush_interval)
+
+    def take_pending(self):
+        """
+        Atgriež vēl nesaglabāto saturu un atzīmē to kā saglabātu
+        """
+        pending = ''.join(self.chunks[self.flushed:])
+        self.flushed = len(self.chunks)
+        self.pending_bytes = 0
+        self.last_flush = time.monotonic()
+        return pending
+
+    def text(self):
+        return ''.join(self.chunks)
+
+
+# delta.content atrašana straumes rindā bez visa JSON objekta parsēšanas
+# (delta objektā nav ligzdotu objektu; citādi tiek izmantota pilnā parsēšana)
+DELTA_CONTENT_PATTERNS = {
+    bytes: (b'"delta"', re.compile(rb'"delta"\s*:\s*\{[^{}]*?"content"\s*:\s*("[^"\\]*(?:\\.[^"\\]*)*"|null)')),
+    str: ('"delta"', re.compile(r'"delta"\s*:\s*\{[^{}]*?"content"\s*:\s*("[^"\\]*(?:\\.[^"\\]*)*"|null)')),
+}
+
+
+def parse_stream_line(line):
+    """
+    Apstrādā vienu LM Studio straumes rindu
+    No JSON tiek nolasīts tikai delta.content; pilnā parsēšana tikai neparastas formas rindām
+    Parametri:
+        line: rinda (bytes vai str) no SSE straumes
+    Atgriež: None (nav satura), True ([DONE]) vai teksta fragmentu
+    """
+    if not line:
+        return None
+    is_bytes = isinstance(line, bytes)
+    if not line.startswith(b'data:' if is_bytes else 'data:'):
+        return None
+    json_str = line[5:].strip()
+    if json_str == (b'[DONE]' if is_bytes else '[DONE]'):
+        return True
+
+    # Atslēgu atrod ar find un regulāro izteiksmi pārbauda tikai tajā vietā (ātrāk nekā search)
+    key, pattern = DELTA_CONTENT_PATTERNS[type(line)]
+    position = json_str.find(key)
+    match = pattern.match(json_str, position) if position >= 0 else None
+    if match:
+        literal = match.group(1)
+        if len(literal) <= 2 or literal[:1] != (b'"' if is_bytes else '"'):
+            # null vai tukšs teksts
+            return None
+        if (b'\\' if is_bytes else '\\') not in literal:
+            # Bez escape secībām saturs ir tieši starp pēdiņām
+            content = literal[1:-1]
+            return content.decode('utf-8') if is_bytes else content
+        return json.loads(literal)
+
+    try:
+        # Neparasta rinda - parsē visu JSON un iegūst saturu
+        json_obj = json.loads(json_str)
+        return json_obj['choices'][0]['delta'].get('content', '') or None
+    except (JSONDecodeError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def compare_model_ids(values):
+    """
+    Atgriež pieprasījumā norādītos modeļus bez tukšām vērtībām un atkārtojumiem (secība saglabājas)
+    """
+    return list(dict.fromkeys(value.strip() for value in values if value and value.strip()))
+
 
 @app.route('/get_response', methods=['GET'])
 def get_response():
     """
     Iegūst AI atbildi (Server-Sent Events)
-    Sūta pieprasījumu uz LM Studio un straumē atbildi
+    Ja čatam jau notiek ģenerācija, pievienojas tai (arī no cita cilnes vai pēc savienojuma atjaunošanas),
+    citādi sāk jaunu ģenerāciju fonā
+    Parametri:
+        chat_id: čata ID
+        model: modeļa ID (norādot vairākas reizes - salīdzināšanas režīms, visi modeļi atbild vienlaikus)
+        attach: '1' - tikai pievienoties esošai ģenerācijai, nesākt jaunu
+        fresh: '1' - neizmantot atbilžu kešatmiņu
     """
     # Pārbauda pieteikšanos
     if 'user_id' not in session:
@@ -398,109 +3831,57 @@ def get_response():
 
     # Iegūst parametrus
     chat_id = request.args.get('chat_id')
-    model_id = request.args.get('model')
+    model_ids = compare_model_ids(request.args.getlist('model'))
+    model_id = model_ids[0] if model_ids else None
+    last_event_id = request.headers.get('Last-Event-ID')
+    attach_only = request.args.get('attach') == '1' or bool(last_event_id)
+    fresh = request.args.get('fresh') == '1'
+    if len(model_ids) > app.config['COMPARE_MAX_MODELS']:
+        return jsonify({'error': f"Vienlaikus var salīdzināt ne vairāk kā {app.config['COMPARE_MAX_MODELS']} modeļus"}), 400
 
     # Pārbauda čata piederību
     chat = Chat.query.get(chat_id)
     if not chat or chat.user_id != session['user_id']:
         return jsonify({'error': 'Nav autorizēts'}), 403
 
-    # Iegūst čata vēsturi
-    messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp).all()
-    history = [{"role": msg.role, "content": msg.content} for msg in messages]
-
     try:
-        # Pieprasījuma dati LM Studio API
-        data = {
-            "model": model_id,
-            "messages": history,
-            "stream": True,      # Straumēšanas režīms
-            "temperature": 0.6,  # Kreativitātes līmenis
-            "max_tokens": 2048   # Maksimālais tokenu skaits
-        }
-
-        def generate():
-            """
-            Ģenerators AI atbildes straumēšanai
-            Izmanto Server-Sent Events protokolu
-            """
-            # Izveido aplikācijas kontekstu ģeneratorā
-            with app.app_context():
-                assistant_message = None
-                full_content = ""
-                active_generations[chat_id] = True  # Atzīmē ģenerāciju kā aktīvu
-                
+        job, created = find_or_create_job(chat_id, model_id, session['user_id'], allow_create=not attach_only,
+                                          compare_models=model_ids)
+        if job is None:
+            # Ģenerācija vairs nav atmiņā - nosūta saglabāto atbildi
+            stream = stored_response_events(chat_id)
+        elif isinstance(job, RemoteGeneration):
+            # Ģenerācija notiek citā darba procesā - seko tās saglabātajam saturam
+            stream = follow_remote_generation(job)
+        else:
+            if created:
+                # Pieprasījuma dati LM Studio API (salīdzināšanā visiem modeļiem pirms pirmās atbildes)
                 try:
-                    # Sūta pieprasījumu uz LM Studio
-                    response = requests.post(f"{LM_STUDIO_API}/v1/chat/completions", json=data, stream=True)
-
-                    # Izveido assistenta ziņojumu datubāzē
-                    assistant_message = Message(
-                        chat_id=chat_id,
-                        role='assistant',
-                        content="",
-                        model=model_id
-                    )
-                    db.session.add(assistant_message)
-                    db.session.commit()
-                    message_id = assistant_message.id
-                    
-                    # Sūta ziņojuma ID klientam
-                    yield f'data: {{"message_id": {message_id}}}\n\n'
-
-                    # Apstrādā straumēto atbildi
-                    for line in response.iter_lines():
-                        # Pārbauda, vai ģenerācija nav apturēta
-                        if not active_generations.get(chat_id, True):
-                            print(f"Ģenerācija apturēta lietotāja dēļ čatam: {chat_id}")
-                            break
-                            
-                        if line:
-                            line_text = line.decode('utf-8').strip()
-                            if line_text.startswith('data: '):
-                                json_str = line_text[6:]
-                                if json_str == '[DONE]':
-                                    print(f"Ģenerācija pabeigta no LM Studio čatam: {chat_id}")
-                                    break
-                                try:
-                                    # Parsē JSON un iegūst saturu
-                                    json_obj = json.loads(json_str)
-                                    content = json_obj['choices'][0]['delta'].get('content', '')
-                                    if content:
-                                        full_content += content
-                                        # Sūta saturu klientam
-                                        yield f"data: {json.dumps({'content': content})}\n\n"
-                                except JSONDecodeError:
-                                    continue
-
-                    # Saglabā pilno atbildi datubāzē
-                    if assistant_message:
-                        assistant_message.content = full_content
-                        db.session.commit()
-                        print(f"Assistenta saturs saglabāts datubāzē ziņojumam: {assistant_message.id}")
+                    payloads = [(lane, *prepare_completion(chat_id, lane.model_id, fresh)) for lane in job.lanes]
+                except Exception as e:
+                    job.publish({'error': f"Kļūda atbildes ģenerēšanā: {str(e)}"}, final=True)
+                    db.session.rollback()
+                    unregister_generation(job.id)
+                    raise
 
-                    # Paziņo par ģenerācijas pabeigšanu
-                    yield f"data: {json.dumps({'done': True})}\n\n"
+                # Plānotājs palaiž katra modeļa ģenerāciju, kad tam ir brīva vieta
+                for lane, data, cached in payloads:
+                    if cached is not None:
+                        # Atbilde ir kešatmiņā - GPU nav vajadzīgs, rinda netiek gaidīta
+                        threading.Thread(target=replay_cached_completion, args=(lane, cached),
+                                         name=f'generation-{chat_id}', daemon=True).start()
+                        continue
 
-                except Exception as e:
-                    # Kļūdu apstrāde
-                    error_message = f"Kļūda atbildes ģenerēšanā: {str(e)}"
-                    print(error_message)
-                    error_data = json.dumps({'error': error_message}, ensure_ascii=False)
-                    yield f"data: {error_data}\n\n"
-                    
-                    # Saglabā kļūdu ziņojumu datubāzē
-                    if assistant_message:
-                        assistant_message.content = f"{full_content}\n[Kļūda: {str(e)}]"
-                        db.session.commit()
+                    def start(lane=lane, data=data):
+                        threading.Thread(target=run_generation_job, args=(lane, data),
+                                         name=f'generation-{chat_id}', daemon=True).start()
 
-                finally:
-                    # Notīra aktīvo ģenerāciju
-                    active_generations.pop(chat_id, None)
-                    print(f"Ģenerācijas apstrāde pabeigta čatam: {chat_id}, aktīvās ģenerācijas: {active_generations}")
+                    if not generation_scheduler.submit(lane, session['user_id'], start):
+                        reject_generation(lane)
+            stream = stream_job_events(job, job.parse_event_id(last_event_id))
 
         # Atgriež Server-Sent Events atbildi
-        response = app.response_class(generate(), mimetype='text/event-stream')
+        response = app.response_class(stream, mimetype='text/event-stream')
         response.headers.add('Cache-Control', 'no-cache')
         response.headers.add('Connection', 'keep-alive')
         return response
@@ -513,9 +3894,68 @@ def get_response():
 def models():
     """
     Atgriež pieejamo modeļu sarakstu (AJAX pieprasījums)
+    Galvenēs norāda kataloga atjaunināšanas laiku un vai dati ir novecojuši
     """
-    models = get_available_models()
-    return jsonify(models)
+    try:
+        catalog = get_model_catalog()
+    except Exception as e:
+        logger.error(f"Modeļu kataloga nolasīšanas kļūda: {e}")
+        db.session.rollback()
+        return jsonify([])
+
+    # Katalogā saglabāto ielādes stāvokli papildina ar šī procesa svaigāko informāciju
+    models = catalog['models']
+    for model in models:
+        state = model_warmer.state(model['id'])
+        model['state'] = state
+        if state == 'loaded':
+            model['loaded'] = True
+        elif state == 'unloaded':
+            model['loaded'] = False
+
+    response = jsonify(models)
+    if catalog['refreshed_at']:
+        response.headers['X-Models-Refreshed-At'] = catalog['refreshed_at']
+    response.headers['X-Models-Stale'] = 'true' if catalog['stale'] else 'false'
+    return response
+
+
+@app.route('/models/status')
+def models_status():
+    """
+    Atgriež modeļu ielādes stāvokli (AJAX pieprasījums)
+    Parametri (URL): model - konkrēta modeļa ID (var norādīt vairākas reizes)
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    model_ids = request.args.getlist('model')
+    if not model_ids:
+        try:
+            model_ids = [model['id'] for model in get_model_catalog()['models']]
+        except Exception as e:
+            logger.error(f"Modeļu kataloga nolasīšanas kļūda: {e}")
+            db.session.rollback()
+            model_ids = []
+    return jsonify(model_warmer.status(model_ids))
+
+
+@app.route('/models/warmup', methods=['POST'])
+def warmup_model():
+    """
+    Sāk izvēlētā modeļa ielādi LM Studio fonā (AJAX pieprasījums)
+    Atgriež: modeļa stāvokli - 'loaded', 'loading', 'unloaded', 'error' vai 'unknown'
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    data = request.get_json(silent=True) or {}
+    model_id = (data.get('model') or '').strip()
+    if not model_id:
+        return jsonify({'error': 'Nav norādīts modelis'}), 400
+
+    model_warmer.warm(model_id)
+    return jsonify({'model': model_id, **model_warmer.status([model_id])[model_id]})
 
 
 @app.route('/update_chat_title', methods=['POST'])
@@ -539,6 +3979,8 @@ def update_chat_title():
 
     # Atjaunina nosaukumu
     chat.title = new_title
+    db.session.flush()
+    index_chat_title(chat.id)
     db.session.commit()
 
     return jsonify({'success': True})
@@ -559,17 +4001,758 @@ def delete_chat(chat_id):
     if not chat or chat.user_id != session['user_id']:
         return jsonify({'error': 'Nav autorizēts'}), 403
 
-    # Dzēš visus čata ziņojumus
-    Message.query.filter_by(chat_id=chat_id).delete()
+    # Aptur čata ģenerāciju (ja tāda notiek)
+    stop_chat_generation(chat_id)
 
-    # Dzēš čatu
-    db.session.delete(chat)
+    # Čats uzreiz pazūd no saraksta, tā ziņojumi tiek dzēsti fonā pa daļām
+    unindex_chat_title(chat_id)
+    Chat.query.filter_by(id=chat_id).delete(synchronize_session=False)
     db.session.commit()
+    schedule_chat_purge(chat_id)
 
     return jsonify({'success': True})
 
 
+# Eksporta formāta versija (NDJSON: viens JSON ieraksts katrā rindā)
+EXPORT_FORMAT_VERSION = 1
+
+
+def format_timestamp(value):
+    return value.isoformat() + 'Z' if value else None
+
+
+def parse_timestamp(value):
+    """
+    Nolasa eksportā saglabāto laiku (ISO 8601, UTC)
+    Izmet: ValueError, ja vērtība nav derīgs laika teksts
+    """
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"laikam jābūt ISO 8601 tekstam, nevis {type(value).__name__}")
+    return datetime.datetime.fromisoformat(value.rstrip('Z'))
+
+
+def iter_export_records(user_id=None, include_users=False):
+    """
+    Straumē čatus un ziņojumus kā eksporta ierakstus (vārdnīcas)
+    Dati tiek nolasīti ar servera kursoru pa EXPORT_FETCH_SIZE rindām, tāpēc atmiņas
+    patēriņš nav atkarīgs no ziņojumu skaita
+    Parametri:
+        user_id: eksportējamā lietotāja ID (None - visi lietotāji)
+        include_users: vai pievienot lietotāju ierakstus (ar paroles hešu; tikai administratora eksportam)
+    """
+    yield {'type': 'export', 'version': EXPORT_FORMAT_VERSION,
+           'exported_at': format_timestamp(datetime.datetime.utcnow())}
+
+    fetch_size = app.config['EXPORT_FETCH_SIZE']
+    with db.engine.connect() as connection:
+        users = db.select(User.id, User.username, User.password, User.registration_ip,
+                          User.registration_date).order_by(User.id)
+        if user_id is not None:
+            users = users.where(User.id == user_id)
+        for user in connection.execution_options(yield_per=fetch_size).execute(users):
+            if include_users:
+                yield {'type': 'user', 'username': user.username, 'password': user.password,
+                       'registration_ip': user.registration_ip,
+                       'registration_date': format_timestamp(user.registration_date)}
+
+            # Viens vaicājums visiem lietotāja čatiem un ziņojumiem (čata ieraksts pirms tā ziņojumiem)
+            rows = (db.select(Chat.id, Chat.title, Chat.created_at, Chat.archived_at, Message.id.label('message_id'),
+                              Message.role, Message.content, Message.model, Message.status, Message.timestamp)
+                    .outerjoin(Message, Message.chat_id == Chat.id)
+                    .where(Chat.user_id == user.id)
+                    .order_by(Chat.id, Message.timestamp, Message.id))
+            current_chat = None
+            for row in connection.execution_options(yield_per=fetch_size).execute(rows):
+                if row.id != current_chat:
+                    current_chat = row.id
+                    yield {'type': 'chat', 'id': row.id, 'title': row.title,
+                           'created_at': format_timestamp(row.created_at)}
+                    if row.archived_at is not None:
+                        # Arhivētie ziņojumi ir vecāki par aktīvajās tabulās esošajiem
+                        for message in load_archived_messages(connection, row.id):
+                            yield {'type': 'message', 'chat_id': row.id, **message}
+                if row.message_id is not None:
+                    yield {'type': 'message', 'chat_id': row.id, 'role': row.role, 'content': row.content,
+                           'model': row.model, 'status': row.status, 'timestamp': format_timestamp(row.timestamp)}
+
+
+def encode_export(records, compress=False):
+    """
+    Pārveido eksporta ierakstus par NDJSON baitu fragmentiem (pēc izvēles gzip)
+    Atgriež: ģenerators ar fragmentiem, kas nav lielāki par aptuveni EXPORT_CHUNK_BYTES
+    """
+    chunk_bytes = app.config['EXPORT_CHUNK_BYTES']
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # 31 - gzip galvene
+    pending = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        pending.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            data = b''.join(pending)
+            pending, size = [], 0
+            data = compressor.compress(data) if compressor else data
+            if data:
+                yield data
+    data = b''.join(pending)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def open_import_stream(stream, compressed):
+    """
+    Atgriež importa datu plūsmu (gzip tiek atspiests straumējot)
+    """
+    return gzip.GzipFile(fileobj=stream, mode='rb') if compressed else stream
+
+
+# Importa ierakstu lauki un to atļautie tipi (None vienmēr atļauts)
+IMPORT_RECORD_FIELDS = {
+    'user': {'username': str, 'password': str, 'registration_ip': str},
+    'chat': {'id': int, 'title': str},
+    'message': {'chat_id': int, 'role': str, 'content': str, 'model': str, 'status': str},
+}
+IMPORT_TIMESTAMP_FIELDS = {'user': ('registration_date',), 'chat': ('created_at',), 'message': ('timestamp',)}
+MESSAGE_STATUSES = ('streaming', 'complete', 'stopped', 'error')
+
+
+def validate_import_record(record):
+    """
+    Pārbauda importa ieraksta lauku tipus un vērtības
+    Izmet: ValueError ar kļūdainā lauka aprakstu
+    """
+    kind = record.get('type')
+    if kind is not None and not isinstance(kind, str):
+        raise ValueError("laukam 'type' jābūt tekstam")
+    for field, expected in IMPORT_RECORD_FIELDS.get(kind, {}).items():
+        value = record.get(field)
+        # bool ir int apakšklase, bet nav derīgs ID
+        if value is not None and (not isinstance(value, expected) or isinstance(value, bool)):
+            raise ValueError(f"laukam '{field}' jābūt {'veselam skaitlim' if expected is int else 'tekstam'}")
+    for field in IMPORT_TIMESTAMP_FIELDS.get(kind, ()):
+        try:
+            parse_timestamp(record.get(field))
+        except ValueError as e:
+            raise ValueError(f"nederīgs lauks '{field}': {e}")
+    if kind == 'message' and record.get('status') not in (None, '', *MESSAGE_STATUSES):
+        raise ValueError(f"nederīgs ziņojuma statuss: {record['status']}")
+
+
+def iter_import_records(stream):
+    """
+    Nolasa NDJSON ierakstus pa vienai rindai
+    Parametri:
+        stream: binārā plūsma
+    """
+    max_line = app.config['IMPORT_MAX_LINE_BYTES']
+    number = 0
+    while True:
+        line = stream.readline(max_line + 1)
+        if not line:
+            return
+        number += 1
+        if len(line) > max_line:
+            raise ValueError(f"Importa rinda {number} ir pārāk gara")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except JSONDecodeError as e:
+            raise ValueError(f"Nederīgs JSON importa rindā {number}: {e}")
+        if not isinstance(record, dict):
+            raise ValueError(f"Importa rindā {number} jābūt JSON objektam")
+        try:
+            validate_import_record(record)
+        except ValueError as e:
+            raise ValueError(f"Nederīgs ieraksts importa rindā {number}: {e}")
+        yield record
+
+
+def import_records(records, user_id=None, batch_size=None):
+    """
+    Importē čatus un ziņojumus ar grupētām transakcijām (BATCH_SIZE ziņojumi vienā commit)
+    Importētie čati vienmēr tiek izveidoti no jauna (ar jauniem ID)
+    Parametri:
+        records: eksporta ierakstu iterators
+        user_id: lietotājs, kuram pievienot čatus (None - lietotāji no 'user' ierakstiem)
+        batch_size: ziņojumu skaits vienā transakcijā
+    Atgriež: statistika {'users', 'chats', 'messages', 'skipped'}
+    """
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    stats = {'users': 0, 'chats': 0, 'messages': 0, 'skipped': 0}
+    owner_id = user_id
+    chat_ids = {}       # eksporta čata ID -> jaunais čata ID (pašreizējam lietotājam)
+    pending = []        # ziņojumi, kas vēl nav ierakstīti
+
+    def write_messages():
+        if not pending:
+            return
+        bulk_insert_messages(pending, owner_id)
+        stats['messages'] += len(pending)
+        pending.clear()
+        db.session.commit()
+
+    try:
+        for record in records:
+            kind = record.get('type')
+            if kind == 'user' and user_id is None:
+                write_messages()
+                user = User.query.filter_by(username=record.get('username')).first()
+                if user is None:
+                    if not record.get('username') or not record.get('password'):
+                        stats['skipped'] += 1
+                        continue
+                    user = User(username=record['username'], password=record['password'],
+                                registration_ip=record.get('registration_ip') or '0.0.0.0',
+                                registration_date=parse_timestamp(record.get('registration_date')))
+                    db.session.add(user)
+                    db.session.flush()
+                    stats['users'] += 1
+                owner_id = user.id
+                chat_ids.clear()
+
+            elif kind == 'chat' and owner_id is not None:
+                chat = Chat(user_id=owner_id, title=str(record.get('title') or DEFAULT_CHAT_TITLE)[:100],
+                            created_at=parse_timestamp(record.get('created_at')) or datetime.datetime.utcnow())
+                db.session.add(chat)
+                db.session.flush()
+                index_chat_title(chat.id)
+                chat_ids[record.get('id')] = chat.id
+                stats['chats'] += 1
+
+            elif kind == 'message' and record.get('chat_id') in chat_ids and record.get('role') in ('user', 'assistant'):
+                status = record.get('status') or 'complete'
+                pending.append({
+                    'chat_id': chat_ids[record['chat_id']],
+                    'role': record['role'],
+                    'content': str(record.get('content') or ''),
+                    'model': record.get('model'),
+                    # Nepabeigta straume netiks turpināta
+                    'status': 'stopped' if status == 'streaming' else status,
+                    'timestamp': parse_timestamp(record.get('timestamp')) or datetime.datetime.utcnow(),
+                })
+                if len(pending) >= batch_size:
+                    write_messages()
+
+            elif kind not in ('export', 'user'):
+                stats['skipped'] += 1
+
+        write_messages()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
+
+
+@app.route('/export')
+def export_chats():
+    """
+    Lejupielādē visus lietotāja čatus un ziņojumus (NDJSON straume)
+    Parametri:
+        format: 'ndjson' (noklusējums) vai 'gzip'
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    compress = request.args.get('format') == 'gzip'
+    filename = f"chats-{session['user_id']}-{datetime.datetime.utcnow():%Y%m%d}.ndjson"
+    records = iter_export_records(session['user_id'])
+    response = app.response_class(stream_with_context(encode_export(records, compress)),
+                                  mimetype='application/gzip' if compress else 'application/x-ndjson')
+    response.headers['Content-Disposition'] = f"attachment; filename={filename}{'.gz' if compress else ''}"
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@app.route('/import', methods=['POST'])
+def import_chats():
+    """
+    Importē čatus no NDJSON eksporta (faila lauks 'file' vai pieprasījuma saturs)
+    Gzip tiek atpazīts pēc faila paplašinājuma .gz vai galvenes Content-Encoding: gzip
+    Atgriež: JSON ar importēto čatu un ziņojumu skaitu
+    """
+    if 'user_id' not in session:
+        return jsonify({'error': 'Nav pieteicies'}), 401
+
+    upload = request.files.get('file')
+    if upload is not None:
+        stream = open_import_stream(upload.stream, (upload.filename or '').endswith('.gz'))
+    else:
+        compressed = (request.headers.get('Content-Encoding') == 'gzip'
+                      or request.mimetype in ('application/gzip', 'application/x-gzip'))
+        stream = open_import_stream(request.stream, compressed)
+
+    try:
+        stats = import_records(iter_import_records(stream), user_id=session['user_id'])
+    except (ValueError, OSError, EOFError) as e:
+        return jsonify({'error': f"Importa kļūda: {e}"}), 400
+    logger.info(f"Importēti {stats['chats']} čati un {stats['messages']} ziņojumi",
+                extra={'user_id': session['user_id']})
+    return jsonify({'success': True, **stats})
+
+
+def compress_archive(data):
+    """
+    Saspiež arhīva datus ar ARCHIVE_CODEC (zstd tikai tad, ja pieejama pakotne zstandard)
+    Atgriež: (kodeks, saspiestie dati)
+    """
+    if app.config['ARCHIVE_CODEC'] == 'zstd' and zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=10).compress(data)
+    return 'zlib', zlib.compress(data, 9)
+
+
+def decompress_archive(codec, payload):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Arhīva atjaunošanai nepieciešama pakotne zstandard")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+def load_archived_messages(connection, chat_id):
+    """
+    Nolasa arhivēta čata ziņojumus
+    Parametri:
+        connection: datubāzes savienojums vai sesija
+        chat_id: čata ID
+    Atgriež: ziņojumu vārdnīcu saraksts (role, content, model, status, timestamp)
+    """
+    archive = connection.execute(db.select(ChatArchive.codec, ChatArchive.payload)
+                                 .where(ChatArchive.chat_id == chat_id)).first()
+    if archive is None:
+        return []
+    return json.loads(decompress_archive(archive.codec, archive.payload))
+
+
+def chat_last_activity():
+    """
+    SQL izteiksme: pēdējā čata ziņojuma laiks (vai izveides laiks, ja ziņojumu nav)
+    max() pa indeksu (chat_id, timestamp) ir viena indeksa meklēšana katram čatam
+    """
+    return db.func.coalesce(
+        db.select(db.func.max(Message.timestamp)).where(Message.chat_id == Chat.id).scalar_subquery(),
+        Chat.created_at)
+
+
+def archive_chat(chat_id, cutoff):
+    """
+    Pārvieto neaktīva čata ziņojumus uz saspiestu arhīvu (vienā transakcijā)
+    Arhivētie ziņojumi netiek meklēti, čata nosaukums paliek meklēšanas indeksā
+    Parametri:
+        chat_id: čata ID
+        cutoff: čats tiek arhivēts tikai tad, ja pēc šī laika tajā nav bijis ziņojumu
+    Atgriež: arhivēto ziņojumu skaits vai None, ja čats pa to laiku tika izmantots
+    """
+    # Nosacījumi tiek pārbaudīti vēlreiz pašā UPDATE, tāpēc jauns ziņojums vai ģenerācija atceļ arhivēšanu
+    claimed = Chat.query.filter(
+        Chat.id == chat_id, Chat.archived_at.is_(None), chat_last_activity() < cutoff,
+        ~db.exists().where(Generation.chat_id == Chat.id)
+    ).update({'archived_at': datetime.datetime.utcnow()}, synchronize_session=False)
+    if not claimed:
+        db.session.rollback()
+        return None
+
+    rows = db.session.execute(
+        db.select(Message.id, Message.role, Message.content, Message.model, Message.status, Message.timestamp)
+        .where(Message.chat_id == chat_id).order_by(Message.timestamp, Message.id)).all()
+    payload = json.dumps([{'role': row.role, 'content': row.content, 'model': row.model, 'status': row.status,
+                           'timestamp': format_timestamp(row.timestamp)} for row in rows], ensure_ascii=False)
+    codec, blob = compress_archive(payload.encode('utf-8'))
+    db.session.add(ChatArchive(chat_id=chat_id, codec=codec, payload=blob, message_count=len(rows)))
+
+    unindex_messages([row.id for row in rows])
+    Message.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    # Kopsavilkums atsaucas uz ziņojumu ID, kas pēc atjaunošanas mainās
+    ChatSummary.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    db.session.commit()
+    return len(rows)
+
+
+def restore_chat(chat_id):
+    """
+    Atjauno arhivēta čata ziņojumus aktīvajās tabulās (ar jauniem ID) un meklēšanas indeksā
+    Atgriež: atjaunoto ziņojumu skaits
+    """
+    # Tikai viens pieprasījums atjauno čatu, pārējie redz jau atjaunotu
+    restored = Chat.query.filter(Chat.id == chat_id, Chat.archived_at.isnot(None)).update(
+        {'archived_at': None}, synchronize_session=False)
+    if not restored:
+        db.session.rollback()
+        return 0
+
+    messages = load_archived_messages(db.session, chat_id)
+    user_id = db.session.execute(db.select(Chat.user_id).where(Chat.id == chat_id)).scalar()
+    bulk_insert_messages([{
+        'chat_id': chat_id,
+        'role': message['role'],
+        'content': message['content'],
+        'model': message.get('model'),
+        'status': message.get('status') or 'complete',
+        'timestamp': parse_timestamp(message.get('timestamp')),
+    } for message in messages], user_id)
+    ChatArchive.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+    db.session.commit()
+    return len(messages)
+
+
+def ensure_chat_restored(chat):
+    """
+    Atjauno čatu, ja tas ir arhivēts (aktīvam čatam - bez papildu vaicājumiem)
+    """
+    if chat.archived_at is None:
+        return
+    count = restore_chat(chat.id)
+    db.session.refresh(chat)
+    logger.info(f"Atjaunots arhivēts čats {chat.id} ({count} ziņojumi)", extra={'chat_id': chat.id})
+
+
+def archive_inactive_chats(cutoff):
+    """
+    Arhivē visus čatus, kuros nav bijis ziņojumu kopš cutoff
+    Atgriež: (arhivēto čatu skaits, arhivēto ziņojumu skaits)
+    """
+    chats = messages = 0
+    last_id = 0
+    while True:
+        candidates = db.session.execute(
+            db.select(Chat.id)
+            .where(Chat.id > last_id, Chat.archived_at.is_(None), chat_last_activity() < cutoff,
+                   db.exists().where(Message.chat_id == Chat.id))
+            .order_by(Chat.id).limit(app.config['RETENTION_BATCH_SIZE'])).scalars().all()
+        db.session.rollback()
+        if not candidates:
+            return chats, messages
+        for chat_id in candidates:
+            count = archive_chat(chat_id, cutoff)
+            if count is not None:
+                chats += 1
+                messages += count
+        last_id = candidates[-1]
+
+
+def prune_login_logs(cutoff):
+    """
+    Apkopo vecos pieteikšanās ierakstus LoginStat tabulā (pa lietotājiem un dienām) un tos dzēš
+    Atgriež: dzēsto ierakstu skaits
+    """
+    rollup = db.text(
+        "INSERT INTO login_stat (user_id, day, logins) "
+        "SELECT user_id, date(login_time), count(*) FROM login_log "
+        "WHERE id BETWEEN :first AND :last AND login_time < :cutoff "
+        "GROUP BY user_id, date(login_time) "
+        "ON CONFLICT (user_id, day) DO UPDATE SET logins = logins + excluded.logins"
+    ).bindparams(db.bindparam('cutoff', type_=db.DateTime))
+    pruned = 0
+    while True:
+        # Ieraksti tiek pievienoti ID secībā, tāpēc vecākie ir tabulas sākumā
+        ids = db.session.execute(
+            db.select(LoginLog.id).where(LoginLog.login_time < cutoff).order_by(LoginLog.id)
+            .limit(app.config['RETENTION_BATCH_SIZE'])).scalars().all()
+        if not ids:
+            db.session.rollback()
+            return pruned
+        db.session.execute(rollup, {'first': ids[0], 'last': ids[-1], 'cutoff': cutoff})
+        pruned += LoginLog.query.filter(LoginLog.id.between(ids[0], ids[-1]), LoginLog.login_time < cutoff).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+
+def purge_chat_rows(chat_ids):
+    """
+    Dzēš dzēstu čatu ziņojumus, meklēšanas indeksu, kopsavilkumus un arhīvus
+    Ziņojumi tiek dzēsti pa RETENTION_BATCH_SIZE rindām īsās transakcijās, lai neaizturētu citus rakstītājus
+    Atgriež: dzēsto ziņojumu skaits
+    """
+    deleted = 0
+    for chat_id in chat_ids:
+        while True:
+            ids = db.session.execute(db.select(Message.id).where(Message.chat_id == chat_id)
+                                     .limit(app.config['RETENTION_BATCH_SIZE'])).scalars().all()
+            if not ids:
+                break
+            unindex_messages(ids)
+            Message.query.filter(Message.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
+        ChatSummary.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+        ChatArchive.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+        db.session.commit()
+    return deleted
+
+
+def purge_orphaned_rows():
+    """
+    Dzēš ziņojumus un arhīvus, kuru čats vairs neeksistē (piemēram, process apstājās fona dzēšanas laikā)
+    Atgriež: dzēsto ziņojumu skaits
+    """
+    live_chats = db.select(Chat.id)
+    orphans = db.session.execute(db.union(
+        db.select(Message.chat_id).where(Message.chat_id.not_in(live_chats)),
+        db.select(ChatArchive.chat_id).where(ChatArchive.chat_id.not_in(live_chats)),
+        db.select(ChatSummary.chat_id).where(ChatSummary.chat_id.not_in(live_chats)))).scalars().all()
+    db.session.rollback()
+    return purge_chat_rows(orphans)
+
+
+# Lieli dzēšanas darbi tiek izpildīti atsevišķā pavedienā (neaiztur pieprasījumus un datubāzes rakstītāju)
+bulk_delete_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-delete')
+
+
+def schedule_chat_purge(chat_id):
+    """
+    Ieplāno dzēsta čata rindu dzēšanu fonā
+    """
+    def purge():
+        with app.app_context():
+            try:
+                deleted = purge_chat_rows([chat_id])
+                logger.info(f"Dzēsti {deleted} čata {chat_id} ziņojumi", extra={'chat_id': chat_id})
+            except Exception as e:
+                logger.error(f"Čata dzēšanas kļūda: {e}", extra={'chat_id': chat_id})
+                db.session.rollback()
+            finally:
+                db.session.remove()
+    bulk_delete_executor.submit(purge)
+
+
+def run_retention():
+    """
+    Izpilda datu glabāšanas darbus: neaktīvo čatu arhivēšana, pieteikšanās žurnāla apkopošana
+    un pamestu rindu dzēšana
+    Atgriež: statistika
+    """
+    now = datetime.datetime.utcnow()
+    stats = {'archived_chats': 0, 'archived_messages': 0, 'pruned_login_logs': 0, 'purged_messages': 0}
+    if app.config['ARCHIVE_AFTER_DAYS'] > 0:
+        stats['archived_chats'], stats['archived_messages'] = archive_inactive_chats(
+            now - datetime.timedelta(days=app.config['ARCHIVE_AFTER_DAYS']))
+    if app.config['LOGIN_LOG_RETENTION_DAYS'] > 0:
+        stats['pruned_login_logs'] = prune_login_logs(
+            now - datetime.timedelta(days=app.config['LOGIN_LOG_RETENTION_DAYS']))
+    stats['purged_messages'] = purge_orphaned_rows()
+    return stats
+
+
+def retention_worker():
+    """
+    Fona pavediens, kas periodiski izpilda datu glabāšanas darbus
+    Vairāki procesi var to darīt vienlaikus - katrs čats tiek arhivēts ar nosacītu UPDATE
+    """
+    while True:
+        time.sleep(app.config['RETENTION_INTERVAL'])
+        with app.app_context():
+            try:
+                stats = run_retention()
+                if any(stats.values()):
+                    logger.info("Datu glabāšanas darbi pabeigti", extra=stats)
+            except Exception as e:
+                logger.error(f"Datu glabāšanas kļūda: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+
+def hot_query_plans():
+    """
+    Atgriež biežāk izmantoto vaicājumu SQLite izpildes plānus
+    Atgriež: saraksts ar (apraksts, sagaidāmais indekss, plāna rindas)
+    """
+    queries = [
+        ("Čata ziņojumi pēc laika", 'ix_message_chat_id_timestamp',
+         Message.query.filter_by(chat_id=1).order_by(Message.timestamp)),
+        ("Lietotāja čati pēc izveides laika", 'ix_chat_user_id_created_at',
+         Chat.query.filter_by(user_id=1).order_by(Chat.created_at.desc())),
+        ("Reģistrācijas IP pārbaude", 'ix_user_registration_ip',
+         User.query.filter_by(registration_ip='127.0.0.1')),
+        ("Čata ziņojumu lapa", 'ix_message_chat_id_timestamp',
+         Message.query.filter_by(chat_id=1)
+         .filter(db.tuple_(Message.timestamp, Message.id) < (datetime.datetime.utcnow(), 1))
+         .order_by(Message.timestamp.desc(), Message.id.desc()).limit(51)),
+        ("Lietotāja čatu lapa", 'ix_chat_user_id_created_at',
+         Chat.query.filter_by(user_id=1)
+         .filter(db.tuple_(Chat.created_at, Chat.id) < (datetime.datetime.utcnow(), 1))
+         .order_by(Chat.created_at.desc(), Chat.id.desc()).limit(51)),
+    ]
+    plans = []
+    for description, index_name, query in queries:
+        compiled = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        rows = db.session.execute(db.text(f"EXPLAIN QUERY PLAN {compiled}")).fetchall()
+        plans.append((description, index_name, [row[-1] for row in rows]))
+    return plans
+
+
+@app.cli.command('list-generations')
+def list_generations_command():
+    """
+    Izdrukā aktīvās ģenerācijas visos darba procesos
+    """
+    reap_stale_generations()
+    generations = Generation.query.order_by(Generation.started_at).all()
+    if not generations:
+        print("Aktīvu ģenerāciju nav")
+    for generation in generations:
+        flags = ' (apturēšana pieprasīta)' if generation.stop_requested else ''
+        print(f"{generation.id} čats={generation.chat_id} lietotājs={generation.user_id} "
+              f"modelis={generation.model} process={generation.pid} "
+              f"sākta={generation.started_at:%Y-%m-%d %H:%M:%S} "
+              f"pulss={generation.heartbeat_at:%H:%M:%S}{flags}")
+
+
+@app.cli.command('check-indexes')
+def check_indexes_command():
+    """
+    Pārbauda, vai biežākie vaicājumi izmanto indeksus (beidzas ar kļūdu, ja nē)
+    """
+    failed = False
+    for description, index_name, plan in hot_query_plans():
+        uses_index = any(index_name in step for step in plan)
+        sorts_in_memory = any('TEMP B-TREE' in step for step in plan)
+        ok = uses_index and not sorts_in_memory
+        failed = failed or not ok
+        print(f"[{'OK' if ok else 'KĻŪDA'}] {description}: {'; '.join(plan)}")
+    if failed:
+        raise SystemExit(1)
+
+
+@app.cli.command('rebuild-search-index')
+@click.option('--batch-size', default=5000, show_default=True, help="Ziņojumu skaits vienā transakcijā")
+def rebuild_search_index_command(batch_size):
+    """
+    No jauna aizpilda pilnteksta meklēšanas indeksu no esošajiem ziņojumiem un čatu nosaukumiem
+    Darbojas pa daļām, lai citi procesi varētu rakstīt datubāzē starp transakcijām
+    """
+    db.session.execute(db.text("DELETE FROM search_index"))
+    db.session.execute(db.text(
+        "INSERT INTO search_index (rowid, body, owner, chat_id) "
+        "SELECT -chat.id, chat.title, 'u' || chat.user_id, chat.id FROM chat WHERE chat.title != :default"),
+        {'default': DEFAULT_CHAT_TITLE})
+    db.session.commit()
+
+    last_id = 0
+    indexed = 0
+    while True:
+        ids = db.session.execute(db.text(
+            "SELECT id FROM message WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': batch_size}).scalars().all()
+        if not ids:
+            break
+        db.session.execute(db.text(
+            "INSERT INTO search_index (rowid, body, owner, chat_id) "
+            "SELECT message.id, message.content, 'u' || chat.user_id, message.chat_id "
+            "FROM message JOIN chat ON chat.id = message.chat_id "
+            "WHERE message.id BETWEEN :first AND :last AND message.content != ''"),
+            {'first': ids[0], 'last': ids[-1]})
+        db.session.commit()
+        last_id = ids[-1]
+        indexed += len(ids)
+        print(f"Indeksēti {indexed} ziņojumi (līdz ID {last_id})")
+
+    db.session.execute(db.text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    db.session.commit()
+    print(f"Meklēšanas indekss atjaunots: {indexed} ziņojumi")
+
+
+@app.cli.command('export-chats')
+@click.argument('output', type=click.Path(dir_okay=False, allow_dash=True), default='-')
+@click.option('--user', 'username', default=None, help="Eksportēt tikai šo lietotāju")
+def export_chats_command(output, username):
+    """
+    Eksportē visu (vai viena) lietotāju čatus NDJSON failā (.gz - saspiestu)
+    Lietotāju ieraksti ietver paroles hešus, lai tos varētu atjaunot ar import-chats
+    """
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f"Lietotājs nav atrasts: {username}")
+        user_id = user.id
+    records = iter_export_records(user_id, include_users=True)
+    with click.open_file(output, 'wb') as file:
+        for chunk in encode_export(records, compress=output.endswith('.gz')):
+            file.write(chunk)
+
+
+@app.cli.command('import-chats')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False, allow_dash=True))
+@click.option('--user', 'username', default=None,
+              help="Pievienot visus čatus šim lietotājam (citādi lietotāji tiek ņemti no faila)")
+def import_chats_command(source, username):
+    """
+    Importē čatus no export-chats vai /export faila
+    """
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException(f"Lietotājs nav atrasts: {username}")
+        user_id = user.id
+    with click.open_file(source, 'rb') as file:
+        stream = open_import_stream(file, source.endswith('.gz'))
+        try:
+            stats = import_records(iter_import_records(stream), user_id=user_id)
+        except (ValueError, OSError, EOFError) as e:
+            raise click.ClickException(str(e))
+    print(f"Importēti {stats['users']} lietotāji, {stats['chats']} čati, {stats['messages']} ziņojumi "
+          f"(izlaisti ieraksti: {stats['skipped']})")
+
+
+@app.cli.command('run-retention')
+def run_retention_command():
+    """
+    Uzreiz izpilda datu glabāšanas darbus (arhivēšana, pieteikšanās žurnāla apkopošana, pamestu rindu dzēšana)
+    """
+    stats = run_retention()
+    print(f"Arhivēti {stats['archived_chats']} čati ({stats['archived_messages']} ziņojumi), "
+          f"apkopoti {stats['pruned_login_logs']} pieteikšanās ieraksti, "
+          f"dzēsti {stats['purged_messages']} pamesti ziņojumi")
+
+
+@app.cli.command('completion-cache')
+@click.option('--clear', is_flag=True, help="Iztukšot kešatmiņas failu")
+def completion_cache_command(clear):
+    """
+    Parāda atbilžu kešatmiņas faila statistiku (COMPLETION_CACHE_PATH) vai to iztukšo
+    """
+    if not completion_cache.path:
+        print("COMPLETION_CACHE_PATH nav iestatīts - kešatmiņa ir tikai darba procesu atmiņā "
+              "(trāpījumi redzami /metrics: completion_cache_requests_total)")
+        return
+    if clear:
+        completion_cache.clear()
+        print("Kešatmiņa iztukšota")
+        return
+    entries, size = completion_cache.disk_stats()
+    print(f"Ieraksti: {entries}, saturs: {size / 1024:.1f} KiB, fails: {completion_cache.path}")
+
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help="Dzēst iepriekšējo versiju failus, kas vairs nav manifestā")
+def build_assets_command(clean):
+    """
+    Izveido statisko failu versijas ar hešu nosaukumā un to .gz/.br variantus (piemēram, izvietošanas laikā)
+    """
+    manifest = static_assets.build()
+    for logical, hashed in sorted(manifest.items()):
+        print(f"{logical} -> {hashed}")
+    if brotli is None:
+        print("Pakotne brotli nav instalēta - izveidoti tikai .gz varianti")
+    if clean:
+        print(f"Dzēsti {static_assets.clean()} novecojuši faili")
+
+
+# Fona pavedienu palaišana
+start_background_workers()
+
+
 # Aplikācijas palaišana
 if __name__ == '__main__':
     # Palaiž aplikāciju debug režīmā, pieejamu no visām IP adresēm
+    # (asinhronajam straumēšanas režīmam izmanto: uvicorn asgi:application)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
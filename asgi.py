@@ -0,0 +1,536 @@
+"""
+Asinhronais (ASGI) servēšanas režīms
+
+/get_response straumēšana notiek ar asyncio un nebloķējošu I/O, tāpēc viens process
+var vienlaikus apkalpot simtiem atbilžu straumju. Visi pārējie maršruti tiek nodoti
+parastajai Flask aplikācijai caur WSGI adapteri.
+
+Palaišana:
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+
+Nepieciešamās pakotnes: httpx, uvicorn
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import httpx
+from itsdangerous import BadSignature
+
+from app import (app, db, Chat, upstream, title_queue, sse_event, prepare_completion, create_assistant_message,
+                 checkpoint_message, StreamBuffer, parse_stream_line, find_or_create_job, stored_response_events,
+                 RemoteGeneration, poll_remote_generation, unregister_generation, generation_scheduler,
+                 reject_generation, content_size, format_job_events, logger, record_upstream_call, upstream_error_kind,
+                 record_generation_metrics, model_warmer, announce_model_load, compare_model_ids, completion_cache,
+                 replay_cached_completion, REQUEST_DURATION)
+
+# Asinhronie HTTP klienti (viens katram LM Studio serverim, izveidoti pēc pieprasījuma)
+_async_clients = {}
+
+# Fona ģenerāciju uzdevumi (saglabā atsauces, lai tos nesavāktu atkritumu savācējs)
+_background_tasks = set()
+
+# Server-Sent Events atbildes galvenes
+SSE_HEADERS = [
+    (b'content-type', b'text/event-stream; charset=utf-8'),
+    (b'cache-control', b'no-cache'),
+    (b'connection', b'keep-alive'),
+]
+
+
+def build_environ(scope, body):
+    """
+    Izveido WSGI vidi no ASGI pieprasījuma
+    """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'content-length':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def flask_application(scope, receive, send):
+    """
+    Izpilda parasto Flask aplikāciju pavedienu kopā (katrs pieprasījums savā pavedienā)
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        body.extend(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+
+    loop = asyncio.get_running_loop()
+    environ = build_environ(scope, bytes(body))
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run_wsgi():
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]),
+                          [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+
+        result = app.wsgi_app(environ, start_response)
+        try:
+            header_sent = False
+            for chunk in result:
+                if not header_sent:
+                    send_from_thread({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+                    header_sent = True
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not header_sent:
+                send_from_thread({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    await asyncio.to_thread(run_wsgi)
+
+
+def get_async_client(backend):
+    """
+    Atgriež pastāvīgu asinhrono HTTP klientu konkrētajam serverim
+    Parametri:
+        backend: UpstreamBackend no app.upstream
+    """
+    client = _async_clients.get(backend.url)
+    if client is None:
+        limits = httpx.Limits(max_connections=None, max_keepalive_connections=app.config['UPSTREAM_POOL_SIZE'])
+        timeout = httpx.Timeout(connect=app.config['UPSTREAM_CONNECT_TIMEOUT'],
+                                read=app.config['UPSTREAM_READ_TIMEOUT'], write=30.0, pool=None)
+        client = httpx.AsyncClient(base_url=backend.url, limits=limits, timeout=timeout)
+        _async_clients[backend.url] = client
+    return client
+
+
+def load_session_user(scope):
+    """
+    Nolasa lietotāja ID no Flask sesijas sīkdatnes
+    Atgriež: user_id vai None
+    """
+    cookie_header = b''
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookie_header = value
+            break
+    cookies = SimpleCookie(cookie_header.decode('latin-1'))
+    morsel = cookies.get(app.config.get('SESSION_COOKIE_NAME', 'session'))
+    if morsel is None:
+        return None
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(morsel.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+
+def chat_belongs_to(user_id, chat_id):
+    """
+    Pārbauda čata piederību (izpildās atsevišķā pavedienā)
+    """
+    with app.app_context():
+        try:
+            chat = db.session.get(Chat, int(chat_id)) if chat_id and chat_id.isdigit() else None
+            return bool(chat and chat.user_id == user_id)
+        finally:
+            db.session.remove()
+
+
+def run_in_app_context(func, *args):
+    """
+    Izpilda datubāzes funkciju ar aplikācijas kontekstu atsevišķā pavedienā
+    """
+    def wrapper():
+        with app.app_context():
+            try:
+                return func(*args)
+            finally:
+                db.session.remove()
+    return asyncio.to_thread(wrapper)
+
+
+async def send_json(send, status, payload):
+    """
+    Nosūta vienkāršu JSON atbildi
+    """
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    """
+    Gaida, līdz klients aizver savienojumu
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def run_generation_job(job, data):
+    """
+    Asinhronā ģenerācijas izpilde - publicē notikumus uzdevuma buferī
+    Parametri:
+        job: GenerationJob
+        data: LM Studio pieprasījuma dati
+    """
+    chat_id = job.chat_id
+    buffer = StreamBuffer()
+    status = 'stopped'
+    saved = False
+    backend = None
+    response = None
+    ok = False
+    try:
+        # Apturēšana atceļ šo uzdevumu, un httpx uzreiz aizver savienojumu ar LM Studio -
+        # arī modeļa ielādes vai uzvednes apstrādes laikā, pirms pirmā tokena
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        job.cancel_hook = lambda: loop.call_soon_threadsafe(task.cancel)
+
+        if job.should_stop():
+            # Apturēta vai pamesta, kamēr gaidīja rindā
+            logger.info(f"Ģenerācija atcelta pirms sākuma čatam: {chat_id}", extra={'chat_id': chat_id})
+            return
+
+        # Brīdina klientus, ja atbilde gaidīs modeļa ielādi
+        announce_model_load(job)
+
+        backend = upstream.choose(job.model_id)
+        client = get_async_client(backend)
+        started = time.perf_counter()
+        async with client.stream('POST', '/v1/chat/completions', json=data) as response:
+            ok = response.status_code < 500
+            record_upstream_call(backend.url, '/v1/chat/completions', time.perf_counter() - started,
+                                 status=response.status_code)
+            response.raise_for_status()
+
+            # Izveido assistenta ziņojumu datubāzē un paziņo tā ID klientiem
+            # (apturēšana šajā brīdī izveidi nepārtrauc, lai ziņojums netiktu pamests statusā 'streaming')
+            creation = asyncio.ensure_future(
+                run_in_app_context(create_assistant_message, chat_id, job.model_id, job.id))
+            try:
+                job.message_id = await asyncio.shield(creation)
+            except asyncio.CancelledError:
+                job.message_id = await creation
+                raise
+            job.publish({'message_id': job.message_id})
+
+            # Apstrādā straumēto atbildi
+            async for line in response.aiter_lines():
+                # Pārbauda, vai ģenerācija nav apturēta
+                if job.should_stop():
+                    logger.info(f"Ģenerācija apturēta čatam: {chat_id}", extra={'chat_id': chat_id})
+                    break
+
+                content = parse_stream_line(line)
+                if content is True:
+                    logger.info(f"Ģenerācija pabeigta no LM Studio čatam: {chat_id}", extra={'chat_id': chat_id})
+                    status = 'complete'
+                    break
+                if content:
+                    # Periodiski saglabā uzkrāto saturu datubāzē
+                    if buffer.append(content):
+                        # Tikai pievieno rakstītāja rindai, negaidot ierakstīšanu
+                        checkpoint_message(job.message_id, buffer.take_pending())
+                    job.publish({'content': content})
+
+                # Sūta fonā ģenerēto čata nosaukumu, tiklīdz tas ir gatavs
+                title = title_queue.pop_ready(chat_id)
+                if title:
+                    job.publish({'title': title})
+            else:
+                # Straume beidzās bez [DONE]
+                status = 'complete'
+
+        # Saglabā atlikušo atbildi datubāzē
+        await asyncio.wrap_future(checkpoint_message(job.message_id, buffer.take_pending(), status))
+        saved = True
+        if status == 'complete' and completion_cache.cacheable(data):
+            # Diska kešatmiņa ir SQLite fails - raksta ārpus notikumu cilpas
+            await asyncio.to_thread(completion_cache.store, data, buffer.text())
+        title = title_queue.pop_ready(chat_id)
+        if title:
+            job.publish({'title': title})
+        job.publish({'done': True}, final=True)
+
+    except asyncio.CancelledError:
+        # Uzdevumu atcēla apturēšana - tā nav kļūda
+        logger.info(f"Ģenerācija apturēta čatam: {chat_id}", extra={'chat_id': chat_id})
+        if response is None:
+            # Atcelts pirms atbildes galvenēm - servera veselība netiek vērtēta
+            ok = None
+
+    except Exception as e:
+        # Kļūdu apstrāde
+        error_message = f"Kļūda atbildes ģenerēšanā: {str(e)}"
+        logger.error(error_message, extra={'chat_id': chat_id})
+        status = 'error'
+        if isinstance(e, httpx.TransportError):
+            # Savienojums pārtrūka (arī straumes vidū) - servera kļūme
+            ok = False
+        if backend is not None and response is None and isinstance(e, httpx.HTTPError):
+            record_upstream_call(backend.url, '/v1/chat/completions', error_kind=upstream_error_kind(e))
+        if job.message_id:
+            saved = True
+            await asyncio.wrap_future(checkpoint_message(job.message_id,
+                                                         f"{buffer.take_pending()}\n[Kļūda: {str(e)}]", 'error'))
+        job.publish({'error': error_message}, final=True)
+
+    finally:
+        job.cancel_hook = None
+        generation_scheduler.release(job.ticket)
+        record_generation_metrics(job, buffer, status)
+        if backend is not None:
+            upstream.release(backend, ok)
+            if buffer.first_at is not None:
+                model_warmer.mark_loaded(backend, job.model_id)
+        if job.message_id and not saved:
+            await asyncio.shield(asyncio.wrap_future(checkpoint_message(job.message_id, buffer.take_pending(), status)))
+        if not job.finished:
+            job.publish({'done': True}, final=True)
+        await asyncio.shield(run_in_app_context(job.unregister))
+        logger.info(f"Ģenerācijas apstrāde pabeigta čatam: {chat_id}", extra={'chat_id': chat_id})
+
+
+async def stream_job_events(job, last_seq, send_text):
+    """
+    Straumē uzdevuma notikumus vienam klientam, negaidot bloķējoši
+    Tokeni, kas pienāk SSE_COALESCE_INTERVAL laikā, tiek nosūtīti vienā kadrā
+    Parametri:
+        job: GenerationJob
+        last_seq: pēdējā klienta saņemtā notikuma numurs
+        send_text: korutīna teksta nosūtīšanai klientam
+    """
+    loop = asyncio.get_running_loop()
+    window = app.config['SSE_COALESCE_INTERVAL']
+    max_bytes = app.config['SSE_COALESCE_BYTES']
+    job.attach()
+    try:
+        while True:
+            waiter = asyncio.Event()
+            snapshot, events, finished = job.read(last_seq, waiter=(loop, waiter))
+            if snapshot is None and not events and not finished:
+                try:
+                    await asyncio.wait_for(waiter.wait(), app.config['SSE_KEEPALIVE_INTERVAL'])
+                except asyncio.TimeoutError:
+                    await send_text(": keep-alive\n\n")
+                continue
+
+            # Nedaudz pagaida nākamos fragmentus, lai tos nosūtītu kopā
+            deadline = loop.time() + window
+            while events and snapshot is None and not finished and content_size(events) < max_bytes:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                waiter = asyncio.Event()
+                more_snapshot, more, more_finished = job.read(events[-1][0], waiter=(loop, waiter))
+                if more_snapshot is not None:
+                    break
+                if not (more or more_finished):
+                    try:
+                        await asyncio.wait_for(waiter.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                    continue
+                events.extend(more)
+                finished = more_finished
+
+            frames = ''
+            if snapshot is not None:
+                last_seq, payload = snapshot
+                frames = sse_event(payload, job.event_id(last_seq))
+            if events:
+                last_seq = events[-1][0]
+                frames += format_job_events(job, events)
+            if frames:
+                await send_text(frames)
+            if finished:
+                break
+    finally:
+        job.detach()
+
+
+async def follow_remote_generation(remote, send_text):
+    """
+    Straumē citā darba procesā notiekošu ģenerāciju, nolasot tās saglabāto saturu
+    Parametri:
+        remote: RemoteGeneration
+        send_text: korutīna teksta nosūtīšanai klientam
+    """
+    state = {}
+    loop = asyncio.get_running_loop()
+    last_sent = loop.time()
+    while True:
+        events, finished = await run_in_app_context(poll_remote_generation, remote, state)
+        for text in events:
+            await send_text(text)
+        if finished:
+            return
+        if events:
+            last_sent = loop.time()
+        elif loop.time() - last_sent >= app.config['SSE_KEEPALIVE_INTERVAL']:
+            last_sent = loop.time()
+            await send_text(": keep-alive\n\n")
+        await asyncio.sleep(app.config['STREAM_FLUSH_INTERVAL'])
+
+
+async def get_response(scope, receive, send):
+    """
+    Asinhronā /get_response versija (Server-Sent Events)
+    Pievienojas čata aktīvajai ģenerācijai vai sāk jaunu, neaizņemot pavedienu visas ģenerācijas laikā
+    """
+    user_id = load_session_user(scope)
+    if user_id is None:
+        await send_json(send, 401, {'error': 'Nav pieteicies'})
+        return
+
+    # Iegūst parametrus
+    params = parse_qs(scope.get('query_string', b'').decode('utf-8'))
+    chat_id = params.get('chat_id', [None])[0]
+    model_ids = compare_model_ids(params.get('model', []))
+    model_id = model_ids[0] if model_ids else None
+    headers = dict(scope.get('headers', []))
+    last_event_id = headers.get(b'last-event-id', b'').decode('latin-1') or None
+    attach_only = params.get('attach', [None])[0] == '1' or bool(last_event_id)
+    fresh = params.get('fresh', [None])[0] == '1'
+    if len(model_ids) > app.config['COMPARE_MAX_MODELS']:
+        await send_json(send, 400, {'error': f"Vienlaikus var salīdzināt ne vairāk kā {app.config['COMPARE_MAX_MODELS']} modeļus"})
+        return
+
+    if not await asyncio.to_thread(chat_belongs_to, user_id, chat_id):
+        await send_json(send, 403, {'error': 'Nav autorizēts'})
+        return
+
+    try:
+        job, created = await run_in_app_context(find_or_create_job, chat_id, model_id, user_id, not attach_only,
+                                                model_ids)
+    except Exception as e:
+        await send_json(send, 500, {'error': str(e)})
+        return
+    if created:
+        try:
+            # Salīdzināšanā konteksts visiem modeļiem tiek salikts pirms pirmās atbildes
+            payloads = [(lane, *await run_in_app_context(prepare_completion, chat_id, lane.model_id, fresh))
+                        for lane in job.lanes]
+        except Exception as e:
+            job.publish({'error': f"Kļūda atbildes ģenerēšanā: {str(e)}"}, final=True)
+            await run_in_app_context(unregister_generation, job.id)
+            await send_json(send, 500, {'error': str(e)})
+            return
+        loop = asyncio.get_running_loop()
+
+        def spawn(lane, data):
+            task = asyncio.ensure_future(run_generation_job(lane, data))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+        # Plānotājs palaiž katra modeļa ģenerāciju, kad tam ir brīva vieta (arī no cita pavediena)
+        for lane, data, cached in payloads:
+            if cached is not None:
+                # Atbilde ir kešatmiņā - GPU nav vajadzīgs, rinda netiek gaidīta
+                task = asyncio.ensure_future(asyncio.to_thread(replay_cached_completion, lane, cached))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+                continue
+            start = lambda lane=lane, data=data: loop.call_soon_threadsafe(spawn, lane, data)
+            if not generation_scheduler.submit(lane, user_id, start):
+                await run_in_app_context(reject_generation, lane)
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': SSE_HEADERS})
+
+    async def send_text(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    if job is None:
+        # Ģenerācija vairs nav atmiņā - nosūta saglabāto atbildi
+        for text in await run_in_app_context(stored_response_events, chat_id):
+            await send_text(text)
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return
+
+    # Klienta atvienošanās pārtrauc tikai šo straumi, nevis pašu ģenerāciju
+    if isinstance(job, RemoteGeneration):
+        # Ģenerācija notiek citā darba procesā
+        stream_task = asyncio.ensure_future(follow_remote_generation(job, send_text))
+    else:
+        stream_task = asyncio.ensure_future(stream_job_events(job, job.parse_event_id(last_event_id), send_text))
+    disconnect_task = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await asyncio.wait({stream_task, disconnect_task}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (stream_task, disconnect_task):
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(stream_task, disconnect_task, return_exceptions=True)
+
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def application(scope, receive, send):
+    """
+    ASGI ieejas punkts
+    """
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for client in _async_clients.values():
+                    await client.aclose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'http' and scope['path'] == '/get_response' and scope['method'] == 'GET':
+        started = time.perf_counter()
+
+        async def send_measured(message):
+            # Latentums tiek mērīts līdz atbildes galvenēm (tāpat kā Flask maršrutiem)
+            if message['type'] == 'http.response.start':
+                REQUEST_DURATION.observe(time.perf_counter() - started, 'GET', '/get_response',
+                                         str(message['status']))
+            await send(message)
+
+        await get_response(scope, receive, send_measured)
+        return
+
+    await flask_application(scope, receive, send)
@@ -0,0 +1,3 @@
+"""
+Veiktspējas mērījumi: LM Studio aizstājējs, slodzes ģenerators un SQLite rakstīšanas ceļa tests
+"""
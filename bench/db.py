@@ -0,0 +1,193 @@
+"""
+SQLite rakstīšanas ceļa veiktspējas tests
+
+Mēra ziņojumu rakstīšanas un lasīšanas caurlaidību ar straumēšanai līdzīgu slodzi:
+vairākas straumes pievieno saturu saviem ziņojumiem, kamēr citi pavedieni lasa ziņojumu lapas.
+Salīdzina divus režīmus uz atsevišķām pagaidu datubāzēm:
+    baseline - noklusējuma žurnāls un commit katram ierakstam straumes pavedienā (kā pirms rakstītāja);
+    shipped  - aplikācijas rakstīšanas ceļš bez izmaiņām: WAL un PRAGMA (configure_sqlite_connection),
+               checkpoint_message un db_writer grupas commit
+
+Palaišana:
+    python -m bench.db --seconds 5 --writers 8 --readers 4 --output db.json
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import nullcontext
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+
+def import_app(path):
+    """
+    Importē aplikāciju ar pagaidu datubāzi (importējot tiek piemērotas migrācijas)
+    Aplikācija izmanto savu dzinēju un rakstītāju - tās datubāzes paplašinājums netiek pārsaistīts
+    """
+    os.environ['DATABASE_URL'] = f"sqlite:///{path}"
+    import app as chatbot
+    return chatbot
+
+
+class BaselineTarget:
+    """Atsevišķs SQLAlchemy dzinējs bez aplikācijas PRAGMA; katrs ieraksts - sava transakcija"""
+
+    name = 'noklusējuma žurnāls, commit katram ierakstam'
+
+    def __init__(self, chatbot, path):
+        self.chatbot = chatbot
+        self.engine = create_engine(f"sqlite:///{path}")
+        chatbot.db.metadata.create_all(self.engine)
+        self.session = scoped_session(sessionmaker(bind=self.engine))
+
+    def context(self):
+        return nullcontext()
+
+    def write(self, message_id, count):
+        Message = self.chatbot.Message
+        try:
+            self.session.query(Message).filter_by(id=message_id).update(
+                {'content': Message.content + ' tok'}, synchronize_session=False)
+            self.session.commit()
+            count('writes')
+        except OperationalError:
+            self.session.rollback()
+            count('lock_errors')
+
+    def finish(self):
+        self.engine.dispose()
+
+
+class ShippedTarget:
+    """Aplikācijas rakstīšanas ceļš: checkpoint_message pievieno saturu db_writer rindai"""
+
+    name = 'WAL + PRAGMA + grupas commit'
+
+    def __init__(self, chatbot):
+        self.chatbot = chatbot
+        self.session = chatbot.db.session
+
+    def context(self):
+        return self.chatbot.app.app_context()
+
+    def write(self, message_id, count):
+        writer = self.chatbot.db_writer
+        future = self.chatbot.checkpoint_message(message_id, ' tok')
+        future.add_done_callback(lambda f: count('writes' if f.exception() is None else 'lock_errors'))
+        if writer.queue.qsize() > writer.batch_size * 2:
+            # Pilna rinda aptur straumes (kā lēns disks)
+            future.result()
+
+    def finish(self):
+        self.chatbot.db_writer.flush()
+
+
+def seed(target, chats=100, messages=2000):
+    """
+    Izveido lietotāju, čatus un straumējamus assistenta ziņojumus
+    Atgriež: (čatu ID saraksts, ziņojumu ID saraksts)
+    """
+    chatbot = target.chatbot
+    with target.context():
+        session = target.session
+        user = chatbot.User(username='bench', password='-', registration_ip='127.0.0.1')
+        session.add(user)
+        session.flush()
+        chat_rows = [chatbot.Chat(user_id=user.id, title='bench') for _ in range(chats)]
+        session.add_all(chat_rows)
+        session.flush()
+        started_at = datetime.datetime.utcnow()
+        session.add_all([chatbot.Message(chat_id=chat_rows[i % chats].id, role='assistant', content='',
+                                         status='streaming', timestamp=started_at + datetime.timedelta(seconds=i))
+                         for i in range(messages)])
+        session.commit()
+        chat_ids = [chat.id for chat in chat_rows]
+        message_ids = [row[0] for row in session.query(chatbot.Message.id).all()]
+        session.remove()
+    return chat_ids, message_ids
+
+
+def measure(target, writers, readers, seconds):
+    """
+    Darbina straumju rakstītājus un lapu lasītājus norādīto laiku
+    Atgriež: vārdnīca ar rakstīšanas/lasīšanas operācijām sekundē un slēdzeņu kļūdu skaitu
+    """
+    chat_ids, message_ids = seed(target)
+    Message = target.chatbot.Message
+    stats = {'writes': 0, 'reads': 0, 'lock_errors': 0}
+    stats_lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def count(key):
+        with stats_lock:
+            stats[key] += 1
+
+    def stream_writer(number):
+        message_id = message_ids[number * 7 % len(message_ids)]
+        with target.context():
+            while time.monotonic() < stop_at:
+                target.write(message_id, count)
+            target.session.remove()
+
+    def reader(number):
+        chat_id = chat_ids[number % len(chat_ids)]
+        with target.context():
+            while time.monotonic() < stop_at:
+                try:
+                    (target.session.query(Message).filter_by(chat_id=chat_id)
+                     .order_by(Message.timestamp.desc()).limit(50).all())
+                    count('reads')
+                except OperationalError:
+                    count('lock_errors')
+                finally:
+                    target.session.remove()
+
+    threads = [threading.Thread(target=stream_writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    target.finish()
+    elapsed = time.monotonic() - started
+    return {
+        'writes_per_second': round(stats['writes'] / elapsed),
+        'reads_per_second': round(stats['reads'] / elapsed),
+        'lock_errors': stats['lock_errors'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite rakstīšanas ceļa veiktspējas tests")
+    parser.add_argument('--writers', type=int, default=8, help="Straumju skaits, kas pievieno saturu ziņojumiem")
+    parser.add_argument('--readers', type=int, default=4, help="Pavedienu skaits, kas lasa ziņojumu lapas")
+    parser.add_argument('--seconds', type=float, default=5.0, help="Katra mērījuma ilgums (s)")
+    parser.add_argument('--output', default=None, help="JSON rezultāta fails (noklusējums - stdout)")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        chatbot = import_app(os.path.join(directory, 'shipped.db'))
+        for target in (BaselineTarget(chatbot, os.path.join(directory, 'baseline.db')), ShippedTarget(chatbot)):
+            results[target.name] = measure(target, args.writers, args.readers, args.seconds)
+            print(f"{target.name}: {results[target.name]}", file=sys.stderr)
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Rezultāts saglabāts: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
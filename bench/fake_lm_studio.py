@@ -0,0 +1,214 @@
+"""
+Lokāls OpenAI-saderīgs LM Studio aizstājējs veiktspējas mērījumiem
+
+Straumē sintētiskus tokenus ar norādīto ātrumu un aizturi, tāpēc aplikāciju var
+slodzes testēt bez GPU un īsta LM Studio.
+
+Palaišana:
+    python -m bench.fake_lm_studio --port 1234 --rate 40 --first-token-latency 0.3
+
+Aplikācija jāpalaiž ar LM_STUDIO_BACKENDS=http://127.0.0.1:1234
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeLMStudio:
+    """
+    Sintētisko tokenu ģeneratora parametri un statistika
+    """
+
+    def __init__(self, models=('bench-model',), tokens=200, rate=40.0, first_token_latency=0.3,
+                 jitter=0.1, total_rate=0.0, load_time=0.0):
+        self.models = list(models)
+        self.tokens = tokens                            # Tokenu skaits vienā atbildē
+        self.rate = rate                                # Tokeni sekundē vienai straumei
+        self.first_token_latency = first_token_latency  # Aizture līdz pirmajam tokenam (prompt apstrāde)
+        self.jitter = jitter                            # Nejauša aiztures novirze (daļa no intervāla)
+        self.total_rate = total_rate                    # Kopējā caurlaidība visām straumēm (0 - neierobežota)
+        self.load_time = load_time                      # Modeļa ielādes laiks pirmajā pieprasījumā (0 - visi ielādēti)
+        self.loaded = set() if load_time > 0 else set(self.models)
+        self.loading = {}                               # Modelis -> notikums, kas iestājas pēc ielādes
+        self.lock = threading.Lock()
+        self.stats = {'streams': 0, 'completed': 0, 'cancelled': 0, 'completions': 0, 'tokens': 0, 'active': 0,
+                      'loads': 0}
+
+    def count(self, key, value=1):
+        with self.lock:
+            self.stats[key] += value
+
+    def token_interval(self):
+        """
+        Intervāls līdz nākamajam tokenam
+        Ja norādīta kopējā caurlaidība, tā tiek sadalīta starp aktīvajām straumēm (kā vienam GPU)
+        """
+        rate = self.rate
+        if self.total_rate:
+            rate = min(rate, self.total_rate / max(1, self.stats['active']))
+        interval = 1.0 / rate if rate > 0 else 0.0
+        return max(0.0, interval * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def ensure_loaded(self, model):
+        """
+        Imitē LM Studio JIT ielādi - pirmais pieprasījums modelim gaida load_time sekundes,
+        vienlaicīgie pieprasījumi gaida to pašu ielādi
+        """
+        with self.lock:
+            if model in self.loaded:
+                return
+            event = self.loading.get(model)
+            owner = event is None
+            if owner:
+                event = self.loading[model] = threading.Event()
+        if not owner:
+            event.wait()
+            return
+        time.sleep(self.load_time)
+        with self.lock:
+            self.loaded.add(model)
+            self.loading.pop(model, None)
+            self.stats['loads'] += 1
+        event.set()
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+def make_handler(fake):
+    """
+    Izveido HTTP pieprasījumu apstrādātāju konkrētajam FakeLMStudio
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/v1/models':
+                self.send_json(200, {'object': 'list', 'data': [
+                    {'id': model, 'object': 'model', 'owned_by': 'bench'} for model in fake.models]})
+            elif self.path == '/api/v0/models':
+                self.send_json(200, {'object': 'list', 'data': [
+                    {'id': model, 'object': 'model', 'type': 'llm',
+                     'state': 'loaded' if model in fake.loaded else 'not-loaded'} for model in fake.models]})
+            elif self.path == '/stats':
+                self.send_json(200, fake.snapshot())
+            else:
+                self.send_json(404, {'error': 'Not found'})
+
+        def do_POST(self):
+            if self.path != '/v1/chat/completions':
+                self.send_json(404, {'error': 'Not found'})
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            max_tokens = request.get('max_tokens') or fake.tokens
+            tokens = min(fake.tokens, max_tokens) if max_tokens > 0 else fake.tokens
+            fake.ensure_loaded(request.get('model'))
+            time.sleep(fake.first_token_latency)
+
+            if not request.get('stream'):
+                # Nosaukumi un kopsavilkumi - atbilde uzreiz
+                fake.count('completions')
+                content = ' '.join(f"w{i}" for i in range(min(tokens, 8)))
+                self.send_json(200, {
+                    'id': 'chatcmpl-bench', 'object': 'chat.completion', 'model': request.get('model'),
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content},
+                                 'finish_reason': 'stop'}],
+                    'usage': {'completion_tokens': min(tokens, 8)}})
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            fake.count('streams')
+            fake.count('active')
+            try:
+                for i in range(tokens):
+                    chunk = {'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                             'model': request.get('model'),
+                             'choices': [{'index': 0, 'delta': {'content': f"w{i} "}, 'finish_reason': None}]}
+                    self.write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                    fake.count('tokens')
+                    time.sleep(fake.token_interval())
+                self.write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                fake.count('completed')
+            except (BrokenPipeError, ConnectionResetError):
+                # Klients aizvēra savienojumu (ģenerācija apturēta)
+                fake.count('cancelled')
+            finally:
+                fake.count('active', -1)
+
+        def write_chunk(self, text):
+            data = text.encode('utf-8')
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_server(fake, host='127.0.0.1', port=1234):
+    """
+    Palaiž serveri fona pavedienā
+    Atgriež: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-lm-studio', daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument('--models', default='bench-model', help="Modeļu ID, atdalīti ar komatu")
+    parser.add_argument('--tokens', type=int, default=200, help="Tokenu skaits vienā atbildē")
+    parser.add_argument('--rate', type=float, default=40.0, help="Tokeni sekundē vienai straumei")
+    parser.add_argument('--first-token-latency', type=float, default=0.3, help="Aizture līdz pirmajam tokenam (s)")
+    parser.add_argument('--jitter', type=float, default=0.1, help="Nejauša tokenu intervāla novirze (0-1)")
+    parser.add_argument('--total-rate', type=float, default=0.0,
+                        help="Kopējā tokenu caurlaidība visām straumēm (0 - neierobežota)")
+    parser.add_argument('--load-time', type=float, default=0.0,
+                        help="Modeļa ielādes laiks pirmajā pieprasījumā (s, 0 - modeļi jau ielādēti)")
+
+
+def fake_from_arguments(args):
+    return FakeLMStudio(models=[m.strip() for m in args.models.split(',') if m.strip()], tokens=args.tokens,
+                        rate=args.rate, first_token_latency=args.first_token_latency, jitter=args.jitter,
+                        total_rate=args.total_rate, load_time=args.load_time)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-saderīgs LM Studio aizstājējs slodzes testiem")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1234)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    fake = fake_from_arguments(args)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(fake))
+    server.daemon_threads = True
+    print(f"Fake LM Studio klausās uz http://{args.host}:{args.port} (modeļi: {', '.join(fake.models)})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,350 @@
+"""
+Slodzes ģenerators aplikācijas veiktspējas mērījumiem
+
+Simulē daudzus vienlaicīgus lietotājus, kas reģistrējas, piesakās, sūta ziņojumus,
+saņem atbildes (SSE), atver čatu sarakstu un čatus. Mēra katra maršruta latentumu
+(p50/p95/p99), laiku līdz pirmajam tokenam, intervālu starp tokeniem un SQLite
+rakstīšanas slēdzeņa gaidīšanas laiku. Rezultāts tiek izdrukāts JSON formātā.
+
+Palaišana (ar iebūvētu LM Studio aizstājēju):
+    python -m bench.load --fake-lm-port 1234 --users 50 --rounds 3 --db instance/chatbot.db --output result.json
+    LM_STUDIO_BACKENDS=http://127.0.0.1:1234 flask --app app run    # atsevišķā terminālī
+
+Divu rezultātu salīdzināšana:
+    python -m bench.load --compare vecais.json jaunais.json
+"""
+import argparse
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+import requests
+
+from bench.fake_lm_studio import add_arguments, fake_from_arguments, start_server
+
+
+def percentile(values, fraction):
+    """
+    Atgriež procentili (lineārā interpolācija) vai None tukšam sarakstam
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values, errors=0):
+    """
+    Latentumu kopsavilkums milisekundēs
+    """
+    milliseconds = [value * 1000 for value in values]
+    result = {'count': len(values), 'errors': errors}
+    if milliseconds:
+        result.update({
+            'mean_ms': round(sum(milliseconds) / len(milliseconds), 2),
+            'p50_ms': round(percentile(milliseconds, 0.50), 2),
+            'p95_ms': round(percentile(milliseconds, 0.95), 2),
+            'p99_ms': round(percentile(milliseconds, 0.99), 2),
+            'max_ms': round(max(milliseconds), 2),
+        })
+    return result
+
+
+class Recorder:
+    """
+    Pavedienu droša mērījumu uzkrāšana
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}     # maršruts -> [sekundes]
+        self.errors = {}        # maršruts -> kļūdu skaits
+        self.ttft = []
+        self.inter_token = []
+        self.stream_tokens = 0
+        self.stream_seconds = 0.0
+
+    def record(self, endpoint, seconds, ok=True):
+        with self.lock:
+            self.latencies.setdefault(endpoint, [])
+            self.errors.setdefault(endpoint, 0)
+            if ok:
+                self.latencies[endpoint].append(seconds)
+            else:
+                self.errors[endpoint] += 1
+
+    def record_stream(self, ttft, gaps, tokens, seconds):
+        with self.lock:
+            if ttft is not None:
+                self.ttft.append(ttft)
+            self.inter_token.extend(gaps)
+            self.stream_tokens += tokens
+            self.stream_seconds += seconds
+
+
+class LockProbe:
+    """
+    Periodiski mēra, cik ilgi jāgaida SQLite rakstīšanas slēdzenis (BEGIN IMMEDIATE) aplikācijas datubāzē
+    """
+
+    def __init__(self, path, interval=0.05):
+        self.path = path
+        self.interval = interval
+        self.waits = []
+        self.timeouts = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='lock-probe', daemon=True)
+
+    def run(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            while not self.stopped.is_set():
+                started = time.perf_counter()
+                try:
+                    connection.execute("BEGIN IMMEDIATE")
+                    connection.execute("ROLLBACK")
+                    self.waits.append(time.perf_counter() - started)
+                except sqlite3.OperationalError:
+                    self.timeouts += 1
+                self.stopped.wait(self.interval)
+        finally:
+            connection.close()
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def timed(recorder, endpoint, call):
+    """
+    Izpilda HTTP pieprasījumu un ieraksta tā latentumu
+    Atgriež: requests.Response vai None kļūdas gadījumā
+    """
+    started = time.perf_counter()
+    try:
+        response = call()
+    except requests.RequestException:
+        recorder.record(endpoint, 0, ok=False)
+        return None
+    elapsed = time.perf_counter() - started
+    recorder.record(endpoint, elapsed, ok=response.status_code < 400)
+    return response
+
+
+def read_stream(recorder, session, base_url, chat_id, model, timeout):
+    """
+    Nolasa /get_response straumi un mēra laiku līdz pirmajam tokenam un starp tokeniem
+    """
+    started = time.perf_counter()
+    first = last = None
+    gaps = []
+    tokens = 0
+    ok = False
+    try:
+        with session.get(f"{base_url}/get_response", params={'chat_id': chat_id, 'model': model},
+                         stream=True, timeout=timeout) as response:
+            if response.status_code >= 400:
+                recorder.record('/get_response', 0, ok=False)
+                return
+            for line in response.iter_lines():
+                if not line.startswith(b'data:'):
+                    continue
+                payload = json.loads(line[5:])
+                text = payload.get('content') or payload.get('snapshot')
+                if text:
+                    now = time.perf_counter()
+                    count = max(1, len(text.split()))
+                    if first is None:
+                        first = now
+                    elif last is not None:
+                        # Apvienotā kadrā esošie tokeni sadala intervālu vienādi
+                        gaps.extend([(now - last) / count] * count)
+                    last = now
+                    tokens += count
+                if payload.get('error'):
+                    break
+                if payload.get('done'):
+                    ok = True
+                    break
+    except (requests.RequestException, ValueError):
+        ok = False
+    total = time.perf_counter() - started
+    recorder.record('/get_response', total, ok=ok)
+    recorder.record_stream(first - started if first else None, gaps, tokens,
+                           (last - first) if first and last else 0.0)
+
+
+def simulate_user(number, args, recorder, run_id, start_barrier):
+    """
+    Viena lietotāja scenārijs: reģistrācija, pieteikšanās, vairāki ziņojumi ar atbildēm
+    """
+    base_url = args.url.rstrip('/')
+    session = requests.Session()
+    # Katram lietotājam sava IP adrese (aplikācija atļauj vienu reģistrāciju no IP)
+    session.headers['X-Forwarded-For'] = f"10.{(number >> 16) & 255}.{(number >> 8) & 255}.{number & 255}"
+    username = f"bench-{run_id}-{number}"
+    password = 'bench-password'
+
+    try:
+        start_barrier.wait()
+    except threading.BrokenBarrierError:
+        return
+
+    timed(recorder, '/register', lambda: session.post(f"{base_url}/register",
+                                                      data={'username': username, 'password': password},
+                                                      allow_redirects=False, timeout=args.timeout))
+    login = timed(recorder, '/login', lambda: session.post(f"{base_url}/login",
+                                                           data={'username': username, 'password': password},
+                                                           allow_redirects=False, timeout=args.timeout))
+    if login is None or 'session' not in session.cookies:
+        return
+
+    created = timed(recorder, '/create_chat', lambda: session.post(f"{base_url}/create_chat", timeout=args.timeout))
+    if created is None or created.status_code >= 400:
+        return
+    chat_id = created.json()['id']
+
+    for round_number in range(args.rounds):
+        sent = timed(recorder, '/send_message', lambda: session.post(
+            f"{base_url}/send_message", timeout=args.timeout,
+            json={'chat_id': chat_id, 'model': args.model, 'content': f"Jautājums {round_number} no {username}"}))
+        if sent is None or sent.status_code >= 400:
+            continue
+        read_stream(recorder, session, base_url, chat_id, args.model, args.timeout)
+        timed(recorder, '/get_chats', lambda: session.get(f"{base_url}/get_chats", timeout=args.timeout))
+        timed(recorder, '/chat/<id>', lambda: session.get(f"{base_url}/chat/{chat_id}", timeout=args.timeout))
+        if args.think_time:
+            time.sleep(args.think_time)
+
+
+def run_load(args):
+    """
+    Palaiž slodzes testu un atgriež rezultātu vārdnīcu
+    """
+    fake = server = None
+    if args.fake_lm_port:
+        fake = fake_from_arguments(args)
+        server = start_server(fake, port=args.fake_lm_port)
+        if not args.model:
+            args.model = fake.models[0]
+    args.model = args.model or 'bench-model'
+
+    recorder = Recorder()
+    probe = LockProbe(args.db) if args.db else None
+    run_id = uuid.uuid4().hex[:8]
+    barrier = threading.Barrier(args.users)
+    threads = [threading.Thread(target=simulate_user, args=(i, args, recorder, run_id, barrier), daemon=True)
+               for i in range(args.users)]
+
+    if probe:
+        probe.start()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - started
+    if probe:
+        probe.stop()
+
+    result = {
+        'run_id': run_id,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'config': {'url': args.url, 'users': args.users, 'rounds': args.rounds, 'model': args.model,
+                   'think_time': args.think_time},
+        'duration_s': round(duration, 3),
+        'endpoints': {endpoint: summarize(recorder.latencies[endpoint], recorder.errors[endpoint])
+                      for endpoint in sorted(recorder.latencies)},
+        'ttft': summarize(recorder.ttft),
+        'inter_token': summarize(recorder.inter_token),
+        'tokens_per_second': round(recorder.stream_tokens / recorder.stream_seconds, 2)
+        if recorder.stream_seconds else None,
+        'requests_per_second': round(sum(len(v) for v in recorder.latencies.values()) / duration, 2),
+    }
+    if probe:
+        result['db_lock_wait'] = summarize(probe.waits, probe.timeouts)
+    if fake:
+        result['fake_lm_studio'] = dict(fake.snapshot(), rate=fake.rate, tokens_per_response=fake.tokens,
+                                        first_token_latency=fake.first_token_latency, total_rate=fake.total_rate)
+        server.shutdown()
+    return result
+
+
+def compare(old_path, new_path, threshold):
+    """
+    Salīdzina divus rezultātu failus un izdrukā latentuma izmaiņas
+    Atgriež: izejas kods (1, ja kāds p95 pasliktinājies vairāk par slieksni)
+    """
+    with open(old_path, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+
+    metrics = [(f"endpoint {name}", old['endpoints'].get(name, {}), new['endpoints'].get(name, {}))
+               for name in sorted(set(old['endpoints']) | set(new['endpoints']))]
+    metrics += [(name, old.get(name) or {}, new.get(name) or {}) for name in ('ttft', 'inter_token', 'db_lock_wait')]
+
+    regressions = []
+    report = {}
+    for name, before, after in metrics:
+        row = {}
+        for key in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if before.get(key) is not None and after.get(key) is not None:
+                change = (after[key] - before[key]) / before[key] if before[key] else 0.0
+                row[key] = {'old': before[key], 'new': after[key], 'change': round(change, 4)}
+                if key == 'p95_ms' and change > threshold:
+                    regressions.append(name)
+        report[name] = row
+    print(json.dumps({'comparison': report, 'regressions': regressions}, ensure_ascii=False, indent=2))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aplikācijas slodzes un veiktspējas tests")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="Aplikācijas adrese")
+    parser.add_argument('--users', type=int, default=20, help="Vienlaicīgo lietotāju skaits")
+    parser.add_argument('--rounds', type=int, default=3, help="Ziņojumu skaits katram lietotājam")
+    parser.add_argument('--model', default=None, help="Modeļa ID (noklusējums - pirmais aizstājēja modelis)")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Pauze starp lietotāja ziņojumiem (s)")
+    parser.add_argument('--timeout', type=float, default=300.0, help="HTTP pieprasījuma taimauts (s)")
+    parser.add_argument('--db', default=None, help="Aplikācijas SQLite fails slēdzeņa gaidīšanas mērīšanai")
+    parser.add_argument('--output', default=None, help="JSON rezultāta fails (noklusējums - stdout)")
+    parser.add_argument('--fake-lm-port', type=int, default=0,
+                        help="Palaist iebūvētu LM Studio aizstājēju uz šī porta")
+    parser.add_argument('--compare', nargs=2, metavar=('VECAIS', 'JAUNAIS'), help="Salīdzināt divus rezultātus")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="Pieļaujamā p95 pasliktināšanās salīdzinot (daļa)")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    if args.db and not os.path.exists(args.db):
+        parser.error(f"Datubāzes fails nav atrasts: {args.db}")
+
+    result = run_load(args)
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f"Rezultāts saglabāts: {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
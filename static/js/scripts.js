@@ -3,19 +3,27 @@ document.addEventListener('DOMContentLoaded', function() {
     const messageForm = document.getElementById('message-form');
     const messageInput = document.getElementById('message-input');
     const sendButton = document.getElementById('send-button');
+    const regenerateButton = document.getElementById('regenerate-button');
     const messagesContainer = document.getElementById('messages-container');
     const modelSelect = document.getElementById('model-select');
     const modelStatus = document.getElementById('model-status');
+    const compareToggle = document.getElementById('compare-toggle');
     const newChatBtn = document.getElementById('new-chat-btn');
     const chatIdInput = document.getElementById('chat-id');
     
     // Status flags
     let isGenerating = false;
     let eventSource = null;
+    let titlePending = false;
+    let responseLanes = null;   // Compare mode: model -> response text element
     
     // Initialize selectedModel from current selection
     let selectedModel = localStorage.getItem('selectedModel') || '';
     
+    // Model warm-up state polling
+    let warmupTimer = null;
+    const WARMUP_POLL_INTERVAL = 2000;
+
     // Update model status on page load
     if (selectedModel) {
         modelStatus.textContent = 'Aviable';
@@ -39,6 +47,8 @@ document.addEventListener('DOMContentLoaded', function() {
         if (selectedModel) {
             modelStatus.textContent = 'Aviable';
             modelStatus.className = 'model-status available';
+            // Ask the server to load the models before the first message is sent
+            getSelectedModels().forEach(warmModel);
         } else {
             modelStatus.textContent = 'Select a model';
             modelStatus.className = 'model-status';
@@ -47,6 +57,91 @@ document.addEventListener('DOMContentLoaded', function() {
         validateSendButton();
     });
 
+    // Compare mode: the selector accepts several models that answer the same message
+    compareToggle.addEventListener('change', function() {
+        modelSelect.multiple = this.checked;
+        if (this.checked) {
+            modelSelect.size = Math.min(Math.max(modelSelect.options.length - 1, 2), 5);
+        } else {
+            modelSelect.removeAttribute('size');
+            Array.from(modelSelect.options).forEach(option => {
+                option.selected = option.value === selectedModel;
+            });
+        }
+        validateSendButton();
+    });
+
+    // Models that will answer the next message
+    function getSelectedModels() {
+        if (compareToggle.checked) {
+            return Array.from(modelSelect.selectedOptions).map(option => option.value).filter(Boolean);
+        }
+        return selectedModel ? [selectedModel] : [];
+    }
+
+    // Starts loading the model in LM Studio and shows its state
+    function warmModel(modelId) {
+        if (modelId !== selectedModel) {
+            // Other compared models are only preloaded, the status shows the first one
+            fetch('/models/warmup', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ model: modelId })
+            }).catch(error => console.error('Model warm-up error:', error));
+            return;
+        }
+        clearTimeout(warmupTimer);
+        fetch('/models/warmup', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ model: modelId })
+        })
+        .then(response => response.ok ? response.json() : null)
+        .then(data => {
+            if (data && data.model === selectedModel) {
+                showModelState(data.model, data.state);
+            }
+        })
+        .catch(error => console.error('Model warm-up error:', error));
+    }
+
+    // Polls the load state until the model is loaded or the load fails
+    function pollModelState(modelId) {
+        clearTimeout(warmupTimer);
+        warmupTimer = setTimeout(() => {
+            fetch(`/models/status?model=${encodeURIComponent(modelId)}`)
+                .then(response => response.ok ? response.json() : null)
+                .then(data => {
+                    if (data && data[modelId] && modelId === selectedModel) {
+                        showModelState(modelId, data[modelId].state);
+                    }
+                })
+                .catch(error => console.error('Model status error:', error));
+        }, WARMUP_POLL_INTERVAL);
+    }
+
+    // Shows the load state of the selected model next to the selector
+    function showModelState(modelId, state) {
+        const option = Array.from(modelSelect.options).find(o => o.value === modelId);
+        if (state === 'loaded') {
+            modelStatus.textContent = 'Loaded';
+            modelStatus.className = 'model-status available';
+            if (option) option.textContent = modelId;
+        } else if (state === 'loading') {
+            modelStatus.textContent = 'Loading model...';
+            modelStatus.className = 'model-status loading';
+            pollModelState(modelId);
+        } else if (state === 'unloaded') {
+            modelStatus.textContent = 'Not loaded';
+            modelStatus.className = 'model-status loading';
+        } else if (state === 'error') {
+            modelStatus.textContent = 'Model failed to load';
+            modelStatus.className = 'model-status unavailable';
+        }
+    }
+
     // Creating new chat
     newChatBtn.addEventListener('click', function() {
         fetch('/create_chat', {
@@ -110,14 +205,15 @@ document.addEventListener('DOMContentLoaded', function() {
 
 			const chatId = chatIdInput.value;
 			const message = messageInput.value.trim();
+			const models = getSelectedModels();
 
-			if (!chatId || !message || !selectedModel) {
+			if (!chatId || !message || models.length === 0) {
 				console.warn("Not enough data to send a message");
 				return;
 			}
 
-			console.log("Sending a message:", message, "to chat:", chatId, "with model:", selectedModel);
-			sendMessage(chatId, message, selectedModel);
+			console.log("Sending a message:", message, "to chat:", chatId, "with models:", models);
+			sendMessage(chatId, message, models);
 		});
 	}
     
@@ -130,10 +226,55 @@ document.addEventListener('DOMContentLoaded', function() {
                 sendButton.disabled = true;
             }
         }
+        if (regenerateButton) {
+            // Only a finished answer to an existing message can be regenerated
+            regenerateButton.disabled = isGenerating || !selectedModel || !chatIdInput.value
+                || !messagesContainer.querySelector('.user-message');
+        }
+    }
+
+    // Regenerating the last answer: the server removes it and the new one bypasses the response cache
+    if (regenerateButton) {
+        regenerateButton.addEventListener('click', function() {
+            const chatId = chatIdInput.value;
+            const models = getSelectedModels();
+            if (isGenerating || !chatId || models.length === 0) {
+                return;
+            }
+            regenerateButton.disabled = true;
+            fetch('/regenerate', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ chat_id: chatId })
+            })
+            .then(response => response.json())
+            .then(data => {
+                if (!data.success) {
+                    console.warn('Regenerate rejected:', data.error);
+                    validateSendButton();
+                    return;
+                }
+                // Remove the old answers that follow the last user message
+                const userMessages = messagesContainer.querySelectorAll('.user-message');
+                let next = userMessages[userMessages.length - 1].nextElementSibling;
+                while (next) {
+                    const current = next;
+                    next = next.nextElementSibling;
+                    if (current.classList.contains('assistant-message')) {
+                        current.remove();
+                    }
+                }
+                getAssistantResponse(chatId, models, true);
+            })
+            .catch(error => {
+                console.error('Error:', error);
+                validateSendButton();
+            });
+        });
     }
     
-    // Message sending function
-    function sendMessage(chatId, message, model) {
+    // Message sending function (several models answer at once in compare mode)
+    function sendMessage(chatId, message, models) {
         addMessageToUI('user', message);
         
         messageInput.value = '';
@@ -148,7 +289,7 @@ document.addEventListener('DOMContentLoaded', function() {
 		fetch('/send_message', {
 			method: 'POST',
 			headers: { 'Content-Type': 'application/json' },
-			body: JSON.stringify({ chat_id: chatId, content: message, model: model })
+			body: JSON.stringify({ chat_id: chatId, content: message, model: models[0] })
 		})
 		.then(response => response.json())
 		.then(data => {
@@ -157,7 +298,9 @@ document.addEventListener('DOMContentLoaded', function() {
 				if (data.updated_chat_title) {
 					updateChatTitleInList(chatId, data.updated_chat_title);
 				}
-				getAssistantResponse(chatId, model);
+				// The title is generated in the background and arrives over the response stream
+				titlePending = !!data.title_pending;
+				getAssistantResponse(chatId, models);
 			}
 		})
 		.catch(error => {
@@ -189,55 +332,287 @@ document.addEventListener('DOMContentLoaded', function() {
 		return text;
 	}
     
-	function updateChatList() {
-		fetch('/get_chats')
-			.then(response => response.json())
+	// Sidebar pagination state (keyset cursor for the next page)
+	let chatsCursor = null;
+	let chatsLoading = false;
+
+	function renderChatItem(chat) {
+		const chatLink = document.createElement('a');
+		chatLink.href = `/chat/${chat.id}`;
+		chatLink.className = `chat-item ${currentChatId == chat.id ? 'active' : ''}`;
+		chatLink.innerHTML = `
+			<span class="chat-title">${chat.title}</span>
+			<span class="chat-delete" data-chat-id="${chat.id}">✖</span>
+		`;
+
+		const deleteButton = chatLink.querySelector('.chat-delete');
+		deleteButton.addEventListener('click', function(e) {
+			e.preventDefault();
+			e.stopPropagation();
+			const chatId = this.getAttribute('data-chat-id');
+			if (confirm('Are you sure you want to delete this chat?')) {
+				fetch(`/delete_chat/${chatId}`, {
+					method: 'POST',
+					headers: {
+						'Content-Type': 'application/json',
+					}
+				})
+				.then(response => response.json())
+				.then(data => {
+					if (data.success) {
+						updateChatList();
+						if (currentChatId == chatId) {
+							window.location.href = '/chat';
+						}
+					}
+				})
+				.catch(error => console.error('Error:', error));
+			}
+		});
+		return chatLink;
+	}
+
+	// Loads a page of chats; without a cursor the list is replaced with the first page
+	function loadChats(before) {
+		const url = before ? `/get_chats?before=${before}` : '/get_chats';
+		chatsLoading = true;
+		return fetch(url)
+			.then(response => {
+				chatsCursor = response.headers.get('X-Next-Cursor');
+				return response.json();
+			})
 			.then(chats => {
 				const chatList = document.querySelector('.chats-list');
-				chatList.innerHTML = '';
-				chats.forEach(chat => {
-					const chatLink = document.createElement('a');
-					chatLink.href = `/chat/${chat.id}`;
-					chatLink.className = `chat-item ${currentChatId == chat.id ? 'active' : ''}`;
-					chatLink.innerHTML = `
-						<span class="chat-title">${chat.title}</span>
-						<span class="chat-delete" data-chat-id="${chat.id}">✖</span>
-					`;
-					chatList.appendChild(chatLink);
-
-					const deleteButton = chatLink.querySelector('.chat-delete');
-					deleteButton.addEventListener('click', function(e) {
-						e.preventDefault();
-						e.stopPropagation();
-						const chatId = this.getAttribute('data-chat-id');
-						if (confirm('Are you sure you want to delete this chat?')) {
-							fetch(`/delete_chat/${chatId}`, {
-								method: 'POST',
-								headers: {
-									'Content-Type': 'application/json',
-								}
-							})
-							.then(response => response.json())
-							.then(data => {
-								if (data.success) {
-									updateChatList();
-									if (currentChatId == chatId) {
-										window.location.href = '/chat';
-									}
-								}
-							})
-							.catch(error => console.error('Error:', error));
-						}
-					});
-				});
+				if (!before) {
+					chatList.innerHTML = '';
+				}
+				chats.forEach(chat => chatList.appendChild(renderChatItem(chat)));
 			})
-			.catch(error => console.error('Error:', error));
+			.catch(error => console.error('Error:', error))
+			.finally(() => { chatsLoading = false; });
+	}
+
+	function updateChatList() {
+		return loadChats(null);
+	}
+
+	// Full-text search state (offset of the next result page)
+	const chatSearch = document.getElementById('chat-search');
+	let searchQuery = '';
+	let searchCursor = null;
+	let searchTimer = null;
+
+	function escapeHtml(text) {
+		const div = document.createElement('div');
+		div.textContent = text;
+		return div.innerHTML;
+	}
+
+	function renderSearchResult(result) {
+		const resultLink = document.createElement('a');
+		resultLink.href = `/chat/${result.chat_id}`;
+		resultLink.className = 'search-result';
+		// The snippet is escaped on the server, only <mark> tags are added
+		resultLink.innerHTML = `
+			<span class="chat-title">${escapeHtml(result.chat_title)}</span>
+			<span class="search-snippet">${result.snippet}</span>
+		`;
+		return resultLink;
+	}
+
+	// Loads a page of search results; without an offset the list is replaced
+	function loadSearchResults(offset) {
+		const query = searchQuery;
+		const url = `/search?q=${encodeURIComponent(query)}` + (offset ? `&offset=${offset}` : '');
+		chatsLoading = true;
+		return fetch(url)
+			.then(response => {
+				if (query === searchQuery) {
+					searchCursor = response.headers.get('X-Next-Cursor');
+				}
+				return response.json();
+			})
+			.then(results => {
+				// Ignore responses for an outdated query
+				if (query !== searchQuery) {
+					return;
+				}
+				const chatList = document.querySelector('.chats-list');
+				if (!offset) {
+					chatList.innerHTML = '';
+					if (!results.length) {
+						chatList.innerHTML = '<div class="search-empty">No results</div>';
+					}
+				}
+				results.forEach(result => chatList.appendChild(renderSearchResult(result)));
+			})
+			.catch(error => console.error('Error:', error))
+			.finally(() => { chatsLoading = false; });
+	}
+
+	if (chatSearch) {
+		chatSearch.addEventListener('input', function() {
+			clearTimeout(searchTimer);
+			searchTimer = setTimeout(() => {
+				searchQuery = this.value.trim();
+				searchCursor = null;
+				if (searchQuery) {
+					loadSearchResults(null);
+				} else {
+					updateChatList();
+				}
+			}, 250);
+		});
+	}
+
+	// Importing chats from an export file (streamed to the server as is)
+	const importFile = document.getElementById('import-file');
+	if (importFile) {
+		importFile.addEventListener('change', function() {
+			if (!this.files.length) {
+				return;
+			}
+			const formData = new FormData();
+			formData.append('file', this.files[0]);
+			fetch('/import', {
+				method: 'POST',
+				body: formData
+			})
+			.then(response => response.json())
+			.then(data => {
+				if (data.success) {
+					alert(`Imported ${data.chats} chats and ${data.messages} messages`);
+					updateChatList();
+				} else {
+					alert(data.error || 'Import failed');
+				}
+			})
+			.catch(error => console.error('Error:', error))
+			.finally(() => { this.value = ''; });
+		});
+	}
+
+	// Loading the next page of chats (or search results) when the sidebar is scrolled to the bottom
+	const chatsList = document.querySelector('.chats-list');
+	if (chatsList) {
+		chatsList.addEventListener('scroll', function() {
+			if (chatsLoading || this.scrollTop + this.clientHeight < this.scrollHeight - 50) {
+				return;
+			}
+			if (searchQuery) {
+				if (searchCursor) {
+					loadSearchResults(searchCursor);
+				}
+			} else if (chatsCursor) {
+				loadChats(chatsCursor);
+			}
+		});
+	}
+
+	// Older messages are loaded lazily when scrolling to the top of the chat
+	let messagesCursor = messagesContainer.getAttribute('data-next-cursor') || null;
+	let messagesLoading = false;
+
+	function createMessageElement(message) {
+		const messageDiv = document.createElement('div');
+		messageDiv.className = `message ${message.role === 'user' ? 'user' : 'assistant'}-message`;
+		messageDiv.setAttribute('data-message-id', message.id);
+		messageDiv.setAttribute('data-model', message.model || '');
+
+		const avatarDiv = document.createElement('div');
+		avatarDiv.className = 'message-avatar';
+		const avatarEl = document.createElement('div');
+		avatarEl.className = message.role === 'user' ? 'user-avatar' : 'assistant-avatar';
+		avatarEl.textContent = message.role === 'user' ? 'U' : 'A';
+		avatarDiv.appendChild(avatarEl);
+
+		const contentDiv = document.createElement('div');
+		contentDiv.className = 'message-content';
+		const textDiv = document.createElement('div');
+		textDiv.className = message.status === 'streaming' ? 'message-text generating' : 'message-text';
+		textDiv.innerHTML = message.content;
+		contentDiv.appendChild(textDiv);
+
+		if (message.role === 'assistant' && message.model) {
+			const infoDiv = document.createElement('div');
+			infoDiv.className = 'message-info';
+			infoDiv.textContent = `Model: ${message.model}`;
+			contentDiv.appendChild(infoDiv);
+		}
+
+		messageDiv.appendChild(avatarDiv);
+		messageDiv.appendChild(contentDiv);
+		return messageDiv;
+	}
+
+	function loadOlderMessages() {
+		const chatId = chatIdInput.value;
+		if (messagesLoading || !messagesCursor || !chatId) {
+			return;
+		}
+		messagesLoading = true;
+		fetch(`/chat/${chatId}/messages?before=${messagesCursor}`)
+			.then(response => {
+				messagesCursor = response.headers.get('X-Next-Cursor');
+				return response.json();
+			})
+			.then(messages => {
+				// Keeping the scroll position while prepending older messages
+				const previousHeight = messagesContainer.scrollHeight;
+				const fragment = document.createDocumentFragment();
+				messages.forEach(message => fragment.appendChild(createMessageElement(message)));
+				messagesContainer.insertBefore(fragment, messagesContainer.firstChild);
+				messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+			})
+			.catch(error => console.error('Error:', error))
+			.finally(() => { messagesLoading = false; });
+	}
+
+	messagesContainer.addEventListener('scroll', function() {
+		if (this.scrollTop < 100) {
+			loadOlderMessages();
+		}
+	});
+	messagesContainer.scrollTop = messagesContainer.scrollHeight;
+
+	// Attaching to a generation that is still running (page reload or a second tab)
+	const streamingTexts = Array.from(messagesContainer.querySelectorAll('.assistant-message .message-text.generating'));
+	const streamingText = streamingTexts[streamingTexts.length - 1];
+	if (streamingText && chatIdInput.value) {
+		let lanes = null;
+		if (streamingTexts.length > 1) {
+			// A compare generation - every model streams into its own message
+			lanes = {};
+			streamingTexts.forEach(div => {
+				lanes[div.closest('.assistant-message').getAttribute('data-model')] = div;
+				div.innerHTML = '';
+			});
+		}
+		streamingText.id = 'current-response';
+		streamingText.innerHTML = '';
+		openResponseStream(`/get_response?chat_id=${chatIdInput.value}&attach=1`, chatIdInput.value, streamingText, lanes);
 	}
 	
 	updateChatList();
 	
-    // The function of receiving the assistant's response
-    function getAssistantResponse(chatId, model) {
+    // The function of receiving the assistant's response; in compare mode every model gets its own message
+    // fresh: the server must not answer from its response cache (regenerate)
+    function getAssistantResponse(chatId, models, fresh) {
+        const textDivs = models.map(createResponseMessage);
+        textDivs[0].id = 'current-response';
+        let lanes = null;
+        if (models.length > 1) {
+            lanes = {};
+            models.forEach((model, index) => { lanes[model] = textDivs[index]; });
+        }
+        messagesContainer.scrollTop = messagesContainer.scrollHeight;
+
+        const query = models.map(model => `model=${encodeURIComponent(model)}`).join('&') + (fresh ? '&fresh=1' : '');
+        openResponseStream(`/get_response?chat_id=${chatId}&${query}`, chatId, textDivs[0], lanes);
+    }
+
+    // Adds an empty assistant message for a streamed response
+    function createResponseMessage(model) {
         const assistantMsgDiv = document.createElement('div');
         assistantMsgDiv.className = 'message assistant-message';
         
@@ -253,9 +628,10 @@ document.addEventListener('DOMContentLoaded', function() {
         const contentDiv = document.createElement('div');
         contentDiv.className = 'message-content';
         
+        assistantMsgDiv.setAttribute('data-model', model);
+        
         const textDiv = document.createElement('div');
         textDiv.className = 'message-text generating';
-        textDiv.id = 'current-response';
         textDiv.textContent = '';
         
         const infoDiv = document.createElement('div');
@@ -269,35 +645,116 @@ document.addEventListener('DOMContentLoaded', function() {
         assistantMsgDiv.appendChild(contentDiv);
         
         messagesContainer.appendChild(assistantMsgDiv);
-        messagesContainer.scrollTop = messagesContainer.scrollHeight;
-        
+        return textDiv;
+    }
+
+    // Opens the response stream; the server replays missed events after a reconnect (Last-Event-ID)
+    // In compare mode the events carry the model they belong to and go to that model's message
+    function openResponseStream(url, chatId, textDiv, lanes) {
         isGenerating = true;
-        
-        eventSource = new EventSource(`/get_response?chat_id=${chatId}&model=${model}`);
-        
+        responseLanes = lanes || null;
+        sendButton.textContent = 'Stop';
+        sendButton.classList.add('stop-button');
+        sendButton.disabled = false;
+        if (regenerateButton) {
+            regenerateButton.disabled = true;
+        }
+
+        eventSource = new EventSource(url);
+
         eventSource.onmessage = function(event) {
 			try {
 				const data = JSON.parse(event.data);
+				const laneDiv = data.model && lanes ? lanes[data.model] : null;
+				const target = laneDiv || textDiv;
 
 				if (data.error) {
 					console.error('Server error:', data.error);
-					textDiv.innerHTML += `<br><span style="color: red;">Error: ${data.error}</span>`;
+					target.innerHTML += `<br><span style="color: red;">Error: ${data.error}</span>`;
+					if (laneDiv) {
+						// Only this model failed - the others keep streaming
+						laneDiv.classList.remove('generating');
+						return;
+					}
 					completeGeneration();
 					return;
 				}
 
+				if (data.queue) {
+					// The model is busy - show the position in the generation queue
+					target.innerHTML = `<span class="queue-status">Waiting in queue (position ${data.queue.position} of ${data.queue.depth})...</span>`;
+					return;
+				}
+
+				if (data.model_loading) {
+					// LM Studio loads the model before answering - this can take a while
+					target.innerHTML = `<span class="queue-status model-loading">Loading model ${data.model_loading.model}, the answer will start once it is loaded...</span>`;
+					return;
+				}
+				// The message ID arrives before the model has produced anything
+				clearQueueStatus(target, data.message_id !== undefined && data.snapshot === undefined);
+
+				if (data.snapshots) {
+					// Compare mode: content generated before this connection, per model
+					Object.entries(data.snapshots).forEach(([model, snapshot]) => {
+						const div = lanes ? lanes[model] : null;
+						if (div) {
+							if (snapshot.message_id) {
+								div.setAttribute('data-message-id', snapshot.message_id);
+							}
+							div.innerHTML = snapshot.content;
+						}
+					});
+					messagesContainer.scrollTop = messagesContainer.scrollHeight;
+					return;
+				}
+
+				if (data.snapshot !== undefined) {
+					// Content generated before this connection (e.g. opened in another tab)
+					if (data.message_id) {
+						target.setAttribute('data-message-id', data.message_id);
+					}
+					target.innerHTML = data.snapshot;
+					messagesContainer.scrollTop = messagesContainer.scrollHeight;
+					return;
+				}
+
 				if (data.message_id) {
-					textDiv.setAttribute('data-message-id', data.message_id);
+					target.setAttribute('data-message-id', data.message_id);
+					if (data.cached) {
+						// Identical request answered before - replayed from the server cache
+						const info = target.parentElement.querySelector('.message-info');
+						if (info) {
+							info.textContent += ' (cached)';
+						}
+					}
+					return;
+				}
+
+				if (data.title) {
+					titlePending = false;
+					updateChatTitleInList(chatId, data.title);
 					return;
 				}
 
 				if (data.content) {
-					textDiv.innerHTML += data.content;
+					target.innerHTML += data.content;
 					messagesContainer.scrollTop = messagesContainer.scrollHeight;
 				}
 
+				if (data.done && laneDiv) {
+					// One of the compared models has finished
+					laneDiv.classList.remove('generating');
+					return;
+				}
+
 				if (data.done) {
 					completeGeneration();
+					if (titlePending) {
+						// The title was finished by another worker - take it from the chat list
+						titlePending = false;
+						updateChatList();
+					}
 				}
 
 			} catch (e) {
@@ -309,6 +766,11 @@ document.addEventListener('DOMContentLoaded', function() {
         
         // EventSource error handling
 		eventSource.onerror = function(error) {
+			if (eventSource && eventSource.readyState === EventSource.CONNECTING) {
+				// The browser reconnects by itself and the server resumes the stream
+				console.warn('EventSource reconnecting');
+				return;
+			}
 			console.error('EventSource error:', error);
 			const currentResponse = document.getElementById('current-response');
 			if (currentResponse) {
@@ -318,6 +780,14 @@ document.addEventListener('DOMContentLoaded', function() {
 		};
     }
     
+    // Removes the queue position notice once the generation has started
+    function clearQueueStatus(textDiv, keepModelLoading) {
+        const queueStatus = textDiv.querySelector('.queue-status');
+        if (queueStatus && !(keepModelLoading && queueStatus.classList.contains('model-loading'))) {
+            queueStatus.remove();
+        }
+    }
+
     // Generation completion function
     function completeGeneration() {
         if (eventSource) {
@@ -331,6 +801,10 @@ document.addEventListener('DOMContentLoaded', function() {
             currentResponse.classList.remove('generating');
             currentResponse.removeAttribute('id');
         }
+        if (responseLanes) {
+            Object.values(responseLanes).forEach(div => div.classList.remove('generating'));
+            responseLanes = null;
+        }
         
         sendButton.textContent = 'Send';
         sendButton.classList.remove('stop-button');
@@ -359,12 +833,18 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         isGenerating = false;
+        const stopped = responseLanes ? Object.values(responseLanes) : [document.getElementById('current-response')];
+        stopped.forEach(div => {
+            if (div && div.classList.contains('generating')) {
+                div.classList.remove('generating');
+                div.innerHTML += '<span style="color: #5f6368; font-style: italic;"> [Generation stopped]</span>';
+            }
+        });
         const currentResponse = document.getElementById('current-response');
         if (currentResponse) {
-            currentResponse.classList.remove('generating');
-            currentResponse.innerHTML += '<span style="color: #5f6368; font-style: italic;"> [Generation stopped]</span>';
             currentResponse.removeAttribute('id');
         }
+        responseLanes = null;
 
         sendButton.textContent = 'Send';
         sendButton.classList.remove('stop-button');
@@ -423,8 +903,17 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
     // Check the availability of all models when loading the page
+    let modelsStale = false;
     fetch('/models')
-        .then(response => response.json())
+        .then(response => {
+            // The model list is served from a cache; stale data is marked by the server
+            modelsStale = response.headers.get('X-Models-Stale') === 'true';
+            const refreshedAt = response.headers.get('X-Models-Refreshed-At');
+            if (refreshedAt) {
+                modelStatus.title = `Model list updated: ${new Date(refreshedAt).toLocaleString()}`;
+            }
+            return response.json();
+        })
 		.then(models => {
 			modelSelect.innerHTML = '<option value="">Select a model</option>';
 			
@@ -439,12 +928,19 @@ document.addEventListener('DOMContentLoaded', function() {
 				models.forEach(model => {
 					const option = document.createElement('option');
 					option.value = model.id;
-					option.textContent = model.id;
+					option.textContent = model.loaded === false ? `${model.id} (not loaded)` : model.id;
 					if (model.id === selectedModel) option.selected = true;
 					modelSelect.appendChild(option);
 				});
 				
 				modelStatus.textContent = selectedModel ? 'Aviable' : 'Select a model';
+				if (modelsStale) {
+					modelStatus.textContent += ' (list may be outdated)';
+				}
+				if (selectedModel) {
+					// Preload the remembered model so the first answer does not wait for it
+					warmModel(selectedModel);
+				}
 			} else {
                 modelStatus.textContent = 'There are no available models';
                 modelStatus.className = 'model-status unavailable';
@@ -0,0 +1,14 @@
+"""
+Kopīgie pytest iestatījumi
+
+Aplikācijas modulis importējot piemēro migrācijas savai datubāzei, tāpēc testu laikā
+tā tiek novirzīta uz pagaidu failu, nevis instance/chatbot.db
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_database_dir = tempfile.mkdtemp(prefix='chatbot-tests-')
+os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(_database_dir, 'chatbot.db')}")
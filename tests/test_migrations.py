@@ -0,0 +1,114 @@
+"""
+Datubāzes migrāciju un biežāko vaicājumu izpildes plānu regresijas testi
+"""
+import sqlite3
+
+import pytest
+from flask import Flask
+
+from app import db, Chat, Message, User, MIGRATIONS, migrate_database, hot_query_plans
+
+# Sākotnējā (versija 0) shēma, kādu to izveidoja pirmā aplikācijas versija ar create_all()
+BASELINE_SCHEMA = [
+    "CREATE TABLE user (id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password VARCHAR(200) NOT NULL, "
+    "registration_ip VARCHAR(45) NOT NULL, registration_date DATETIME, PRIMARY KEY (id), UNIQUE (username))",
+    "CREATE TABLE login_log (id INTEGER NOT NULL, user_id INTEGER NOT NULL, login_time DATETIME, "
+    "ip_address VARCHAR(45) NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))",
+    "CREATE TABLE chat (id INTEGER NOT NULL, user_id INTEGER NOT NULL, title VARCHAR(100) NOT NULL, "
+    "created_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))",
+    "CREATE TABLE message (id INTEGER NOT NULL, chat_id INTEGER NOT NULL, role VARCHAR(10) NOT NULL, "
+    "content TEXT NOT NULL, timestamp DATETIME, model VARCHAR(100), PRIMARY KEY (id), "
+    "FOREIGN KEY(chat_id) REFERENCES chat (id))",
+]
+
+HOT_INDEXES = {'ix_message_chat_id_timestamp', 'ix_chat_user_id_created_at', 'ix_user_registration_ip'}
+
+
+@pytest.fixture
+def database_path(tmp_path):
+    return tmp_path / 'chatbot.db'
+
+
+@pytest.fixture
+def database(database_path):
+    """
+    Atsevišķa Flask aplikācija ar pagaidu datubāzi (modeļi un db paplašinājums ir kopīgi)
+    """
+    test_app = Flask(__name__)
+    test_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{database_path}"
+    db.init_app(test_app)
+    with test_app.app_context():
+        yield
+        db.session.remove()
+        db.engine.dispose()
+
+
+def user_version(database_path):
+    connection = sqlite3.connect(database_path)
+    try:
+        return connection.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def index_names(database_path):
+    connection = sqlite3.connect(database_path)
+    try:
+        return {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        connection.close()
+
+
+def assert_hot_queries_use_indexes():
+    plans = hot_query_plans()
+    assert {index_name for _, index_name, _ in plans} == HOT_INDEXES
+    for description, index_name, plan in plans:
+        assert any(index_name in step for step in plan), (description, plan)
+        assert not any('TEMP B-TREE' in step for step in plan), (description, plan)
+
+
+def test_new_database_uses_indexes(database, database_path):
+    migrate_database()
+
+    assert user_version(database_path) == MIGRATIONS[-1][0]
+    assert HOT_INDEXES <= index_names(database_path)
+    assert_hot_queries_use_indexes()
+
+
+def test_baseline_database_is_upgraded(database, database_path):
+    # Pietiekami daudz datu, lai ANALYZE statistika neliktu plānotājam izvēlēties pilnu tabulas skenēšanu
+    connection = sqlite3.connect(database_path)
+    for statement in BASELINE_SCHEMA:
+        connection.execute(statement)
+    connection.executemany("INSERT INTO user (id, username, password, registration_ip) VALUES (?, ?, 'x', ?)",
+                           [(number, f'lietotajs{number}', f'10.0.{number // 256}.{number % 256}')
+                            for number in range(1, 501)])
+    connection.executemany("INSERT INTO chat (id, user_id, title) VALUES (?, ?, 'Vecs čats')",
+                           [(number, number % 500 + 1) for number in range(1, 2001)])
+    connection.executemany("INSERT INTO message (id, chat_id, role, content) VALUES (?, ?, 'assistant', 'Sveiki')",
+                           [(number, number % 2000 + 1) for number in range(1, 20001)])
+    connection.commit()
+    connection.close()
+    assert user_version(database_path) == 0
+
+    migrate_database()
+
+    assert user_version(database_path) == MIGRATIONS[-1][0]
+    assert HOT_INDEXES <= index_names(database_path)
+    assert db.session.get(Message, 1).status == 'complete'
+    assert db.session.get(Chat, 1).archived_at is None
+    assert_hot_queries_use_indexes()
+
+    # Atkārtota palaišana neko nemaina
+    migrate_database()
+    assert user_version(database_path) == MIGRATIONS[-1][0]
+
+
+def test_sessions_can_roll_back_after_migration(database):
+    migrate_database()
+
+    db.session.add(User(username='janis', password='x', registration_ip='127.0.0.1'))
+    db.session.flush()
+    db.session.rollback()
+
+    assert User.query.count() == 0